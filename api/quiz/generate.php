@@ -81,10 +81,13 @@ $generate = function($request) {
     // Try to parse JSON output
     $result = json_decode($output, true);
 
-    if ($result && isset($result['status']) && $result['status'] === 'success') {
+    // "partial" means some questions failed validation, the rest were saved
+    if ($result && isset($result['status']) && in_array($result['status'], ['success', 'partial'], true)) {
         return [
             'success' => true,
-            'message' => 'Questions generated successfully',
+            'message' => $result['status'] === 'partial'
+                ? 'Some questions generated successfully'
+                : 'Questions generated successfully',
             'topic' => $result['topic'] ?? $topic,
             'difficulty' => $result['difficulty'] ?? $difficulty,
             'generated' => $result['generated'] ?? 0,
@@ -92,6 +95,15 @@ $generate = function($request) {
         ];
     }
 
+    if ($result && isset($result['status']) && $result['status'] === 'error') {
+        return [
+            'success' => false,
+            'message' => $result['message'] ?? 'Question generation failed',
+            'topic' => $topic,
+            'difficulty' => $difficulty
+        ];
+    }
+
     // If JSON parsing failed, still report success if we got output
     return [
         'success' => true,
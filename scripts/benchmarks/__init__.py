@@ -0,0 +1,9 @@
+"""
+Benchmarks for the quiz generator hot paths
+Runs offline: the agent is replaced by a fake with configurable latency,
+MongoDB by mongomock (or any server given with --mongo-uri) and file
+storage by a temporary directory.
+
+Usage (from the scripts directory):
+    python -m benchmarks --sizes 1000 10000 100000 --output bench.json
+"""
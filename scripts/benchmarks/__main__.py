@@ -0,0 +1,225 @@
+"""
+Benchmark CLI: python -m benchmarks [options]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quiz_generator as qg  # noqa: E402
+from benchmarks.fakes import FakeRunner, synthetic_question, write_file_corpus, write_mongo_corpus, write_sqlite_corpus  # noqa: E402
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted samples"""
+    index = min(len(samples) - 1, max(0, round(pct / 100 * len(samples)) - 1))
+    return samples[index]
+
+
+def measure(name: str, call, iterations: int, loop: asyncio.AbstractEventLoop) -> dict:
+    """Time `call` over `iterations` runs, then measure peak memory of one more run"""
+    def run_once():
+        result = call()
+        if asyncio.iscoroutine(result):
+            result = loop.run_until_complete(result)
+        return result
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        run_once()
+        latencies.append((time.perf_counter() - t) * 1000)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    run_once()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "operation": name,
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p90_ms": round(percentile(latencies, 90), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "ops_per_sec": round(iterations / elapsed, 2) if elapsed else None,
+        "peak_memory_kb": round(peak / 1024, 1)
+    }
+
+
+def reset_state():
+    """Drop module-level caches so each backend starts cold"""
+    qg._question_catalogue = None
+    qg._sqlite_store = None
+
+
+def batch(size: int = 10) -> list[dict]:
+    return [synthetic_question(time.perf_counter_ns() + i) for i in range(size)]
+
+
+def bench_file(size: int, iterations: int, loop) -> list[dict]:
+    directory = tempfile.mkdtemp(prefix="quiz-bench-")
+    try:
+        qg.QUESTIONS_DIR = directory
+        qg.STORAGE_BACKEND = "file"
+        qg.USE_FILE_STORAGE = True
+        reset_state()
+        write_file_corpus(directory, size)
+
+        results = [
+            measure("get_stats", qg.get_stats, iterations, loop),
+            measure("generate_for_quiz_session", lambda: qg.generate_for_quiz_session(age=11, count=10), iterations, loop),
+            measure("save_questions_to_db", lambda: qg.save_questions_to_db(batch()), iterations, loop),
+            measure("save_questions_to_file", lambda: qg.save_questions_to_file(batch()), iterations, loop),
+            measure("load_questions_from_file", qg.load_questions_from_file, max(1, min(iterations, 5)), loop),
+        ]
+        for r in results:
+            r.update(backend="file", corpus_size=size)
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_sqlite(size: int, iterations: int, loop) -> list[dict]:
+    directory = tempfile.mkdtemp(prefix="quiz-bench-")
+    try:
+        qg.QUESTIONS_DIR = directory
+        qg.STORAGE_BACKEND = "sqlite"
+        qg.USE_FILE_STORAGE = False
+        reset_state()
+        write_sqlite_corpus(qg.get_sqlite_store(), size)
+
+        results = [
+            measure("get_stats", qg.get_stats, iterations, loop),
+            measure("generate_for_quiz_session", lambda: qg.generate_for_quiz_session(age=11, count=10), iterations, loop),
+            measure("save_questions_to_db", lambda: qg.save_questions_to_db(batch()), iterations, loop),
+        ]
+        for r in results:
+            r.update(backend="sqlite", corpus_size=size)
+        return results
+    finally:
+        reset_state()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_mongo(size: int, iterations: int, loop, mongo_uri: str = None) -> list[dict]:
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+
+    qg._mongo_client = client
+    qg.AsyncMongoClient = None  # Route async paths through the shared sync client
+    qg.STORAGE_BACKEND = "mongodb"
+    qg.USE_FILE_STORAGE = False
+    reset_state()
+    write_mongo_corpus(client[qg.DB_NAME], size)
+
+    results = [
+        measure("get_stats", qg.get_stats, iterations, loop),
+        measure("generate_for_quiz_session", lambda: qg.generate_for_quiz_session(age=11, count=10), iterations, loop),
+        measure("save_questions_to_db", lambda: qg.save_questions_to_db(batch()), iterations, loop),
+    ]
+    for r in results:
+        r.update(backend="mongodb" if mongo_uri else "mongomock", corpus_size=size)
+
+    client[qg.DB_NAME].questions.drop()
+    return results
+
+
+def bench_cold_quiz(iterations: int, loop) -> list[dict]:
+    """Quiz session with an empty pool, so every call goes through fake generation"""
+    directory = tempfile.mkdtemp(prefix="quiz-bench-")
+    try:
+        qg.QUESTIONS_DIR = directory
+        qg.STORAGE_BACKEND = "file"
+        qg.USE_FILE_STORAGE = True
+
+        def cold_session():
+            # Empty the pool again, otherwise the previous run's questions serve this one
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+            reset_state()
+            return qg.generate_for_quiz_session(age=11, count=10, excluded_ids=[])
+
+        result = measure("generate_for_quiz_session_cold", cold_session, iterations, loop)
+        result.update(backend="file", corpus_size=0)
+        return [result]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the quiz generator hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Synthetic corpus sizes")
+    parser.add_argument("--iterations", type=int, default=50, help="Timed runs per operation")
+    parser.add_argument("--backends", nargs="+", default=["file", "mongomock"], choices=["file", "sqlite", "mongomock", "mongodb"])
+    parser.add_argument("--mongo-uri", help="MongoDB server for the mongodb backend (e.g. a temporary local mongod)")
+    parser.add_argument("--latency-ms", type=float, default=1500, help="Fake agent latency")
+    parser.add_argument("--jitter-ms", type=float, default=300, help="Fake agent latency jitter")
+    parser.add_argument("--cold-iterations", type=int, default=3, help="Runs of the cold-pool quiz session (0 to skip)")
+    parser.add_argument("--dedup", choices=["drop", "flag", "off"], help="Override DEDUP_MODE")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if "mongodb" in args.backends and not args.mongo_uri:
+        parser.error("--mongo-uri is required for the mongodb backend")
+
+    runner = FakeRunner(args.latency_ms, args.jitter_ms)
+    qg.Runner = runner
+    qg.LLM_CACHE_MODE = "off"
+    if args.dedup:
+        qg.DEDUP_MODE = args.dedup
+
+    loop = asyncio.new_event_loop()
+    results = []
+    try:
+        for size in args.sizes:
+            if "file" in args.backends:
+                results.extend(bench_file(size, args.iterations, loop))
+            if "sqlite" in args.backends:
+                results.extend(bench_sqlite(size, args.iterations, loop))
+            if "mongomock" in args.backends:
+                results.extend(bench_mongo(size, args.iterations, loop))
+            if "mongodb" in args.backends:
+                results.extend(bench_mongo(size, args.iterations, loop, args.mongo_uri))
+            print(f"Finished corpus size {size}", file=sys.stderr)
+
+        if args.cold_iterations:
+            results.extend(bench_cold_quiz(args.cold_iterations, loop))
+    finally:
+        loop.close()
+
+    report = {
+        "python": sys.version.split()[0],
+        "fake_latency_ms": args.latency_ms,
+        "agent_calls": runner.calls,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
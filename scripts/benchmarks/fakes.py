@@ -0,0 +1,147 @@
+"""
+Stand-ins for the agent runner and synthetic question corpora
+"""
+
+import asyncio
+import json
+import os
+import random
+from types import SimpleNamespace
+
+import quiz_generator as qg
+
+WORDS = (
+    "river mountain planet rocket temple festival king queen tiger elephant computer password "
+    "ocean desert forest cricket football music dance painting number triangle volcano island "
+    "satellite battery magnet engine bridge castle museum library garden village market"
+).split()
+
+
+def synthetic_question(n: int, topic: str = None, difficulty: str = None) -> dict:
+    """A unique, schema-valid question (the number keeps dedup from rejecting it)"""
+    topic = topic or random.choice(list(qg.TOPICS))
+    difficulty = difficulty or random.choice(list(qg.DIFFICULTY_AGE_BANDS))
+    age_min, age_max = qg.DIFFICULTY_AGE_BANDS[difficulty]
+    words = " ".join(random.choices(WORDS, k=8))
+    return {
+        "question": f"Question {n}: which {words}?",
+        "options": [f"{random.choice(WORDS)} {n}-{i}" for i in range(4)],
+        "correct": random.randrange(4),
+        "explanation": f"Because {' '.join(random.choices(WORDS, k=12))}.",
+        "difficulty": difficulty,
+        "topic": topic,
+        "age_min": age_min,
+        "age_max": age_max
+    }
+
+
+class FakeResult:
+    """Mimics the agents SDK RunResult for structured output"""
+
+    def __init__(self, output, tokens: int = 0):
+        self.final_output = output
+        input_tokens = min(tokens, qg.PROMPT_TOKEN_ESTIMATE)
+        self.context_wrapper = SimpleNamespace(usage=SimpleNamespace(
+            input_tokens=input_tokens,
+            output_tokens=tokens - input_tokens,
+            total_tokens=tokens
+        ))
+
+    def final_output_as(self, cls):
+        return self.final_output
+
+
+class FakeRunner:
+    """Drop-in for agents.Runner returning synthetic questions after a delay"""
+
+    def __init__(self, latency_ms: float = 1500, jitter_ms: float = 300):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = 0
+        self.counter = 10 ** 9
+
+    def delay(self) -> float:
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+    def questions(self, topic: str, difficulty: str, count: int) -> list:
+        questions = []
+        for _ in range(count):
+            self.counter += 1
+            questions.append(qg.QuizQuestion(**synthetic_question(self.counter, topic, difficulty)))
+        return questions
+
+    def batch(self, context):
+        if isinstance(context, qg.BatchContext):
+            return qg.MultiCellBatch(cells=[
+                qg.CellQuestions(cell=f"{topic}:{difficulty}", questions=self.questions(topic, difficulty, count))
+                for topic, difficulty, count in context.cells
+            ])
+        return qg.QuestionBatch(questions=self.questions(context.topic, context.difficulty, context.count))
+
+    async def run(self, agent, input, context=None, **kwargs):
+        self.calls += 1
+        output = self.batch(context)
+        count = sum(c for _, _, c in context.cells) if isinstance(context, qg.BatchContext) else context.count
+        await asyncio.sleep(self.delay())
+        return FakeResult(output, tokens=qg.estimate_tokens(count))
+
+    def run_streamed(self, agent, input, context=None, **kwargs):
+        self.calls += 1
+        return FakeStreamingResult(self.batch(context), self.delay())
+
+
+class FakeStreamingResult(FakeResult):
+    """Mimics RunResultStreaming, spreading the output text over `latency` seconds"""
+
+    def __init__(self, output, latency: float, chunk_size: int = 40):
+        super().__init__(output)
+        self.latency = latency
+        self.chunk_size = chunk_size
+
+    async def stream_events(self):
+        text = self.final_output.model_dump_json()
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield SimpleNamespace(
+                type="raw_response_event",
+                data=SimpleNamespace(type="response.output_text.delta", delta=chunk)
+            )
+
+
+def write_file_corpus(directory: str, size: int):
+    """Write `size` synthetic questions straight to the question log"""
+    import uuid
+
+    with open(os.path.join(directory, qg.QUESTIONS_LOG), 'w') as f:
+        for n in range(size):
+            q = synthetic_question(n)
+            q['_id'] = str(uuid.uuid4())
+            q['created_at'] = "2024-01-01T00:00:00"
+            q['used_count'] = 0
+            qg.stamp_dedup_bands(q)
+            f.write(json.dumps(q) + "\n")
+
+
+def write_mongo_corpus(db, size: int, chunk: int = 10000):
+    """Insert `size` synthetic questions into the questions collection, stamped like real inserts"""
+    db.questions.delete_many({})
+    for start in range(0, size, chunk):
+        batch = [synthetic_question(n) for n in range(start, min(size, start + chunk))]
+        qg.stamp_new_questions(batch)
+        db.questions.insert_many(batch)
+
+
+def write_sqlite_corpus(store, size: int, chunk: int = 10000):
+    """Insert `size` synthetic questions into a SQLite question store"""
+    import uuid
+
+    for start in range(0, size, chunk):
+        batch = [synthetic_question(n) for n in range(start, min(size, start + chunk))]
+        for q in batch:
+            q['_id'] = str(uuid.uuid4())
+            q['created_at'] = "2024-01-01T00:00:00"
+            q['used_count'] = 0
+            q['random_key'] = random.random()
+            q['content_hash'] = qg.content_hash(q)
+        store.insert(batch)
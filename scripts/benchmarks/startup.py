@@ -0,0 +1,117 @@
+"""
+Cold-start regression check: python -m benchmarks.startup [options]
+
+Runs lightweight CLI commands in fresh interpreters under -X importtime and
+fails when one goes over its start-up budget or imports a heavy dependency
+it should not need.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import write_file_corpus  # noqa: E402
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "quiz_generator.py")
+
+# Modules that take seconds to import and are only needed to generate or hit MongoDB
+HEAVY_MODULES = ("agents", "openai", "pydantic", "pymongo", "bson")
+
+# name -> (CLI args, use file storage, import budget ms, wall budget ms)
+STARTUP_BUDGETS = {
+    "topics": (["topics"], False, 250, 750),
+    "stats (file)": (["stats"], True, 250, 750),
+    "quiz (file)": (["quiz", "--age", "11", "--count", "10"], True, 250, 900),
+}
+
+
+def parse_importtime(stderr: str) -> tuple[float, set]:
+    """Total import time (ms) of top-level imports and every module imported"""
+    total_us = 0
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # Nesting is shown by indentation, top-level imports have one space
+        if len(name) - len(name.lstrip()) == 1:
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+
+def run_case(args: list[str], env: dict, runs: int) -> dict:
+    """Median wall and import time of `runs` fresh runs of one command"""
+    walls = []
+    imports = []
+    modules = set()
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", SCRIPT, *args],
+            env=env,
+            capture_output=True,
+            text=True
+        )
+        walls.append((time.perf_counter() - started) * 1000)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(args)} failed: {result.stderr[-500:]}")
+        import_ms, imported = parse_importtime(result.stderr)
+        imports.append(import_ms)
+        modules |= imported
+
+    return {
+        "wall_ms": round(statistics.median(walls), 1),
+        "import_ms": round(statistics.median(imports), 1),
+        "heavy_imports": sorted(m for m in modules if m.split(".")[0] in HEAVY_MODULES and "." not in m)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check CLI cold-start time against its budget")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command (the median is reported)")
+    parser.add_argument("--slack", type=float, default=1.0, help="Multiply every budget by this (slow CI machines)")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {"python": sys.version.split()[0], "commands": {}}
+    failures = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_file_corpus(directory, 1000)
+
+        for name, (cli_args, file_storage, import_budget, wall_budget) in STARTUP_BUDGETS.items():
+            env = {**os.environ, "USE_FILE_STORAGE": "true" if file_storage else "false", "QUESTIONS_DIR": directory}
+            result = run_case(cli_args, env, args.runs)
+            result["import_budget_ms"] = import_budget * args.slack
+            result["wall_budget_ms"] = wall_budget * args.slack
+            report["commands"][name] = result
+
+            if result["import_ms"] > result["import_budget_ms"]:
+                failures.append(f"{name}: imports took {result['import_ms']}ms (budget {result['import_budget_ms']}ms)")
+            if result["wall_ms"] > result["wall_budget_ms"]:
+                failures.append(f"{name}: ran in {result['wall_ms']}ms (budget {result['wall_budget_ms']}ms)")
+            if result["heavy_imports"]:
+                failures.append(f"{name}: imported {', '.join(result['heavy_imports'])}")
+
+    report["failures"] = failures
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    for failure in failures:
+        print(f"Over budget - {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,48 @@ Uses OpenAI Agents SDK to generate age-appropriate quiz questions
 """
 
 import asyncio
+import base64
+import concurrent.futures
+import contextvars
+import functools
+import gzip
+import hashlib
 import json
+import math
 import sys
 import os
 import argparse
-from typing import Optional
+import random
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
 from dataclasses import dataclass
-from pydantic import BaseModel, Field
-from pymongo import MongoClient
 from datetime import datetime
+from types import SimpleNamespace
 from dotenv import load_dotenv
 
-from agents import Agent, Runner, function_tool
+# agents (with the OpenAI client), pydantic and pymongo take seconds to import,
+# so they are imported on the code paths that need them. Commands like
+# `topics` or file-mode `quiz` never load them (see benchmarks/startup.py).
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locking on this platform, rely on the in-process lock only
+    fcntl = None
+
+# agents.Runner, imported on first use (tests and benchmarks may replace it)
+Runner = None
+
+# pymongo.AsyncMongoClient (pymongo 4.10+), looked up on first use; None if unavailable
+_UNRESOLVED = object()
+AsyncMongoClient = _UNRESOLVED
 
 # Load environment variables from .env file
 # Look for .env in parent directory (project root) or current directory
@@ -29,8 +59,152 @@ else:
 # MongoDB connection from environment
 MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/funquiz")
 DB_NAME = os.getenv("MONGODB_DATABASE", "funquiz")
-USE_FILE_STORAGE = os.getenv("USE_FILE_STORAGE", "false").lower() == "true"
-QUESTIONS_FILE = "questions.json"
+# Question store: "mongodb", "file" (append-only JSONL log) or "sqlite" (embedded, WAL mode).
+# USE_FILE_STORAGE=true is the older spelling of STORAGE_BACKEND=file.
+STORAGE_BACKEND = os.getenv(
+    "STORAGE_BACKEND",
+    "file" if os.getenv("USE_FILE_STORAGE", "false").lower() == "true" else "mongodb"
+).lower()
+USE_FILE_STORAGE = STORAGE_BACKEND == "file"
+# Keep a counters document updated on insert so `stats` is a single read
+STATS_COUNTERS = os.getenv("STATS_COUNTERS", "false").lower() == "true"
+STATS_COUNTERS_ID = "question_counters"
+QUESTIONS_FILE = "questions.json"  # Legacy single-array store, read but never rewritten
+QUESTIONS_LOG = "questions.jsonl"  # Append-only store, one question per line
+QUESTIONS_USAGE_LOG = "questions.usage.jsonl"  # used_count increments, one {_id: n} batch per line
+QUESTIONS_DIR = os.getenv("QUESTIONS_DIR", os.path.dirname(os.path.abspath(__file__)))
+SQLITE_FILE = "questions.db"  # SQLite store, in QUESTIONS_DIR unless SQLITE_PATH is set
+SQLITE_PATH = os.getenv("SQLITE_PATH")
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))  # Seconds a writer waits for the lock
+LEADERBOARD_FILE = "leaderboard.json"  # Legacy totals written by api/quiz/submit.php, read but never rewritten
+LEADERBOARD_LOG = "leaderboard.jsonl"  # Append-only score increments, one submission per line
+# The file leaderboard folds its log to one line per player once it holds this many lines
+# and at least twice as many lines as players
+LEADERBOARD_COMPACT_LINES = int(os.getenv("LEADERBOARD_COMPACT_LINES", "10000"))
+# Seconds a cached top-K list is served before it is re-read from MongoDB/SQLite
+# (writes through this process clear it straight away; the file store checks its log instead)
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "2"))
+
+# Connection pool settings shared by the sync and async MongoDB clients
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+    "connectTimeoutMS": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+}
+
+# Age band covered by each difficulty level
+DIFFICULTY_AGE_BANDS = {
+    "easy": (8, 10),
+    "medium": (11, 13),
+    "hard": (14, 16),
+}
+
+# Duplicate handling before insert: "drop", "flag" (keep, marked) or "off"
+DEDUP_MODE = os.getenv("DEDUP_MODE", "drop").lower()
+# Estimated Jaccard similarity of question shingles above which two questions are near-duplicates
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.7"))
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+
+# Per-player seen-question filters: questions remembered per generation and false-positive rate
+SEEN_CAPACITY = int(os.getenv("SEEN_CAPACITY", "5000"))
+SEEN_ERROR_RATE = float(os.getenv("SEEN_ERROR_RATE", "0.01"))
+# Sampling rounds used to top up a quiz after dropping already-seen questions
+SEEN_SAMPLE_ROUNDS = 4
+
+# Live quiz path limits: overall deadline (0 = none), per-call generation timeout,
+# delay before hedging slow generations with more topics, and time kept back for
+# relaxed pool queries once generation has used up the deadline
+QUIZ_DEADLINE_MS = int(os.getenv("QUIZ_DEADLINE_MS", "0"))
+GENERATION_TIMEOUT_MS = int(os.getenv("GENERATION_TIMEOUT_MS", "20000"))
+QUIZ_HEDGE_MS = int(os.getenv("QUIZ_HEDGE_MS", "3000"))
+QUIZ_RELAX_RESERVE_MS = int(os.getenv("QUIZ_RELAX_RESERVE_MS", "100"))
+# Skip live generation for BREAKER_COOLDOWN seconds after BREAKER_FAILURES failed calls in a row
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+# Served question ids are counted in memory and written back in one batch every
+# USAGE_FLUSH_INTERVAL seconds (bulk $inc, SQLite UPDATEs or one usage log line)
+USAGE_TRACKING = os.getenv("USAGE_TRACKING", "true").lower() == "true"
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+# Quiz pool selection: "random" or "least_used" (lowest used_count level first)
+QUIZ_SELECTION = os.getenv("QUIZ_SELECTION", "random").lower()
+LEAST_USED_MAX_LEVELS = 4  # used_count levels tried before topping up at random
+
+# Sample by seeking to random points of the random_key index instead of $match + $sample
+RANDOM_KEY_SAMPLING = os.getenv("RANDOM_KEY_SAMPLING", "true").lower() == "true"
+SAMPLE_SEEK_SIZE = 3  # Questions read per random seek
+
+# Indexes backing random-key sampling on the questions collection
+SAMPLING_INDEXES = {
+    "random_key_age": [("random_key", 1), ("age_min", 1), ("age_max", 1)],
+    "cell_random_key": [("difficulty", 1), ("topic", 1), ("random_key", 1), ("age_min", 1), ("age_max", 1)],
+}
+CONTENT_HASH_INDEX = "content_hash_unique"
+
+# Every index the questions collection should have, as name -> (keys, options).
+# `indexes` creates them and audits the query shapes in audit_query_shapes.
+QUESTION_INDEXES = {
+    **{name: (keys, {}) for name, keys in SAMPLING_INDEXES.items()},
+    # Mixed-topic quizzes: each difficulty in $in is read in random_key order and merged
+    "difficulty_random_key": ([("difficulty", 1), ("random_key", 1), ("age_min", 1), ("age_max", 1)], {}),
+    # Per-topic reads (dedup scans) and per-cell counts
+    "cell": ([("topic", 1), ("difficulty", 1), ("age_min", 1), ("age_max", 1)], {}),
+    # Duplicate checks: stored questions of a topic sharing an LSH band with new ones
+    "topic_dedup_bands": ([("topic", 1), ("dedup_bands", 1)], {}),
+    # Least-used selection: lowest used_count level, then random_key seeks inside it
+    "used_random_key": ([("used_count", 1), ("random_key", 1), ("age_min", 1), ("age_max", 1)], {}),
+    CONTENT_HASH_INDEX: (
+        [("content_hash", 1)],
+        {"unique": True, "partialFilterExpression": {"content_hash": {"$exists": True}}}
+    ),
+}
+# Leaderboard collection: one document per player, ranked by score
+LEADERBOARD_INDEXES = {
+    # Submissions upsert by name, racing first submissions fail on it instead of adding a second player
+    "name_unique": ([("name", 1)], {"unique": True}),
+    # Top-K reads and rank counts
+    "score_name": ([("score", -1), ("name", 1)], {}),
+}
+# Query shapes examining more than this many documents per document returned fail the audit
+AUDIT_MAX_EXAMINED_RATIO = 4
+
+# Inventory watermarks per topic x difficulty cell for the replenish command
+REPLENISH_LOW_WATERMARK = int(os.getenv("REPLENISH_LOW_WATERMARK", "20"))
+REPLENISH_HIGH_WATERMARK = int(os.getenv("REPLENISH_HIGH_WATERMARK", "50"))
+REPLENISH_MAX_USED = int(os.getenv("REPLENISH_MAX_USED", "3"))  # Questions served more often don't count as stock
+
+# Rounds of generation used to replace questions rejected by validation
+VALIDATION_ROUNDS = int(os.getenv("VALIDATION_ROUNDS", "3"))
+
+# Streamed generations save every STREAM_SAVE_BATCH questions as they arrive
+STREAM_SAVE_BATCH = int(os.getenv("STREAM_SAVE_BATCH", "3"))
+
+# LLM response cache: "off", "on" (read and write) or "replay" (cache only, never call the API)
+LLM_CACHE_MODE = os.getenv("LLM_CACHE", "off").lower()
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))  # Seconds, ignored in replay mode
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+# Bump when build_instructions or the prompt changes meaning, so old cache entries stop matching
+PROMPT_VERSION = "1"
+
+# Model used by the generator agents
+GENERATOR_MODEL = os.getenv("GENERATOR_MODEL", "gpt-4.1-mini")
+
+# Rough token cost of one generation call, used by the seed rate limiter
+PROMPT_TOKEN_ESTIMATE = 700
+TOKENS_PER_QUESTION_ESTIMATE = 150
+
+# Multi-cell batched generation for seed and replenish: questions per call start
+# at BATCH_INITIAL_QUESTIONS and adapt to latency, token usage and failures
+BATCH_GENERATION = os.getenv("BATCH_GENERATION", "true").lower() == "true"
+BATCH_INITIAL_QUESTIONS = int(os.getenv("BATCH_INITIAL_QUESTIONS", "20"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "60"))
+BATCH_TARGET_LATENCY = float(os.getenv("BATCH_TARGET_LATENCY", "60"))  # Seconds per call
+BATCH_MAX_TOKENS = int(os.getenv("BATCH_MAX_TOKENS", "12000"))  # Per call
+BATCH_MAX_FAILURE_RATE = float(os.getenv("BATCH_MAX_FAILURE_RATE", "0.25"))
 
 # Topics configuration - must match PHP QuizTopics.php
 TOPICS = {
@@ -316,27 +490,46 @@ def normalize_topic(topic: str) -> str:
     return normalized
 
 
-class QuizQuestion(BaseModel):
-    """Schema for a single quiz question"""
-    question: str = Field(..., description="The quiz question text")
-    options: list[str] = Field(..., description="Exactly 4 answer options", min_length=4, max_length=4)
-    correct: int = Field(..., description="Index of correct answer (0-3)", ge=0, le=3)
-    explanation: str = Field(..., description="Brief explanation of the correct answer")
-    difficulty: str = Field(..., description="Difficulty level: easy, medium, or hard")
-    topic: str = Field(..., description="Topic slug from the predefined list")
-    age_min: int = Field(..., description="Minimum recommended age", ge=8)
-    age_max: int = Field(..., description="Maximum recommended age", le=16)
+@functools.cache
+def question_models() -> SimpleNamespace:
+    """The pydantic output schemas, built on first use"""
+    from pydantic import BaseModel, Field
 
+    class QuizQuestion(BaseModel):
+        """Schema for a single quiz question"""
+        question: str = Field(..., description="The quiz question text")
+        options: list[str] = Field(..., description="Exactly 4 answer options", min_length=4, max_length=4)
+        correct: int = Field(..., description="Index of correct answer (0-3)", ge=0, le=3)
+        explanation: str = Field(..., description="Brief explanation of the correct answer")
+        difficulty: str = Field(..., description="Difficulty level: easy, medium, or hard")
+        topic: str = Field(..., description="Topic slug from the predefined list")
+        age_min: int = Field(..., description="Minimum recommended age", ge=8)
+        age_max: int = Field(..., description="Maximum recommended age", le=16)
 
-class QuestionBatch(BaseModel):
-    """Schema for a batch of questions"""
-    questions: list[QuizQuestion] = Field(..., description="List of generated questions")
+    class QuestionBatch(BaseModel):
+        """Schema for a batch of questions"""
+        questions: list[QuizQuestion] = Field(..., description="List of generated questions")
+
+    class CellQuestions(BaseModel):
+        """Questions generated for one topic x difficulty cell"""
+        cell: str = Field(..., description="Cell id exactly as given, e.g. sports:easy")
+        questions: list[QuizQuestion] = Field(..., description="Questions for this cell")
+
+    class MultiCellBatch(BaseModel):
+        """Schema for questions across several cells, keyed by cell id"""
+        cells: list[CellQuestions] = Field(..., description="One entry per requested cell")
+
+    return SimpleNamespace(
+        QuizQuestion=QuizQuestion,
+        QuestionBatch=QuestionBatch,
+        CellQuestions=CellQuestions,
+        MultiCellBatch=MultiCellBatch
+    )
 
 
 @dataclass
 class GeneratorContext:
     """Context for the quiz generator agent"""
-    db: MongoClient
     topic: str
     difficulty: str
     count: int
@@ -344,427 +537,5337 @@ class GeneratorContext:
     age_max: int
 
 
-def get_db_connection():
-    """Get MongoDB connection"""
-    client = MongoClient(MONGO_URI)
-    return client[DB_NAME]
+@dataclass
+class BatchContext:
+    """Context for the multi-cell generator agent"""
+    cells: list[tuple[str, str, int]]  # (topic, difficulty, count)
 
 
-def load_questions_from_file() -> list[dict]:
-    """Load questions from JSON file"""
-    import os
-    file_path = os.path.join(os.path.dirname(__file__), QUESTIONS_FILE)
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    return []
+# Upper bounds (seconds) of the exported span latency histogram buckets
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
 
 
-def save_questions_to_file(questions: list[dict]) -> int:
-    """Save questions to JSON file"""
-    import os
-    import uuid
-    file_path = os.path.join(os.path.dirname(__file__), QUESTIONS_FILE)
+class MetricsRecord:
+    """Span timings and counters collected during one command or daemon request"""
 
-    existing = load_questions_from_file()
+    def __init__(self, command: str):
+        self.command = command
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
 
-    for q in questions:
-        q['_id'] = str(uuid.uuid4())
-        q['created_at'] = datetime.utcnow().isoformat()
-        q['used_count'] = 0
+    def add_span(self, name: str, seconds: float):
+        entry = self.spans.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] += seconds * 1000
+        entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
 
-    existing.extend(questions)
+    def add(self, name: str, value: float):
+        self.counters[name] = self.counters.get(name, 0) + value
 
-    with open(file_path, 'w') as f:
-        json.dump(existing, f, indent=2, default=str)
+    def to_dict(self) -> dict:
+        return {
+            "command": self.command,
+            "wall_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "spans": {
+                name: {"count": e["count"], "total_ms": round(e["total_ms"], 3), "max_ms": round(e["max_ms"], 3)}
+                for name, e in sorted(self.spans.items())
+            },
+            "counters": dict(sorted(self.counters.items()))
+        }
 
-    return len(questions)
 
+class MetricsRegistry:
+    """Process-wide span histograms and counters for Prometheus/OpenMetrics export"""
 
-def build_instructions(context, agent) -> str:
-    """Build dynamic instructions based on context"""
-    ctx = context.context
-    topic_info = TOPICS.get(ctx.topic, {})
+    def __init__(self, buckets: tuple = METRICS_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}  # span -> [bucket counts..., +Inf count, sum]
+        self.counters = {}
 
-    # List valid topic slugs for the AI
-    valid_topics = ", ".join(TOPICS.keys())
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
 
-    return f"""You are a quiz question generator for Indian Tamil kids aged {ctx.age_min}-{ctx.age_max}.
+    def add(self, name: str, value: float):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
 
-TOPIC: {topic_info.get('name', ctx.topic)}
-TOPIC SLUG: {ctx.topic}
-DESCRIPTION: {topic_info.get('description', '')}
-EXAMPLES: {topic_info.get('examples', '')}
-DIFFICULTY: {ctx.difficulty}
-GENERATE: {ctx.count} questions
+    def render(self, openmetrics: bool = False) -> str:
+        """Prometheus text exposition, or OpenMetrics text with openmetrics=True"""
+        lines = [
+            "# HELP quiz_generator_span_seconds Time spent in instrumented generator stages.",
+            "# TYPE quiz_generator_span_seconds histogram"
+        ]
+        with self.lock:
+            histograms = {name: list(h) for name, h in self.histograms.items()}
+            counters = dict(self.counters)
 
-CRITICAL - TOPIC FIELD:
-The "topic" field in each question MUST be EXACTLY: "{ctx.topic}"
-Do NOT use variations like "cricket", "football", "space", etc.
-Use ONLY the exact slug provided above.
+        for name, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), histogram[:-1]):
+                cumulative += n
+                lines.append(f'quiz_generator_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'quiz_generator_span_seconds_sum{{span="{name}"}} {histogram[-1]:.6f}')
+            lines.append(f'quiz_generator_span_seconds_count{{span="{name}"}} {cumulative}')
 
-VALID TOPIC SLUGS: {valid_topics}
+        family = "quiz_generator_events" if openmetrics else "quiz_generator_events_total"
+        lines.append(f"# HELP {family} Counted generator events (tokens, round trips, questions).")
+        lines.append(f"# TYPE {family} counter")
+        for name, value in sorted(counters.items()):
+            lines.append(f'quiz_generator_events_total{{name="{name}"}} {value}')
 
-IMPORTANT GUIDELINES:
-1. Questions must be appropriate for kids aged {ctx.age_min}-{ctx.age_max}
-2. Focus on general knowledge that Indian children would find interesting
-3. Include facts about India, Tamil Nadu, and world knowledge
-4. Make questions fun and educational, not too hard
-5. Avoid controversial, religious conflicts, or sensitive topics
-6. Use simple language that kids can understand
-7. Each question must have exactly 4 options
-8. Only ONE option should be correct
-9. Provide a brief, kid-friendly explanation for each answer
-10. Questions should be interesting and make kids curious to learn more
-11. ALWAYS use the exact topic slug "{ctx.topic}" - never use sub-categories or variants
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
 
-DIFFICULTY LEVELS:
-- easy (age 8-10): Very simple facts, basic knowledge
-- medium (age 11-13): Moderate complexity, some reasoning
-- hard (age 14-16): More detailed knowledge, critical thinking
 
-Generate {ctx.count} unique, interesting questions about {topic_info.get('name', ctx.topic)}.
-Ensure variety - don't repeat similar questions."""
+metrics_registry = MetricsRegistry()
 
+# The record of the command or daemon request running in this context, if any
+_current_metrics: contextvars.ContextVar[Optional[MetricsRecord]] = contextvars.ContextVar("metrics", default=None)
 
-# Create the question generator agent
-question_generator = Agent(
-    name="QuizQuestionGenerator",
-    instructions=build_instructions,
-    model="gpt-4.1-mini",
-    output_type=QuestionBatch
-)
 
+def record_span(name: str, seconds: float):
+    """Add a timing to the process registry and the current record"""
+    metrics_registry.observe(name, seconds)
+    record = _current_metrics.get()
+    if record is not None:
+        record.add_span(name, seconds)
 
-async def generate_questions(
-    topic: str,
-    count: int = 10,
-    difficulty: str = "medium",
-    age_min: int = 8,
-    age_max: int = 16
-) -> list[dict]:
-    """Generate quiz questions using the AI agent"""
 
-    if topic not in TOPICS:
-        raise ValueError(f"Invalid topic: {topic}. Valid topics: {list(TOPICS.keys())}")
+def count_event(name: str, value: float = 1):
+    """Add to a counter in the process registry and the current record"""
+    if not value:
+        return
+    metrics_registry.add(name, value)
+    record = _current_metrics.get()
+    if record is not None:
+        record.add(name, value)
 
-    context = GeneratorContext(
-        db=get_db_connection(),
-        topic=topic,
-        difficulty=difficulty,
-        count=count,
-        age_min=age_min,
-        age_max=age_max
-    )
 
-    prompt = f"Generate {count} {difficulty} difficulty quiz questions about {TOPICS[topic]['name']} for kids aged {age_min}-{age_max}."
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed block as `name`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
 
-    result = await Runner.run(
-        question_generator,
-        input=prompt,
-        context=context
-    )
 
-    output = result.final_output_as(QuestionBatch)
-    return [q.model_dump() for q in output.questions]
+@contextmanager
+def collect_metrics(command: str) -> Iterator[MetricsRecord]:
+    """Collect the spans and counters of everything run inside into one record"""
+    record = MetricsRecord(command)
+    token = _current_metrics.set(record)
+    try:
+        with span(f"command.{command}"):
+            yield record
+    finally:
+        _current_metrics.reset(token)
 
 
-def save_questions_to_db(questions: list[dict]) -> int:
-    """Save questions to MongoDB or file"""
-    # Normalize all topic slugs before saving
-    for q in questions:
-        if 'topic' in q:
-            q['topic'] = normalize_topic(q['topic'])
+def timed(name: str):
+    """Decorator timing every call of a function (sync or async) as `name`"""
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
 
-    if USE_FILE_STORAGE:
-        return save_questions_to_file(questions)
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
 
-    try:
-        db = get_db_connection()
-        collection = db.questions
 
-        for q in questions:
-            q['created_at'] = datetime.utcnow()
-            q['used_count'] = 0
+def count_usage(result):
+    """Count LLM calls and tokens from an agents SDK run result"""
+    usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+    count_event("llm_calls")
+    count_event("llm_input_tokens", getattr(usage, "input_tokens", 0) or 0)
+    count_event("llm_output_tokens", getattr(usage, "output_tokens", 0) or 0)
 
-        result = collection.insert_many(questions)
-        return len(result.inserted_ids)
-    except Exception as e:
-        print(f"DB Error, falling back to file storage: {e}", file=sys.stderr)
-        return save_questions_to_file(questions)
 
+def mongo_command_metrics():
+    """A pymongo command listener timing every round trip as a mongo.<command> span"""
+    from pymongo import monitoring
 
-async def generate_and_save(
-    topic: str,
-    count: int = 10,
-    difficulty: str = "medium",
-    age_min: int = 8,
-    age_max: int = 16,
-    stream_first: bool = False
-) -> dict:
-    """Generate questions and save to database"""
+    class MongoCommandMetrics(monitoring.CommandListener):
+        def started(self, event):
+            pass
 
-    questions = await generate_questions(
-        topic=topic,
-        count=count,
-        difficulty=difficulty,
-        age_min=age_min,
-        age_max=age_max
-    )
+        def succeeded(self, event):
+            count_event("mongo_round_trips")
+            record_span(f"mongo.{event.command_name}", event.duration_micros / 1e6)
 
-    if stream_first and questions:
-        # Output first question immediately
-        first_q = questions[0]
-        print(json.dumps({"first_question": first_q, "status": "streaming"}), flush=True)
+        def failed(self, event):
+            count_event("mongo_round_trips")
+            count_event("mongo_errors")
+            record_span(f"mongo.{event.command_name}", event.duration_micros / 1e6)
 
-    saved_count = save_questions_to_db(questions)
+    return MongoCommandMetrics()
 
-    return {
-        "status": "success",
-        "topic": topic,
-        "difficulty": difficulty,
-        "generated": len(questions),
-        "saved": saved_count,
-        "questions": questions
-    }
 
+# Shared MongoDB clients, created on first use and reused by every call
+_mongo_client = None
+_async_mongo_client = None
+_async_mongo_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_client_closes: set = set()  # Close tasks of clients left behind by an earlier loop
+_mongo_client_lock = threading.Lock()
 
-async def generate_for_quiz_session(
-    age: int,
-    excluded_ids: list[str] = None,
-    count: int = 10
-) -> dict:
+# Serializes question log writes across threads (flock covers other processes)
+_file_lock = threading.Lock()
+
+
+def get_db_connection():
+    """Get MongoDB connection (the client is shared for the process lifetime)"""
+    global _mongo_client
+    if _mongo_client is None:
+        with _mongo_client_lock:
+            if _mongo_client is None:
+                from pymongo import MongoClient
+                _mongo_client = MongoClient(MONGO_URI, event_listeners=[mongo_command_metrics()], **MONGO_POOL_OPTIONS)
+    return _mongo_client[DB_NAME]
+
+
+def async_client_class():
+    """pymongo's AsyncMongoClient, or None when the installed pymongo has none"""
+    global AsyncMongoClient
+    if AsyncMongoClient is _UNRESOLVED:
+        try:
+            from pymongo import AsyncMongoClient
+        except ImportError:
+            AsyncMongoClient = None
+    return AsyncMongoClient
+
+
+def get_async_db_connection():
     """
-    Generate questions for a live quiz session.
-    First tries to fetch from file/DB, then generates new ones if needed.
+    Get an asyncio-native MongoDB connection for the running event loop.
+    Returns None when the installed pymongo has no AsyncMongoClient.
     """
-    import random
+    global _async_mongo_client, _async_mongo_loop
+    client_class = async_client_class()
+    if client_class is None:
+        return None
 
-    # Determine difficulty based on age
-    if age <= 10:
-        difficulty = "easy"
-    elif age <= 13:
-        difficulty = "medium"
-    else:
-        difficulty = "hard"
+    # The async client is bound to the loop it was created on
+    loop = asyncio.get_running_loop()
+    if _async_mongo_client is None or _async_mongo_loop is not loop:
+        if _async_mongo_client is not None:
+            close_async_client(_async_mongo_client, _async_mongo_loop)
+        _async_mongo_client = client_class(MONGO_URI, event_listeners=[mongo_command_metrics()], **MONGO_POOL_OPTIONS)
+        _async_mongo_loop = loop
+    return _async_mongo_client[DB_NAME]
 
-    excluded_ids = excluded_ids or []
 
-    # Try to get questions from file storage first
-    if USE_FILE_STORAGE:
-        all_questions = load_questions_from_file()
+def close_async_client(client, loop: asyncio.AbstractEventLoop):
+    """
+    Close an async client created on another event loop, on that loop if it
+    is still running (in another thread), else in the background on this one
+    """
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.close(), loop)
+        return
+    task = asyncio.get_running_loop().create_task(client.close())
+    _async_client_closes.add(task)
+    task.add_done_callback(_async_client_closes.discard)
 
-        # Filter by age and exclude used ones
-        filtered = [
-            q for q in all_questions
-            if q.get('age_min', 8) <= age <= q.get('age_max', 16)
-            and q.get('_id') not in excluded_ids
-        ]
 
-        if len(filtered) >= count:
-            random.shuffle(filtered)
-            return {
-                "status": "success",
-                "source": "file",
-                "questions": filtered[:count]
-            }
-    else:
-        # Try MongoDB
-        try:
-            db = get_db_connection()
-            collection = db.questions
+async def aggregate_questions(pipeline: list[dict]) -> list[dict]:
+    """Run an aggregation on the questions collection without blocking the event loop"""
+    db = get_async_db_connection()
+    if db is None:
+        return await asyncio.to_thread(lambda: list(get_db_connection().questions.aggregate(pipeline)))
+
+    cursor = await db.questions.aggregate(pipeline)
+    return await cursor.to_list(None)
 
-            age_filter = {"age_min": {"$lte": age}, "age_max": {"$gte": age}}
 
-            match_filter = age_filter.copy()
-            if excluded_ids:
-                from bson import ObjectId
-                match_filter["_id"] = {"$nin": [ObjectId(id) for id in excluded_ids if ObjectId.is_valid(id)]}
+@timed("sample")
+async def sample_questions(match_filter: dict, size: int, prefer_topic: Optional[str] = None) -> list[dict]:
+    """
+    Pick up to `size` random questions matching `match_filter`.
+    Runs a few concurrent seeks to random points of the random_key index,
+    wrapping around to the start when a seek runs off the end. Falls back to
+    $match + $sample when that comes up short (e.g. keys not backfilled yet).
+    With `prefer_topic`, see sample_topic_first.
+    """
+    if size <= 0:
+        return []
+    if prefer_topic is not None:
+        return await sample_topic_first(match_filter, size, prefer_topic)
 
-            pipeline = [
-                {"$match": match_filter},
-                {"$sample": {"size": count}}
-            ]
+    if RANDOM_KEY_SAMPLING:
+        async def seek(limit: int) -> list[dict]:
+            pivot = random.random()
+            docs = await aggregate_questions([
+                {"$match": {**match_filter, "random_key": {"$gte": pivot}}},
+                {"$sort": {"random_key": 1}},
+                {"$limit": limit}
+            ])
+            if len(docs) < limit:
+                docs += await aggregate_questions([
+                    {"$match": {**match_filter, "random_key": {"$lt": pivot}}},
+                    {"$sort": {"random_key": 1}},
+                    {"$limit": limit - len(docs)}
+                ])
+            return docs
 
-            existing = list(collection.aggregate(pipeline))
+        picked = {}
+        # A second round tops up when seeks landed on overlapping runs
+        for _ in range(2):
+            missing = size - len(picked)
+            seeks = max(1, math.ceil(missing / SAMPLE_SEEK_SIZE))
+            per_seek = math.ceil(missing / seeks)
+            for docs in await asyncio.gather(*(seek(per_seek) for _ in range(seeks))):
+                for doc in docs:
+                    picked.setdefault(doc['_id'], doc)
+            if len(picked) >= size:
+                return list(picked.values())[:size]
+            if not picked:
+                break
 
-            if len(existing) >= count:
-                questions = []
-                for q in existing:
-                    q['_id'] = str(q['_id'])
-                    questions.append(q)
+    return await aggregate_questions([
+        {"$match": match_filter},
+        {"$sample": {"size": size}}
+    ])
 
-                return {
-                    "status": "success",
-                    "source": "database",
-                    "questions": questions
-                }
-        except Exception as e:
-            print(f"DB Error: {e}", file=sys.stderr)
 
-    # Not enough questions, generate new ones
-    topics_to_generate = random.sample(list(TOPICS.keys()), min(5, len(TOPICS)))
-    all_questions = []
+@timed("sample.topic_first")
+async def sample_topic_first(match_filter: dict, size: int, topic: str) -> list[dict]:
+    """
+    Pick up to `size` random questions matching `match_filter`, from `topic`
+    first and other topics after, in one aggregation: a few short random_key
+    seeks per branch (wrapping around), as in sample_questions, joined with
+    $unionWith. Each branch's picks are shuffled so seeks do not come back as
+    runs. Falls back to one $facet with a $sample per branch when short.
+    """
+    branches = [{"topic": topic}, {"topic": {"$ne": topic}}]
+    picked = []
+
+    if RANDOM_KEY_SAMPLING:
+        seeks = max(1, math.ceil(size / SAMPLE_SEEK_SIZE))
+        per_seek = math.ceil(size / seeks)
+        parts = []
+        for branch in branches:
+            for _ in range(seeks):
+                pivot = random.random()
+                for op in ("$gte", "$lt"):
+                    parts.append([
+                        {"$match": {**match_filter, **branch, "random_key": {op: pivot}}},
+                        {"$sort": {"random_key": 1}},
+                        {"$limit": per_seek},
+                        {"$addFields": {"_seek_part": len(parts)}}
+                    ])
+        docs = await aggregate_questions(parts[0] + [{"$unionWith": {"coll": "questions", "pipeline": p}} for p in parts[1:]])
 
-    for topic in topics_to_generate:
-        if len(all_questions) >= count:
+        found = [[] for _ in parts]
+        for doc in docs:
+            found[doc.pop('_seek_part')].append(doc)
+        # The wrapped-around part of a seek only tops up a short first part
+        pools = ({}, {})
+        for part in range(0, len(parts), 2):
+            for doc in (found[part] + found[part + 1])[:per_seek]:
+                pools[doc.get('topic') != topic].setdefault(doc['_id'], doc)
+        preferred, others = (random.sample(list(pool.values()), len(pool)) for pool in pools)
+        picked = preferred[:size] + others[:max(0, size - len(preferred))]
+        if len(picked) >= size:
+            return picked
+
+    rows = await aggregate_questions([
+        {"$match": match_filter},
+        {"$facet": {
+            "preferred": [{"$match": branches[0]}, {"$sample": {"size": size}}],
+            "others": [{"$match": branches[1]}, {"$sample": {"size": size}}]
+        }}
+    ])
+    if not rows:
+        return picked
+    sampled = (rows[0]["preferred"] + rows[0]["others"])[:size]
+    return sampled if len(sampled) > len(picked) else picked
+
+
+@timed("sample.least_used")
+async def sample_least_used_questions(match_filter: dict, size: int, prefer_topic: Optional[str] = None) -> list[dict]:
+    """
+    Pick up to `size` questions matching `match_filter`, least served first.
+    The lowest used_count level is found with an indexed sort + limit 1 and
+    sampled with random_key seeks, moving up a level while still short.
+    With `prefer_topic` that topic is drawn from first, then the others.
+    """
+    if prefer_topic is not None:
+        picked = await sample_least_used_questions({**match_filter, "topic": prefer_topic}, size)
+        if len(picked) < size:
+            others = {**match_filter, "topic": {"$ne": prefer_topic}}
+            picked += await sample_least_used_questions(others, size - len(picked))
+        return picked
+
+    picked = []
+    level_filter = {}
+    for _ in range(LEAST_USED_MAX_LEVELS):
+        if len(picked) >= size:
             break
+        lowest = await aggregate_questions([
+            {"$match": {**match_filter, **level_filter}},
+            {"$sort": {"used_count": 1}},
+            {"$limit": 1},
+            {"$project": {"used_count": 1}}
+        ])
+        if not lowest:
+            break
+        level = lowest[0].get("used_count")
+        picked += await sample_questions({**match_filter, "used_count": level}, size - len(picked))
+        # Questions without a used_count sort first (and match None), numbers after them
+        level_filter = {"used_count": {"$gt": level} if level is not None else {"$type": "number"}}
 
-        try:
-            questions = await generate_questions(
-                topic=topic,
-                count=3,  # Generate 3 per topic
-                difficulty=difficulty,
-                age_min=8 if age <= 10 else (11 if age <= 13 else 14),
-                age_max=10 if age <= 10 else (13 if age <= 13 else 16)
-            )
-            all_questions.extend(questions)
-        except Exception as e:
-            print(f"Error generating for topic {topic}: {e}", file=sys.stderr)
-            continue
+    if len(picked) < size:
+        rest = {"$and": [match_filter, {"_id": {"$nin": [q['_id'] for q in picked]}}]}
+        picked += await sample_questions(rest, size - len(picked))
+    return picked
 
-    if all_questions:
-        save_questions_to_db(all_questions)
 
-        return {
-            "status": "success",
-            "source": "generated",
-            "questions": all_questions[:count]
-        }
+def record_usage_mongo(counts: dict):
+    """Add served counts to used_count, one bulk $inc per distinct count"""
+    from bson import ObjectId
+    from pymongo import UpdateMany
+
+    by_count = {}
+    for question_id, n in counts.items():
+        if ObjectId.is_valid(question_id):
+            by_count.setdefault(n, []).append(ObjectId(question_id))
+    operations = [
+        UpdateMany({"_id": {"$in": ids}}, {"$inc": {"used_count": n}})
+        for n, ids in by_count.items()
+    ]
+    if operations:
+        get_db_connection().questions.bulk_write(operations, ordered=False)
+
+
+def backfill_random_keys(batch_size: int = 1000) -> dict:
+    """
+    Give questions without a random_key, content_hash or dedup_bands one, then
+    create the sampling, content hash and dedup indexes
+    """
+    from pymongo import UpdateOne
+
+    collection = get_db_connection().questions
+    updated = 0
+    while True:
+        ids = [doc['_id'] for doc in collection.find({"random_key": {"$exists": False}}, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            break
+        result = collection.bulk_write(
+            [UpdateOne({"_id": i}, {"$set": {"random_key": random.random()}}) for i in ids],
+            ordered=False
+        )
+        updated += result.modified_count
+
+    hashed = 0
+    while True:
+        docs = list(collection.find({"content_hash": {"$exists": False}}, CONTENT_HASH_FIELDS).limit(batch_size))
+        if not docs:
+            break
+        result = collection.bulk_write(
+            [UpdateOne({"_id": doc['_id']}, {"$set": {"content_hash": content_hash(doc)}}) for doc in docs],
+            ordered=False
+        )
+        hashed += result.modified_count
+
+    banded = 0
+    while True:
+        docs = list(collection.find({"dedup_bands": {"$exists": False}}, {"question": 1}).limit(batch_size))
+        if not docs:
+            break
+        result = collection.bulk_write(
+            [UpdateOne({"_id": doc['_id']}, {"$set": {"dedup_bands": stamp_dedup_bands(doc)}}) for doc in docs],
+            ordered=False
+        )
+        banded += result.modified_count
 
     return {
-        "status": "error",
-        "message": "Could not generate questions"
+        "status": "success",
+        "updated": updated,
+        "hashed": hashed,
+        "banded": banded,
+        "indexes": ensure_question_indexes(collection)
     }
 
 
-def list_topics():
-    """List all available topics"""
-    return TOPICS
+# Fields a question's content hash is computed from
+CONTENT_HASH_FIELDS = {"question": 1, "options": 1, "correct": 1, "topic": 1, "difficulty": 1, "age_min": 1, "age_max": 1}
 
 
-def get_stats():
-    """Get database/file statistics"""
-    if USE_FILE_STORAGE:
-        questions = load_questions_from_file()
+def content_hash(q: dict) -> str:
+    """Stable hash of a question's content, used as the import/export key"""
+    material = json.dumps([
+        normalize_question_text(q.get('question', '')),
+        [option_key(o) for o in q.get('options', [])],
+        q.get('correct'),
+        normalize_topic(q.get('topic', '')),
+        q.get('difficulty'),
+        q.get('age_min'),
+        q.get('age_max')
+    ])
+    return hashlib.sha256(material.encode()).hexdigest()
 
-        stats = {
-            "total_questions": len(questions),
-            "storage": "file",
-            "by_topic": {},
-            "by_difficulty": {}
-        }
 
-        for topic in TOPICS:
-            stats["by_topic"][topic] = len([q for q in questions if q.get('topic') == topic])
+def create_content_hash_index(collection) -> Optional[dict]:
+    """
+    Unique index on content_hash, ignoring questions that don't have one yet.
+    Returns None once the index is there, or a report of the duplicated
+    hashes that keep it from being built.
+    """
+    from pymongo.errors import OperationFailure
 
-        for diff in ["easy", "medium", "hard"]:
-            stats["by_difficulty"][diff] = len([q for q in questions if q.get('difficulty') == diff])
+    keys, options = QUESTION_INDEXES[CONTENT_HASH_INDEX]
+    try:
+        collection.create_index(keys, name=CONTENT_HASH_INDEX, **options)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        return content_hash_duplicates(collection)
+    return None
 
-        return stats
 
-    try:
-        db = get_db_connection()
-        collection = db.questions
+def content_hash_duplicates(collection, examples: int = 5) -> dict:
+    """Questions sharing a content_hash with another one, with a few example hashes"""
+    pipeline = [
+        {"$match": {"content_hash": {"$exists": True}}},
+        {"$group": {"_id": "$content_hash", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    hashes = 0
+    extra = 0
+    sample = []
+    for row in collection.aggregate(pipeline, allowDiskUse=True):
+        hashes += 1
+        extra += row["count"] - 1
+        if len(sample) < examples:
+            sample.append(row["_id"])
+    return {
+        "duplicated_hashes": hashes,
+        "duplicate_questions": extra,
+        "examples": sample,
+        "hint": "run `dedup --apply` to delete the newer copies, then `indexes`"
+    }
 
-        stats = {
-            "total_questions": collection.count_documents({}),
-            "storage": "mongodb",
-            "by_topic": {},
-            "by_difficulty": {}
-        }
 
-        for topic in TOPICS:
-            stats["by_topic"][topic] = collection.count_documents({"topic": topic})
+def index_matches(info: dict, keys: list, options: dict) -> bool:
+    """Whether an index_information() entry has these keys and options"""
+    return (
+        [(field, int(direction)) for field, direction in info["key"]] == keys
+        and bool(info.get("unique")) == bool(options.get("unique"))
+        and info.get("partialFilterExpression") == options.get("partialFilterExpression")
+    )
 
-        for diff in ["easy", "medium", "hard"]:
-            stats["by_difficulty"][diff] = collection.count_documents({"difficulty": diff})
 
-        return stats
-    except Exception as e:
-        return {"error": str(e)}
+def ensure_question_indexes(collection, indexes: dict = QUESTION_INDEXES) -> dict:
+    """
+    Create the missing `indexes` (QUESTION_INDEXES by default) and rebuild
+    ones whose definition changed. Safe to run repeatedly. Returns each
+    index's status.
+    """
+    existing = collection.index_information()
+    status = {}
+    for name, (keys, options) in indexes.items():
+        current = existing.get(name)
+        if current is not None and index_matches(current, keys, options):
+            status[name] = "exists"
+            continue
 
+        # The same index under another name would make create_index fail
+        twin = next((other for other, info in existing.items() if other != name and index_matches(info, keys, options)), None)
+        if twin is not None:
+            status[name] = f"exists as {twin}"
+            continue
 
-def main():
-    parser = argparse.ArgumentParser(description="Fun Quiz Question Generator")
-    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+        if current is not None:
+            collection.drop_index(name)
+        if name == CONTENT_HASH_INDEX:
+            duplicates = create_content_hash_index(collection)
+            if duplicates is not None:
+                status[name] = (
+                    f"not created: {duplicates['duplicate_questions']} questions repeat another's content_hash, "
+                    f"{duplicates['hint']}"
+                )
+                continue
+        else:
+            collection.create_index(keys, name=name, **options)
+        status[name] = "rebuilt" if current is not None else "created"
+    return status
 
-    # Generate command
-    gen_parser = subparsers.add_parser("generate", help="Generate questions for a topic")
-    gen_parser.add_argument("--topic", required=True, help="Topic slug")
-    gen_parser.add_argument("--count", type=int, default=10, help="Number of questions")
-    gen_parser.add_argument("--difficulty", default="medium", choices=["easy", "medium", "hard"])
-    gen_parser.add_argument("--age-min", type=int, default=8)
-    gen_parser.add_argument("--age-max", type=int, default=16)
-    gen_parser.add_argument("--stream-first", action="store_true", help="Output first question immediately")
 
-    # Quiz session command
-    quiz_parser = subparsers.add_parser("quiz", help="Get questions for a quiz session")
-    quiz_parser.add_argument("--age", type=int, required=True, help="Player's age")
-    quiz_parser.add_argument("--count", type=int, default=10, help="Number of questions")
-    quiz_parser.add_argument("--exclude", nargs="*", default=[], help="Question IDs to exclude")
+def missing_question_indexes(collection, indexes: dict = QUESTION_INDEXES) -> list[str]:
+    """`indexes` (QUESTION_INDEXES by default) the collection doesn't have (under any name)"""
+    existing = collection.index_information().values()
+    return [
+        name for name, (keys, options) in indexes.items()
+        if not any(index_matches(info, keys, options) for info in existing)
+    ]
 
-    # List topics command
-    subparsers.add_parser("topics", help="List all available topics")
 
-    # Stats command
-    subparsers.add_parser("stats", help="Show database statistics")
+def explain_summary(explain: dict) -> dict:
+    """Winning plan stages and indexes plus execution counts from an explain result"""
+    stages = []
+    indexes = []
+    counts = {}
 
-    # Seed command - generate initial questions for all topics
-    seed_parser = subparsers.add_parser("seed", help="Seed database with initial questions")
-    seed_parser.add_argument("--count", type=int, default=10, help="Questions per topic per difficulty")
+    def walk(node, in_plan: bool):
+        if isinstance(node, list):
+            for item in node:
+                walk(item, in_plan)
+            return
+        if not isinstance(node, dict):
+            return
+        if in_plan and "stage" in node and node["stage"] not in stages:
+            stages.append(node["stage"])
+        if in_plan and "indexName" in node and node["indexName"] not in indexes:
+            indexes.append(node["indexName"])
+        for key, value in node.items():
+            if key in ("rejectedPlans", "allPlansExecution", "slotBasedPlan"):
+                continue
+            if key == "executionStats" and not counts:
+                counts.update(value)
+            walk(value, in_plan or key == "winningPlan")
 
-    args = parser.parse_args()
+    walk(explain, False)
+    return {
+        "stages": stages,
+        "indexes": indexes,
+        "docs_examined": counts.get("totalDocsExamined"),
+        "keys_examined": counts.get("totalKeysExamined"),
+        "returned": counts.get("nReturned")
+    }
 
-    if args.command == "generate":
-        result = asyncio.run(generate_and_save(
-            topic=args.topic,
-            count=args.count,
-            difficulty=args.difficulty,
-            age_min=args.age_min,
-            age_max=args.age_max,
-            stream_first=args.stream_first
-        ))
-        print(json.dumps(result, indent=2, default=str))
 
-    elif args.command == "quiz":
-        result = asyncio.run(generate_for_quiz_session(
-            age=args.age,
-            excluded_ids=args.exclude,
-            count=args.count
-        ))
-        print(json.dumps(result, indent=2, default=str))
+def audit_query_shapes(db, age: int = 11) -> list[dict]:
+    """
+    Explain the query shapes the quiz path, the PHP API and `stats` run and
+    judge each plan: collection scans and plans examining many more documents
+    than they return fail, except for shapes that read everything anyway.
+    """
+    from bson import ObjectId
 
-    elif args.command == "topics":
-        print(json.dumps(list_topics(), indent=2))
+    difficulty = quiz_difficulty(age)
+    adjacent = relaxation_steps(difficulty)[0][1]["difficulties"]
+    topic = next(iter(TOPICS))
+    pivot = 0.5
+    age_filter = {"age_min": {"$lte": age}, "age_max": {"$gte": age}}
 
-    elif args.command == "stats":
-        print(json.dumps(get_stats(), indent=2))
+    def seek(filter_: dict, limit: int) -> dict:
+        return {
+            "find": "questions",
+            "filter": {**filter_, "random_key": {"$gte": pivot}},
+            "sort": {"random_key": 1},
+            "limit": limit
+        }
 
-    elif args.command == "seed":
-        print("Seeding database with initial questions...")
-        total = 0
+    # name -> (command, reads the whole collection by design)
+    shapes = {
+        "quiz.sample_pool": (seek(age_filter, SAMPLE_SEEK_SIZE), False),
+        "quiz.exclude_answered": (seek({**age_filter, "_id": {"$nin": [ObjectId() for _ in range(50)]}}, SAMPLE_SEEK_SIZE), False),
+        "quiz.adjacent_difficulty": (seek({"difficulty": {"$in": adjacent}}, SAMPLE_SEEK_SIZE), False),
+        "quiz.least_used_level": ({"find": "questions", "filter": age_filter, "sort": {"used_count": 1}, "limit": 1}, False),
+        "quiz.least_used_sample": (seek({**age_filter, "used_count": 0}, SAMPLE_SEEK_SIZE), False),
+        "php.topic_quiz": (seek({"difficulty": {"$in": ["easy", difficulty]}, "topic": topic}, SAMPLE_SEEK_SIZE), False),
+        "php.mixed_quiz": (seek({"difficulty": {"$in": ["easy", difficulty]}}, SAMPLE_SEEK_SIZE), False),
+        "dedup.load_index": ({"find": "questions", "filter": {"topic": topic, "dedup_bands": {"$in": band_keys(minhash_signature(topic))}}}, False),
+        "stats.cell_counts": ({"aggregate": "questions", "pipeline": [{"$group": {"_id": {"topic": "$topic", "difficulty": "$difficulty"}, "count": {"$sum": 1}}}], "cursor": {}}, True),
+    }
 
-        for topic in TOPICS:
-            for difficulty in ["easy", "medium", "hard"]:
-                print(f"Generating {args.count} {difficulty} questions for {topic}...")
-                try:
-                    result = asyncio.run(generate_and_save(
-                        topic=topic,
-                        count=args.count,
-                        difficulty=difficulty,
-                        age_min=8 if difficulty == "easy" else (11 if difficulty == "medium" else 14),
-                        age_max=10 if difficulty == "easy" else (13 if difficulty == "medium" else 16)
-                    ))
-                    total += result.get("saved", 0)
-                    print(f"  Saved {result.get('saved', 0)} questions")
-                except Exception as e:
-                    print(f"  Error: {e}")
+    results = []
+    for name, (command, full_scan) in shapes.items():
+        summary = explain_summary(db.command("explain", command, verbosity="executionStats"))
+        examined = summary["docs_examined"] or 0
+        returned = summary["returned"] or 0
+        if full_scan:
+            verdict = "full_scan"
+        elif "COLLSCAN" in summary["stages"]:
+            verdict = "collscan"
+        elif examined > AUDIT_MAX_EXAMINED_RATIO * max(returned, 1):
+            verdict = "inefficient"
+        else:
+            verdict = "ok"
+        results.append({"query": name, "verdict": verdict, **summary})
+    return results
 
-        print(f"\nTotal questions seeded: {total}")
 
-    else:
-        parser.print_help()
+def manage_indexes(audit_only: bool = False, age: int = 11) -> dict:
+    """
+    Create and verify the questions and leaderboard collection indexes
+    (unless `audit_only`), then explain the real query shapes against them.
+    The status is "failed" when an index is missing or a query shape scans.
+    """
+    if get_question_store().name != "mongodb":
+        return {"status": "error", "error": f"indexes manages MongoDB indexes, storage is {STORAGE_BACKEND}"}
+
+    db = get_db_connection()
+    collection = db.questions
+    created = {} if audit_only else ensure_question_indexes(collection)
+    leaderboard_created = {} if audit_only else ensure_question_indexes(db.leaderboard, LEADERBOARD_INDEXES)
+    missing = missing_question_indexes(collection)
+    missing += [f"leaderboard.{name}" for name in missing_question_indexes(db.leaderboard, LEADERBOARD_INDEXES)]
+    queries = audit_query_shapes(db, age)
+    failed = [q["query"] for q in queries if q["verdict"] not in ("ok", "full_scan")]
+
+    return {
+        "status": "failed" if missing or failed else "success",
+        "indexes": created,
+        "leaderboard_indexes": leaderboard_created,
+        "missing": missing,
+        "failed_queries": failed,
+        "queries": queries
+    }
+
+
+def questions_path(name: str) -> str:
+    """Absolute path of a question store file (next to this script by default)"""
+    return os.path.join(QUESTIONS_DIR, name)
+
+
+@contextmanager
+def locked_file(lock_path: str, exclusive: bool = False):
+    """Hold an advisory lock on `lock_path` (shared or exclusive) across processes"""
+    with open(lock_path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def locked_question_store(exclusive: bool = False):
+    """
+    Hold the question store lock across processes.
+    Readers take a shared lock, writers and compaction an exclusive one.
+    """
+    return locked_file(questions_path(QUESTIONS_LOG + ".lock"), exclusive)
+
+
+def iter_question_records() -> Iterator[dict]:
+    """Yield raw records from the legacy JSON file, then from the append-only log"""
+    legacy_path = questions_path(QUESTIONS_FILE)
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'r') as f:
+            yield from json.load(f)
+
+    log_path = questions_path(QUESTIONS_LOG)
+    if os.path.exists(log_path):
+        with open(log_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Torn line from an interrupted write
+                    print("Skipping unreadable line in question log", file=sys.stderr)
+
+
+@timed("file.load")
+def load_questions_from_file() -> list[dict]:
+    """Load questions from the question store (later records with the same _id win)"""
+    with locked_question_store():
+        questions = {}
+        for q in iter_question_records():
+            questions[q.get('_id')] = q
+        usage, _ = read_usage_log()
+    for question_id, n in usage.items():
+        if question_id in questions:
+            questions[question_id]['used_count'] = int(questions[question_id].get('used_count') or 0) + n
+    return list(questions.values())
+
+
+@timed("file.append")
+def append_question_records(records: list[dict]):
+    """Append records to the question log as one locked write"""
+    data = "".join(json.dumps(q, default=str) + "\n" for q in records).encode()
+    append_to_log(questions_path(QUESTIONS_LOG), data)
+
+
+def append_usage_record(counts: dict):
+    """Append one batch of used_count increments to the usage log"""
+    append_to_log(questions_path(QUESTIONS_USAGE_LOG), (json.dumps(counts) + "\n").encode())
+
+
+def read_usage_log(offset: int = 0) -> tuple[dict, int]:
+    """Summed used_count increments in the usage log from `offset`, and the offset read up to"""
+    counts = {}
+    try:
+        f = open(questions_path(QUESTIONS_USAGE_LOG), 'rb')
+    except FileNotFoundError:
+        return counts, offset
+    with f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Write still in progress
+            offset += len(line)
+            try:
+                batch = json.loads(line)
+            except ValueError:
+                continue
+            for question_id, n in batch.items():
+                counts[question_id] = counts.get(question_id, 0) + n
+    return counts, offset
+
+
+def append_to_log(log_path: str, data: bytes, lock_path: Optional[str] = None):
+    """
+    Append `data` to a log file as one write under an exclusive lock
+    (the question store lock unless `lock_path` is given)
+    """
+    lock = locked_file(lock_path, exclusive=True) if lock_path else locked_question_store(exclusive=True)
+    with _file_lock, lock:
+        fd = os.open(log_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # Terminate a torn last line so the new batch starts on its own line
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                data = b"\n" + data
+
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+        finally:
+            os.close(fd)
+
+
+def stamp_new_questions(questions: list[dict]):
+    """Set the bookkeeping fields every newly inserted MongoDB question gets"""
+    for q in questions:
+        q['created_at'] = datetime.utcnow()
+        q['used_count'] = 0
+        q['random_key'] = random.random()
+        q['content_hash'] = content_hash(q)
+        stamp_dedup_bands(q)
+
+
+def save_questions_to_file(questions: list[dict]) -> int:
+    """Save questions by appending them to the question log"""
+    import uuid
+
+    for q in questions:
+        q['_id'] = str(uuid.uuid4())
+        q['created_at'] = datetime.utcnow().isoformat()
+        q['used_count'] = 0
+        q['content_hash'] = content_hash(q)
+        stamp_dedup_bands(q)
+
+    append_question_records(questions)
+    return len(questions)
+
+
+def compact_question_store(drop_ids: Optional[set] = None) -> dict:
+    """
+    Rewrite the question log with one record per question.
+    Folds in the legacy questions.json (kept as questions.json.bak), gives
+    older records their dedup_bands and leaves out any question whose _id
+    is in `drop_ids`.
+    """
+    log_path = questions_path(QUESTIONS_LOG)
+    legacy_path = questions_path(QUESTIONS_FILE)
+    bytes_before = sum(os.path.getsize(p) for p in (log_path, legacy_path) if os.path.exists(p))
+
+    with _file_lock, locked_question_store(exclusive=True):
+        records = 0
+        questions = {}
+        for q in iter_question_records():
+            records += 1
+            questions[q.get('_id')] = q
+
+        dropped = sum(1 for question_id in drop_ids or () if questions.pop(question_id, None) is not None)
+
+        # Fold the usage log into the records it counts
+        usage, _ = read_usage_log()
+        for question_id, n in usage.items():
+            if question_id in questions:
+                questions[question_id]['used_count'] = int(questions[question_id].get('used_count') or 0) + n
+
+        tmp_path = log_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for q in questions.values():
+                stamp_dedup_bands(q)
+                f.write(json.dumps(q, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, log_path)
+        if os.path.exists(questions_path(QUESTIONS_USAGE_LOG)):
+            os.unlink(questions_path(QUESTIONS_USAGE_LOG))
+
+        if os.path.exists(legacy_path):
+            os.replace(legacy_path, legacy_path + ".bak")
+
+    return {
+        "status": "success",
+        "records_before": records,
+        "questions": len(questions),
+        "dropped": dropped,
+        "bytes_before": bytes_before,
+        "bytes_after": os.path.getsize(log_path)
+    }
+
+
+def file_signature(path: str) -> Optional[tuple]:
+    """(inode, size, mtime) of a file, or None if it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class QuestionStore(ABC):
+    """
+    Question storage backend: MongoDB, the file catalogue or SQLite (see
+    get_question_store). Sampling is async so MongoDB can use the async
+    driver; the local stores run their sync sampling in a thread.
+    """
+
+    name = "base"  # Reported by stats and the leaderboard
+    source = "base"  # Reported as a quiz's source
+
+    @abstractmethod
+    def save(self, questions: list[dict]) -> int:
+        """Stamp and store new questions, returning how many were stored"""
+
+    async def save_async(self, questions: list[dict]) -> int:
+        """save() without blocking the event loop"""
+        return await asyncio.to_thread(self.save, questions)
+
+    @abstractmethod
+    async def sample(
+        self,
+        count: int,
+        age: Optional[int] = None,
+        exclude: Optional[list[str]] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None,
+        prefer_topic: Optional[str] = None
+    ) -> list[dict]:
+        """
+        Pick up to `count` random questions matching the filters, from
+        `prefer_topic` first and other topics after when it runs short.
+        Returned questions have string ids.
+        """
+
+    @abstractmethod
+    async def sample_least_used(
+        self,
+        count: int,
+        age: Optional[int] = None,
+        exclude: Optional[list[str]] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None,
+        prefer_topic: Optional[str] = None
+    ) -> list[dict]:
+        """Like sample(), but lowest used_count first"""
+
+    @abstractmethod
+    def record_usage(self, counts: dict):
+        """Add served counts ({_id: n}) to used_count in one batch"""
+
+    @abstractmethod
+    def cell_counts(self, max_used: Optional[int] = None) -> dict:
+        """
+        Question count per (topic, difficulty, age_min, age_max) cell,
+        optionally only counting questions served at most `max_used` times
+        """
+
+    @abstractmethod
+    def iter_chunks(self, chunk_size: int = 1000) -> Iterator[list[dict]]:
+        """Stream every stored question in chunks"""
+
+    @abstractmethod
+    def iter_questions(self, topics: Optional[set] = None) -> Iterator[dict]:
+        """Stream stored questions, oldest first, optionally only some topics"""
+
+    @abstractmethod
+    def band_candidates(self, topic: str, bands: list[int]) -> Iterable[dict]:
+        """Stored questions of `topic` sharing at least one of the LSH `bands`"""
+
+    @abstractmethod
+    def delete(self, question_ids: list) -> int:
+        """Delete questions by _id, returning how many were deleted"""
+
+    @abstractmethod
+    def import_writer(self, mode: str):
+        """
+        Chunk writer for import: a function storing a list of snapshot
+        records and returning (inserted, already present)
+        """
+
+    @abstractmethod
+    def load_seen_doc(self, player: str) -> Optional[dict]:
+        """A player's stored seen set document, or None"""
+
+    @abstractmethod
+    def update_seen_doc(self, player: str, update) -> dict:
+        """
+        Atomically replace a player's seen set document with `update(doc)`
+        (doc is None for a new player); `update` may run more than once
+        """
+
+    def warm_up(self):
+        """Open connections before the first request (daemon start-up)"""
+
+
+class QuestionCatalogue(QuestionStore):
+    """
+    Indexed view of the file question store.
+    Only index fields are kept in memory, in arrays; full questions are read
+    back from the log by byte offset when sampled. The log is re-read
+    incrementally as it grows and reloaded fully when a file is replaced.
+    """
+
+    name = "file"
+    source = "file"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.offsets = array('q')  # Log byte offset, or -(i + 1) for legacy[i]
+        self.cell_of = array('H')  # Cell number of each position
+        self.alive = bytearray()  # 0 once a later record replaced this one
+        self.cell_keys = []  # Cell number -> (topic, difficulty, age_min, age_max)
+        self.cell_index = {}  # Cell key -> cell number
+        self.cells = []  # Cell number -> array of positions
+        self.counts = array('I')  # Cell number -> live questions
+        self.used = array('I')  # used_count of each position
+        self.levels = []  # Cell number -> {used_count: positions}, entries checked against `used` on read
+        self.level_entries = array('I')  # Cell number -> entries in its levels, stale ones included
+        self.positions = {}  # _id -> position
+        self.bands = array('q')  # MINHASH_BANDS dedup band keys per position, 0s until known
+        self.legacy = []
+        self.legacy_signature = None
+        self.log_inode = None
+        self.log_offset = 0
+        self.usage_inode = None
+        self.usage_offset = 0
+
+    @timed("catalogue.refresh")
+    def refresh(self):
+        """Pick up appended records, or reload if the store was replaced"""
+        legacy_signature = file_signature(questions_path(QUESTIONS_FILE))
+        log_signature = file_signature(questions_path(QUESTIONS_LOG))
+        log_inode = log_signature[0] if log_signature else None
+        log_size = log_signature[1] if log_signature else 0
+        usage_signature = file_signature(questions_path(QUESTIONS_USAGE_LOG))
+        usage_inode = usage_signature[0] if usage_signature else None
+        usage_size = usage_signature[1] if usage_signature else 0
+
+        if (legacy_signature != self.legacy_signature
+                or log_inode != self.log_inode
+                or log_size < self.log_offset
+                or self.usage_offset and (usage_inode != self.usage_inode or usage_size < self.usage_offset)):
+            self._reset()
+            self.legacy_signature = legacy_signature
+            self.log_inode = log_inode
+            if legacy_signature:
+                with open(questions_path(QUESTIONS_FILE), 'r') as f:
+                    self.legacy = json.load(f)
+                for i, q in enumerate(self.legacy):
+                    self._add(q, -(i + 1))
+
+        if log_size > self.log_offset:
+            self._read_log()
+        self.usage_inode = usage_inode
+        if usage_size > self.usage_offset:
+            counts, self.usage_offset = read_usage_log(self.usage_offset)
+            for question_id, n in counts.items():
+                position = self.positions.get(question_id)
+                if position is not None:
+                    self._use(position, n)
+
+    def _read_log(self):
+        """Index log lines from the last read offset"""
+        with open(questions_path(QUESTIONS_LOG), 'rb') as f:
+            f.seek(self.log_offset)
+            offset = self.log_offset
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Write still in progress
+                start = offset
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    q = json.loads(line)
+                except ValueError:
+                    continue
+                self._add(q, start)
+            self.log_offset = offset
+
+    def _add(self, q: dict, offset: int):
+        """Index one record stored at `offset`"""
+        key = (q.get('topic'), q.get('difficulty'), int(q.get('age_min', 8)), int(q.get('age_max', 16)))
+        cell = self.cell_index.get(key)
+        if cell is None:
+            cell = len(self.cell_keys)
+            self.cell_index[key] = cell
+            self.cell_keys.append(key)
+            self.cells.append(array('I'))
+            self.counts.append(0)
+            self.levels.append({})
+            self.level_entries.append(0)
+
+        position = len(self.offsets)
+        previous = self.positions.get(q.get('_id'))
+        if previous is not None:
+            self.alive[previous] = 0
+            self.counts[self.cell_of[previous]] -= 1
+
+        self.positions[q.get('_id')] = position
+        self.offsets.append(offset)
+        self.used.append(int(q.get('used_count') or 0))
+        self.cell_of.append(cell)
+        self.alive.append(1)
+        self.cells[cell].append(position)
+        self.counts[cell] += 1
+        self.levels[cell].setdefault(self.used[position], array('I')).append(position)
+        self.level_entries[cell] += 1
+        bands = q.get('dedup_bands')
+        self.bands.extend(bands if bands and len(bands) == MINHASH_BANDS else [0] * MINHASH_BANDS)
+
+    def _use(self, position: int, n: int):
+        """Add `n` to a position's used_count and file it under its new level"""
+        self.used[position] += n
+        cell = self.cell_of[position]
+        self.levels[cell].setdefault(self.used[position], array('I')).append(position)
+        self.level_entries[cell] += 1
+        if self.level_entries[cell] > 2 * self.counts[cell] + 64:
+            # Mostly stale entries, rebuild the cell's levels from `used`
+            levels = {}
+            for p in self.cells[cell]:
+                if self.alive[p]:
+                    levels.setdefault(self.used[p], array('I')).append(p)
+            self.levels[cell] = levels
+            self.level_entries[cell] = self.counts[cell]
+
+    def matching_cells(
+        self,
+        age: Optional[int] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None
+    ) -> list[int]:
+        """Cell numbers matching an age and optional topic/difficulty filters"""
+        matches = []
+        for cell, (topic, difficulty, age_min, age_max) in enumerate(self.cell_keys):
+            if age is not None and not age_min <= age <= age_max:
+                continue
+            if topics is not None and topic not in topics:
+                continue
+            if difficulties is not None and difficulty not in difficulties:
+                continue
+            matches.append(cell)
+        return matches
+
+    def cell_counts(self, max_used: Optional[int] = None) -> dict:
+        """
+        Live question count per (topic, difficulty, age_min, age_max) cell,
+        optionally only counting questions served at most `max_used` times.
+        """
+        with self.lock, locked_question_store():
+            self.refresh()
+            if max_used is None:
+                return {key: self.counts[cell] for cell, key in enumerate(self.cell_keys) if self.counts[cell]}
+
+            counts = {}
+            for cell, key in enumerate(self.cell_keys):
+                n = sum(1 for p in self.cells[cell] if self.alive[p] and self.used[p] <= max_used)
+                if n:
+                    counts[key] = n
+            return counts
+
+    async def sample(self, count: int, **filters) -> list[dict]:
+        return await asyncio.to_thread(self.sample_sync, count, **filters)
+
+    async def sample_least_used(self, count: int, **filters) -> list[dict]:
+        return await asyncio.to_thread(self.sample_least_used_sync, count, **filters)
+
+    @timed("catalogue.sample")
+    def sample_sync(
+        self,
+        count: int,
+        age: Optional[int] = None,
+        exclude: Optional[list[str]] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None,
+        prefer_topic: Optional[str] = None
+    ) -> list[dict]:
+        """
+        Pick up to `count` random live questions matching the filters, from
+        `prefer_topic` cells first and the other matching cells after
+        """
+        with self.lock, locked_question_store():
+            self.refresh()
+
+            excluded = {self.positions[i] for i in (exclude or []) if i in self.positions}
+            chosen = []
+            for cells in self.topic_first(self.matching_cells(age, topics, difficulties), prefer_topic):
+                chosen += self._pick([self.cells[c] for c in cells], count - len(chosen), excluded)
+                if len(chosen) >= count:
+                    break
+            return self.fetch(chosen)
+
+    @timed("catalogue.sample_least_used")
+    def sample_least_used_sync(
+        self,
+        count: int,
+        age: Optional[int] = None,
+        exclude: Optional[list[str]] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None,
+        prefer_topic: Optional[str] = None
+    ) -> list[dict]:
+        """
+        Pick up to `count` live questions matching the filters from the lowest
+        used_count levels of the matching cells, random within a level,
+        `prefer_topic` cells first.
+        """
+        with self.lock, locked_question_store():
+            self.refresh()
+
+            excluded = {self.positions[i] for i in (exclude or []) if i in self.positions}
+            chosen = []
+            for cells in self.topic_first(self.matching_cells(age, topics, difficulties), prefer_topic):
+                chosen += self._pick_least_used(cells, count - len(chosen), excluded)
+                if len(chosen) >= count:
+                    break
+            return self.fetch(chosen)
+
+    def topic_first(self, cells: list[int], topic: Optional[str]) -> list[list[int]]:
+        """Non-empty cells split into `topic` cells and the rest (one group without a topic)"""
+        cells = [c for c in cells if self.counts[c]]
+        if topic is None:
+            return [cells]
+        return [
+            [c for c in cells if self.cell_keys[c][0] == topic],
+            [c for c in cells if self.cell_keys[c][0] != topic]
+        ]
+
+    def _pick_least_used(self, cells: list[int], count: int, excluded: set) -> list[int]:
+        """Pick from the lowest used_count levels of `cells`, topping up at random"""
+        chosen = []
+        for level in sorted({level for c in cells for level in self.levels[c]})[:LEAST_USED_MAX_LEVELS]:
+            groups = [self.levels[c][level] for c in cells if level in self.levels[c]]
+            chosen += self._pick(groups, count - len(chosen), excluded, level)
+            if len(chosen) >= count:
+                return chosen
+            excluded.update(chosen)
+
+        chosen += self._pick([self.cells[c] for c in cells], count - len(chosen), excluded)
+        return chosen
+
+    def _pick(self, groups: list, count: int, excluded: set, level: Optional[int] = None) -> list[int]:
+        """
+        Pick up to `count` random live positions from `groups`, skipping
+        `excluded` and, with `level`, positions whose used_count moved on.
+        """
+        def usable(position: int) -> bool:
+            return (self.alive[position] and position not in excluded
+                    and (level is None or self.used[position] == level))
+
+        ends = []
+        total = 0
+        for group in groups:
+            total += len(group)
+            ends.append(total)
+
+        chosen = []
+        taken = set()
+        attempts = 0
+        while total and len(chosen) < count and attempts < count * 10:
+            attempts += 1
+            i = random.randrange(total)
+            g = bisect_right(ends, i)
+            position = groups[g][i - (ends[g - 1] if g else 0)]
+            if position in taken or not usable(position):
+                continue
+            taken.add(position)
+            chosen.append(position)
+
+        if len(chosen) < count:
+            # Mostly excluded or replaced, fall back to scanning the groups
+            rest = [p for group in groups for p in group if p not in taken and usable(p)]
+            chosen.extend(random.sample(rest, min(count - len(chosen), len(rest))))
+        return chosen
+
+    @timed("catalogue.fetch")
+    def fetch(self, positions: list[int]) -> list[dict]:
+        """Read full questions for catalogue positions"""
+        questions = []
+        log = None
+        try:
+            for position in positions:
+                offset = self.offsets[position]
+                if offset < 0:
+                    q = dict(self.legacy[-offset - 1])
+                    q['used_count'] = self.used[position]
+                    questions.append(q)
+                    continue
+                if log is None:
+                    log = open(questions_path(QUESTIONS_LOG), 'rb')
+                log.seek(offset)
+                q = json.loads(log.readline())
+                q['used_count'] = self.used[position]
+                questions.append(q)
+        finally:
+            if log is not None:
+                log.close()
+        return questions
+
+    def save(self, questions: list[dict]) -> int:
+        return save_questions_to_file(questions)
+
+    def record_usage(self, counts: dict):
+        # Picked up by every process's catalogue on its next refresh
+        append_usage_record(counts)
+
+    def iter_chunks(self, chunk_size: int = 1000) -> Iterator[list[dict]]:
+        with self.lock, locked_question_store():
+            self.refresh()
+            total = len(self.offsets)
+        for start in range(0, total, chunk_size):
+            with self.lock, locked_question_store():
+                positions = [p for p in range(start, min(start + chunk_size, total)) if self.alive[p]]
+                chunk = self.fetch(positions)
+            if chunk:
+                yield chunk
+
+    def topic_positions(self, topics: Optional[set] = None) -> list[int]:
+        """Live positions of the given topics, oldest first"""
+        return sorted(
+            p
+            for cell, key in enumerate(self.cell_keys)
+            if topics is None or key[0] in topics
+            for p in self.cells[cell]
+            if self.alive[p]
+        )
+
+    def iter_questions(self, topics: Optional[set] = None) -> Iterator[dict]:
+        with self.lock, locked_question_store():
+            self.refresh()
+            positions = self.topic_positions(topics)
+        for start in range(0, len(positions), 1000):
+            with self.lock, locked_question_store():
+                chunk = self.fetch(positions[start:start + 1000])
+            yield from chunk
+
+    @timed("catalogue.band_candidates")
+    def band_candidates(self, topic: str, bands: list[int]) -> list[dict]:
+        wanted = set(bands)
+        with self.lock, locked_question_store():
+            self.refresh()
+            matches = []
+            unknown = []
+            for p in self.topic_positions({topic}):
+                keys = self.bands[p * MINHASH_BANDS:(p + 1) * MINHASH_BANDS]
+                if not any(keys):
+                    unknown.append(p)
+                elif not wanted.isdisjoint(keys):
+                    matches.append(p)
+            # Records written before dedup_bands existed get theirs once per process
+            # (compact stores them)
+            for p, q in zip(unknown, self.fetch(unknown)):
+                keys = stamp_dedup_bands(q)
+                self.bands[p * MINHASH_BANDS:(p + 1) * MINHASH_BANDS] = array('q', keys)
+                if not wanted.isdisjoint(keys):
+                    matches.append(p)
+            return self.fetch(matches)
+
+    def delete(self, question_ids: list[str]) -> int:
+        return compact_question_store(drop_ids=set(question_ids))["dropped"]
+
+    def import_writer(self, mode: str):
+        import uuid
+
+        # Content hashes and ids already in the log, as compact ints and a set
+        known_hashes = set()
+        known_ids = set()
+        for q in iter_question_records():
+            known_hashes.add(int((q.get('content_hash') or content_hash(q))[:16], 16))
+            known_ids.add(q.get('_id'))
+
+        def write(records: list[dict]) -> tuple[int, int]:
+            fresh = []
+            for q in records:
+                key = int(q['content_hash'][:16], 16)
+                if key in known_hashes:
+                    continue
+                known_hashes.add(key)
+                if not isinstance(q.get('_id'), str) or q['_id'] in known_ids:
+                    q['_id'] = str(uuid.uuid4())
+                known_ids.add(q['_id'])
+                q.setdefault('created_at', datetime.utcnow().isoformat())
+                fresh.append(q)
+            if fresh:
+                append_question_records([json.loads(json.dumps(q, default=snapshot_default)) for q in fresh])
+            return len(fresh), len(records) - len(fresh)
+
+        return write
+
+    def load_seen_doc(self, player: str) -> Optional[dict]:
+        try:
+            with open(seen_path(player), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def update_seen_doc(self, player: str, update) -> dict:
+        path = seen_path(player)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with locked_file(path + ".lock", exclusive=True):
+            doc = update(self.load_seen_doc(player))
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(doc, f)
+            os.replace(tmp_path, path)
+        return doc
+
+
+_question_catalogue: Optional[QuestionCatalogue] = None
+
+
+def get_question_catalogue() -> QuestionCatalogue:
+    """Get the process-wide question catalogue for file storage"""
+    global _question_catalogue
+    if _question_catalogue is None:
+        _question_catalogue = QuestionCatalogue()
+    return _question_catalogue
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id TEXT PRIMARY KEY,
+    topic TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    age_min INTEGER NOT NULL,
+    age_max INTEGER NOT NULL,
+    random_key REAL NOT NULL,
+    used_count INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT UNIQUE,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_cell ON questions (topic, difficulty, age_min, age_max);
+CREATE INDEX IF NOT EXISTS questions_difficulty_random_key ON questions (difficulty, random_key);
+CREATE INDEX IF NOT EXISTS questions_random_key ON questions (random_key, age_min, age_max);
+CREATE INDEX IF NOT EXISTS questions_used_random_key ON questions (used_count, random_key);
+CREATE TABLE IF NOT EXISTS question_bands (
+    topic TEXT NOT NULL,
+    band INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (topic, band, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS question_bands_id ON question_bands (id);
+CREATE TABLE IF NOT EXISTS seen_questions (
+    player TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leaderboard (
+    name TEXT PRIMARY KEY,
+    score INTEGER NOT NULL DEFAULT 0,
+    games INTEGER NOT NULL DEFAULT 0,
+    age INTEGER,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS leaderboard_score ON leaderboard (score DESC, name);
+"""
+
+
+class SQLiteQuestionStore(QuestionStore):
+    """
+    Question store in an embedded SQLite database.
+    Index fields are columns next to the question JSON, with indexes on the
+    (topic, difficulty, age_min, age_max) cell and on random_key for
+    random-key sampling. WAL mode lets readers run alongside the writer, and
+    every thread gets its own connection.
+    """
+
+    name = "sqlite"
+    source = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        conn = self.connection()
+        conn.executescript(SQLITE_SCHEMA)
+        if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            self.backfill_bands()
+            conn.execute("PRAGMA user_version = 1")
+
+    def backfill_bands(self, chunk_size: int = 1000):
+        """Fill question_bands for questions stored before it existed"""
+        conn = self.connection()
+        last = 0
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, id, topic, doc FROM questions WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            with self.transaction() as conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO question_bands (topic, band, id) VALUES (?, ?, ?)",
+                    [(topic, band, i) for _, i, topic, doc in rows for band in stamp_dedup_bands(json.loads(doc))]
+                )
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # Autocommit, writes take the lock explicitly in transaction()
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in one write transaction"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def row_question(doc: str, used_count: int) -> dict:
+        q = json.loads(doc)
+        q['used_count'] = used_count
+        return q
+
+    def insert(self, questions: list[dict]) -> int:
+        """Insert stamped questions and their dedup bands, skipping ones whose content is already stored"""
+        inserted = 0
+        with self.transaction() as conn:
+            for q in questions:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO questions "
+                    "(id, topic, difficulty, age_min, age_max, random_key, used_count, content_hash, doc) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        q['_id'], q['topic'], q['difficulty'], q['age_min'], q['age_max'],
+                        q['random_key'], q.get('used_count', 0), q['content_hash'],
+                        json.dumps(q, default=str)
+                    )
+                )
+                if cursor.rowcount:
+                    inserted += 1
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO question_bands (topic, band, id) VALUES (?, ?, ?)",
+                        [(q['topic'], band, q['_id']) for band in stamp_dedup_bands(q)]
+                    )
+        return inserted
+
+    @timed("sqlite.save")
+    def save(self, questions: list[dict]) -> int:
+        import uuid
+
+        for q in questions:
+            q['_id'] = str(uuid.uuid4())
+            q['created_at'] = datetime.utcnow().isoformat()
+            q['used_count'] = 0
+            q['random_key'] = random.random()
+            q['content_hash'] = content_hash(q)
+            stamp_dedup_bands(q)
+        return self.insert(questions)
+
+    @staticmethod
+    def filters(
+        age: Optional[int],
+        exclude: Optional[list[str]],
+        topics: Optional[list[str]],
+        difficulties: Optional[list[str]]
+    ) -> tuple[str, list]:
+        """WHERE clause and parameters for the sampling filters"""
+        clauses = []
+        params = []
+        if age is not None:
+            clauses.append("age_min <= ? AND age_max >= ?")
+            params += [age, age]
+        if topics is not None:
+            clauses.append(f"topic IN ({', '.join('?' * len(topics))})")
+            params += list(topics)
+        if difficulties is not None:
+            clauses.append(f"difficulty IN ({', '.join('?' * len(difficulties))})")
+            params += list(difficulties)
+        if exclude:
+            # One JSON parameter however many ids are excluded
+            clauses.append("id NOT IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(exclude)))
+        return " AND ".join(clauses) or "1", params
+
+    async def sample(self, count: int, **filters) -> list[dict]:
+        return await asyncio.to_thread(self.sample_sync, count, **filters)
+
+    async def sample_least_used(self, count: int, **filters) -> list[dict]:
+        return await asyncio.to_thread(self.sample_least_used_sync, count, **filters)
+
+    @timed("sqlite.sample")
+    def sample_sync(
+        self,
+        count: int,
+        age: Optional[int] = None,
+        exclude: Optional[list[str]] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None,
+        prefer_topic: Optional[str] = None
+    ) -> list[dict]:
+        """
+        Pick up to `count` random questions matching the filters by seeking to
+        random points of the random_key index, wrapping around at the end.
+        Falls back to ORDER BY random() when seeks keep landing on the same run.
+        """
+        where, params = self.filters(age, exclude, topics, difficulties)
+        return self.topic_first(self._sample, count, where, params, prefer_topic)
+
+    def topic_first(self, sampler, count: int, where: str, params: list, topic: Optional[str]) -> list[dict]:
+        """Run `sampler` on `topic` first, then on the other topics for what is missing"""
+        if topic is None:
+            return sampler(count, where, params)
+        # One read transaction, so both branches see the same snapshot
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            picked = sampler(count, f"{where} AND topic = ?", [*params, topic])
+            return picked + sampler(count - len(picked), f"{where} AND topic != ?", [*params, topic])
+        finally:
+            conn.execute("COMMIT")
+
+    def _sample(self, count: int, where: str, params: list) -> list[dict]:
+        """Random-key sampling of the questions matching a WHERE clause"""
+        if count <= 0:
+            return []
+        conn = self.connection()
+
+        def seek(limit: int) -> list[tuple]:
+            pivot = random.random()
+            query = f"SELECT id, doc, used_count FROM questions WHERE {where} AND random_key {{}} ? ORDER BY random_key LIMIT ?"
+            rows = conn.execute(query.format(">="), [*params, pivot, limit]).fetchall()
+            if len(rows) < limit:
+                rows += conn.execute(query.format("<"), [*params, pivot, limit - len(rows)]).fetchall()
+            return rows
+
+        picked = {}
+        for _ in range(2):
+            missing = count - len(picked)
+            seeks = max(1, math.ceil(missing / SAMPLE_SEEK_SIZE))
+            per_seek = math.ceil(missing / seeks)
+            for _ in range(seeks):
+                for question_id, doc, used_count in seek(per_seek):
+                    picked.setdefault(question_id, (doc, used_count))
+            if len(picked) >= count or not picked:
+                break
+
+        if picked and len(picked) < count:
+            rows = conn.execute(
+                f"SELECT id, doc, used_count FROM questions WHERE {where} "
+                "AND id NOT IN (SELECT value FROM json_each(?)) ORDER BY random() LIMIT ?",
+                [*params, json.dumps(list(picked)), count - len(picked)]
+            ).fetchall()
+            for question_id, doc, used_count in rows:
+                picked[question_id] = (doc, used_count)
+
+        return [self.row_question(doc, used_count) for doc, used_count in list(picked.values())[:count]]
+
+    @timed("sqlite.sample_least_used")
+    def sample_least_used_sync(
+        self,
+        count: int,
+        age: Optional[int] = None,
+        exclude: Optional[list[str]] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None,
+        prefer_topic: Optional[str] = None
+    ) -> list[dict]:
+        """
+        Pick up to `count` questions matching the filters, least served first.
+        Each used_count level is found by walking the (used_count, random_key)
+        index and then sampled with random-key seeks.
+        """
+        where, params = self.filters(age, exclude, topics, difficulties)
+        return self.topic_first(self._sample_least_used, count, where, params, prefer_topic)
+
+    def _sample_least_used(self, count: int, where: str, params: list) -> list[dict]:
+        if count <= 0:
+            return []
+        conn = self.connection()
+        picked = []
+        above = ("", [])
+        for _ in range(LEAST_USED_MAX_LEVELS):
+            if len(picked) >= count:
+                break
+            row = conn.execute(
+                f"SELECT used_count FROM questions WHERE {where}{above[0]} ORDER BY used_count LIMIT 1",
+                [*params, *above[1]]
+            ).fetchone()
+            if row is None:
+                break
+            picked += self._sample(count - len(picked), f"{where} AND used_count = ?", [*params, row[0]])
+            above = (" AND used_count > ?", [row[0]])
+
+        if len(picked) < count:
+            picked += self._sample(
+                count - len(picked),
+                f"{where} AND id NOT IN (SELECT value FROM json_each(?))",
+                [*params, json.dumps([q['_id'] for q in picked])]
+            )
+        return picked
+
+    def record_usage(self, counts: dict):
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE questions SET used_count = used_count + ? WHERE id = ?",
+                [(n, question_id) for question_id, n in counts.items()]
+            )
+
+    def cell_counts(self, max_used: Optional[int] = None) -> dict:
+        query = "SELECT topic, difficulty, age_min, age_max, COUNT(*) FROM questions"
+        params = []
+        if max_used is not None:
+            query += " WHERE used_count <= ?"
+            params.append(max_used)
+        query += " GROUP BY topic, difficulty, age_min, age_max"
+        return {tuple(row[:4]): row[4] for row in self.connection().execute(query, params)}
+
+    def iter_chunks(self, chunk_size: int = 1000) -> Iterator[list[dict]]:
+        # Keyset pagination on rowid, so each chunk is one short indexed read
+        conn = self.connection()
+        last = 0
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, doc, used_count FROM questions WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [self.row_question(doc, used_count) for _, doc, used_count in rows]
+
+    def iter_questions(self, topics: Optional[set] = None) -> Iterator[dict]:
+        if topics is None:
+            for chunk in self.iter_chunks():
+                yield from chunk
+            return
+        placeholders = ",".join("?" * len(topics))
+        rows = self.connection().execute(
+            f"SELECT doc, used_count FROM questions WHERE topic IN ({placeholders}) ORDER BY rowid",
+            sorted(topics)
+        )
+        for doc, used_count in rows:
+            yield self.row_question(doc, used_count)
+
+    def band_candidates(self, topic: str, bands: list[int]) -> list[dict]:
+        placeholders = ",".join("?" * len(bands))
+        rows = self.connection().execute(
+            "SELECT doc, used_count FROM questions WHERE id IN "
+            f"(SELECT id FROM question_bands WHERE topic = ? AND band IN ({placeholders}))",
+            [topic, *bands]
+        )
+        return [self.row_question(doc, used_count) for doc, used_count in rows]
+
+    def delete(self, question_ids: list[str]) -> int:
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("DELETE FROM questions WHERE id = ?", [(i,) for i in question_ids])
+            deleted = conn.total_changes - before
+            conn.executemany("DELETE FROM question_bands WHERE id = ?", [(i,) for i in question_ids])
+            return deleted
+
+    def import_writer(self, mode: str):
+        import uuid
+
+        def write(records: list[dict]) -> tuple[int, int]:
+            for q in records:
+                if not isinstance(q.get('_id'), str):
+                    q['_id'] = str(uuid.uuid4())
+                q.setdefault('created_at', datetime.utcnow().isoformat())
+            inserted = self.insert(records)
+            return inserted, len(records) - inserted
+
+        return write
+
+    def load_seen_doc(self, player: str) -> Optional[dict]:
+        row = self.connection().execute("SELECT doc FROM seen_questions WHERE player = ?", (player,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_seen_doc(self, player: str, update) -> dict:
+        with self.transaction() as conn:
+            doc = update(self.load_seen_doc(player))
+            conn.execute(
+                "INSERT OR REPLACE INTO seen_questions (player, doc) VALUES (?, ?)",
+                (player, json.dumps(doc))
+            )
+        return doc
+
+
+_sqlite_store: Optional[SQLiteQuestionStore] = None
+
+
+def get_sqlite_store() -> SQLiteQuestionStore:
+    """Get the process-wide SQLite question store"""
+    global _sqlite_store
+    if _sqlite_store is None:
+        _sqlite_store = SQLiteQuestionStore(SQLITE_PATH or questions_path(SQLITE_FILE))
+    return _sqlite_store
+
+
+def mongo_filter(
+    age: Optional[int] = None,
+    exclude: Optional[list[str]] = None,
+    topics: Optional[list[str]] = None,
+    difficulties: Optional[list[str]] = None
+) -> dict:
+    """Query filter for the sampling filters"""
+    from bson import ObjectId
+
+    match_filter = {}
+    if age is not None:
+        match_filter.update({"age_min": {"$lte": age}, "age_max": {"$gte": age}})
+    if topics is not None:
+        match_filter["topic"] = {"$in": list(topics)}
+    if difficulties is not None:
+        match_filter["difficulty"] = {"$in": list(difficulties)}
+    skip = [ObjectId(i) for i in exclude or () if ObjectId.is_valid(str(i))]
+    if skip:
+        match_filter["_id"] = {"$nin": skip}
+    return match_filter
+
+
+def object_ids(question_ids: list) -> list:
+    """Question ids as ObjectIds (strings from JSON output are converted back)"""
+    from bson import ObjectId
+
+    return [ObjectId(i) if isinstance(i, str) and ObjectId.is_valid(i) else i for i in question_ids]
+
+
+class MongoQuestionStore(QuestionStore):
+    """
+    Questions in the MongoDB questions collection. Sync methods use the
+    shared client; sampling and save_async use the async driver when the
+    installed pymongo has one.
+    """
+
+    name = "mongodb"
+    source = "database"
+
+    @staticmethod
+    def inserted(questions: list[dict], error) -> list[dict]:
+        """
+        The questions an unordered insert_many stored, given the BulkWriteError
+        it raised. Duplicate content hashes (e.g. flagged duplicates) are
+        skipped; any other write error is raised.
+        """
+        write_errors = error.details.get("writeErrors", [])
+        if any(e.get("code") != 11000 for e in write_errors):
+            raise error
+        # Left out of the "saved" count, stderr is part of generate.php's output
+        count_event("questions_already_stored", len(write_errors))
+        failed = {e["index"] for e in write_errors}
+        return [q for i, q in enumerate(questions) if i not in failed]
+
+    @timed("mongo.save")
+    def save(self, questions: list[dict]) -> int:
+        from pymongo.errors import BulkWriteError
+
+        db = get_db_connection()
+        stamp_new_questions(questions)
+        try:
+            db.questions.insert_many(questions, ordered=False)
+            inserted = questions
+        except BulkWriteError as e:
+            inserted = self.inserted(questions, e)
+
+        if STATS_COUNTERS and inserted:
+            try:
+                db.stats.update_one({"_id": STATS_COUNTERS_ID}, {"$inc": counter_increments(inserted)}, upsert=True)
+            except Exception as e:
+                print(f"Stats counters not updated: {e}", file=sys.stderr)
+        return len(inserted)
+
+    async def save_async(self, questions: list[dict]) -> int:
+        from pymongo.errors import BulkWriteError
+
+        db = get_async_db_connection()
+        if db is None:
+            return await asyncio.to_thread(self.save, questions)
+
+        stamp_new_questions(questions)
+        try:
+            await db.questions.insert_many(questions, ordered=False)
+            inserted = questions
+        except BulkWriteError as e:
+            inserted = self.inserted(questions, e)
+
+        if STATS_COUNTERS and inserted:
+            try:
+                await db.stats.update_one({"_id": STATS_COUNTERS_ID}, {"$inc": counter_increments(inserted)}, upsert=True)
+            except Exception as e:
+                print(f"Stats counters not updated: {e}", file=sys.stderr)
+        return len(inserted)
+
+    async def sample(
+        self,
+        count: int,
+        age: Optional[int] = None,
+        exclude: Optional[list[str]] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None,
+        prefer_topic: Optional[str] = None
+    ) -> list[dict]:
+        docs = await sample_questions(mongo_filter(age, exclude, topics, difficulties), count, prefer_topic)
+        return self.with_string_ids(docs)
+
+    async def sample_least_used(
+        self,
+        count: int,
+        age: Optional[int] = None,
+        exclude: Optional[list[str]] = None,
+        topics: Optional[list[str]] = None,
+        difficulties: Optional[list[str]] = None,
+        prefer_topic: Optional[str] = None
+    ) -> list[dict]:
+        docs = await sample_least_used_questions(mongo_filter(age, exclude, topics, difficulties), count, prefer_topic)
+        return self.with_string_ids(docs)
+
+    @staticmethod
+    def with_string_ids(docs: list[dict]) -> list[dict]:
+        for doc in docs:
+            doc['_id'] = str(doc['_id'])
+        return docs
+
+    def record_usage(self, counts: dict):
+        record_usage_mongo(counts)
+
+    def cell_counts(self, max_used: Optional[int] = None) -> dict:
+        db = get_db_connection()
+        if max_used is None:
+            cell_counts = read_stats_counters(db) if STATS_COUNTERS else None
+            return cell_counts if cell_counts is not None else aggregate_cell_counts(db)
+        # $not also matches questions with no used_count yet
+        return aggregate_cell_counts(db, {"used_count": {"$not": {"$gt": max_used}}})
+
+    def iter_chunks(self, chunk_size: int = 1000) -> Iterator[list[dict]]:
+        cursor = get_db_connection().questions.find({}, batch_size=chunk_size).sort("_id", 1)
+        chunk = []
+        for doc in cursor:
+            chunk.append(doc)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def iter_questions(self, topics: Optional[set] = None) -> Iterator[dict]:
+        query = {} if topics is None else {"topic": {"$in": sorted(topics)}}
+        return get_db_connection().questions.find(query).sort("_id", 1).batch_size(1000)
+
+    def band_candidates(self, topic: str, bands: list[int]) -> Iterable[dict]:
+        return self.with_string_ids(list(get_db_connection().questions.find({"topic": topic, "dedup_bands": {"$in": bands}})))
+
+    def delete(self, question_ids: list) -> int:
+        collection = get_db_connection().questions
+        ids = object_ids(question_ids)
+        deleted = 0
+        for i in range(0, len(ids), 1000):
+            deleted += collection.delete_many({"_id": {"$in": ids[i:i + 1000]}}).deleted_count
+        if deleted and STATS_COUNTERS:
+            rebuild_stats_counters()
+        return deleted
+
+    def import_writer(self, mode: str):
+        db = get_db_connection()
+        duplicates = create_content_hash_index(db.questions)
+        if duplicates is not None:
+            # Without the unique index plain inserts can't tell stored questions apart
+            print(
+                f"content_hash index not created, {duplicates['duplicate_questions']} stored questions are duplicates "
+                f"({duplicates['hint']}); importing with upserts",
+                file=sys.stderr
+            )
+            mode = "upsert"
+
+        def write(records: list[dict]) -> tuple[int, int]:
+            inserted, existing, new_records = import_chunk_mongo(db.questions, records, mode)
+            if STATS_COUNTERS and new_records:
+                db.stats.update_one({"_id": STATS_COUNTERS_ID}, {"$inc": counter_increments(new_records)}, upsert=True)
+            return inserted, existing
+
+        return write
+
+    def load_seen_doc(self, player: str) -> Optional[dict]:
+        return get_db_connection().seen_questions.find_one({"_id": player})
+
+    def update_seen_doc(self, player: str, update) -> dict:
+        from pymongo.errors import DuplicateKeyError
+
+        collection = get_db_connection().seen_questions
+        # Optimistic concurrency: retry if another submit for the player won the race
+        for _ in range(5):
+            doc = collection.find_one({"_id": player})
+            revision = doc.get("revision", 0) if doc else 0
+            new_doc = {**update(doc), "revision": revision + 1}
+            if doc is None:
+                try:
+                    collection.insert_one({"_id": player, **new_doc})
+                    return new_doc
+                except DuplicateKeyError:
+                    continue
+            if collection.replace_one({"_id": player, "revision": revision}, new_doc).matched_count:
+                return new_doc
+        raise RuntimeError(f"Could not update seen questions for {player}")
+
+    def warm_up(self):
+        get_db_connection()
+
+
+_mongo_store = MongoQuestionStore()
+
+
+def get_question_store() -> QuestionStore:
+    """The question store selected by STORAGE_BACKEND"""
+    if USE_FILE_STORAGE:
+        return get_question_catalogue()
+    if STORAGE_BACKEND == "sqlite":
+        return get_sqlite_store()
+    return _mongo_store
+
+
+class UsageRecorder:
+    """
+    Write-behind used_count updates. Served question ids are counted in
+    memory and written back as one batch per flush, so serving a quiz costs
+    no writes of its own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def record(self, question_ids) -> int:
+        """Count questions as served once more, returning the ids waiting for a flush"""
+        with self.lock:
+            for question_id in question_ids:
+                self.pending[question_id] = self.pending.get(question_id, 0) + 1
+            return len(self.pending)
+
+    @timed("usage.flush")
+    def flush(self) -> int:
+        """Write the pending counts to the store, returning how many questions were updated"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+
+        try:
+            get_question_store().record_usage(pending)
+        except Exception as e:
+            # Keep the counts for the next flush
+            with self.lock:
+                for question_id, n in pending.items():
+                    self.pending[question_id] = self.pending.get(question_id, 0) + n
+            print(f"Usage counters not flushed: {e}", file=sys.stderr)
+            return 0
+
+        count_event("usage_flushed", sum(pending.values()))
+        return len(pending)
+
+
+usage_recorder = UsageRecorder()
+
+
+def record_usage(question_ids) -> int:
+    """Record served questions for the next usage flush (no-op with USAGE_TRACKING off)"""
+    if not USAGE_TRACKING:
+        return 0
+    return usage_recorder.record(str(question_id) for question_id in question_ids)
+
+
+def flush_usage() -> int:
+    """Write the recorded usage now"""
+    return usage_recorder.flush()
+
+
+async def flush_usage_periodically(interval: float):
+    """Flush recorded usage every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(flush_usage)
+
+
+class SeenSet:
+    """
+    Compact record of the questions a player has seen.
+    Two rotating Bloom filters: when the current one holds `capacity` ids it
+    becomes the previous one and a fresh filter starts, so size and
+    false-positive rate stay fixed and only very old questions come back.
+    A set stored under other SEEN_CAPACITY/SEEN_ERROR_RATE settings is
+    rebuilt at the new ones, its filters kept as `older` and still checked
+    until the first rotation.
+    """
+
+    def __init__(self, capacity: int = SEEN_CAPACITY, error_rate: float = SEEN_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.current = bytearray((self.bits + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+        self.older = None  # SeenSet with other settings, dropped on the next rotation
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.sha256(str(item).encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, item: str) -> bool:
+        positions = self._positions(item)
+        return any(
+            all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+            for bits in (self.current, self.previous)
+        ) or (self.older is not None and item in self.older)
+
+    def add(self, item: str) -> bool:
+        """Record an id, returning False if it was (probably) already there"""
+        if item in self:
+            return False
+        if self.count >= self.capacity:
+            self.previous = self.current
+            self.current = bytearray(len(self.previous))
+            self.count = 0
+            self.older = None
+        for p in self._positions(item):
+            self.current[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+        return True
+
+    def to_doc(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "count": self.count,
+            "current": base64.b64encode(bytes(self.current)).decode(),
+            "previous": base64.b64encode(bytes(self.previous)).decode(),
+            "older": self.older.to_doc() if self.older is not None else None
+        }
+
+    @classmethod
+    def from_doc(cls, doc: dict, capacity: int = SEEN_CAPACITY, error_rate: float = SEEN_ERROR_RATE) -> "SeenSet":
+        """Load a stored set, rebuilt at `capacity` and `error_rate` if it was stored with others"""
+        seen = cls(doc["capacity"], doc["error_rate"])
+        current = bytearray(base64.b64decode(doc["current"]))
+        previous = bytearray(base64.b64decode(doc["previous"]))
+        # Filters that don't match their own settings are damaged, start over
+        if len(current) == len(seen.current) == len(previous):
+            seen.current = current
+            seen.previous = previous
+            seen.count = doc["count"]
+        if doc.get("older"):
+            older = doc["older"]
+            seen.older = cls.from_doc(older, older["capacity"], older["error_rate"])
+
+        if (seen.capacity, seen.error_rate) == (capacity, error_rate):
+            return seen
+        rebuilt = cls(capacity, error_rate)
+        rebuilt.older = seen
+        return rebuilt
+
+
+def unseen_sample_size(missing: int, sampled: int, accepted: int) -> int:
+    """Candidates to draw next so that about `missing` of them pass the seen filter"""
+    if not sampled:
+        return missing * 2
+    rate = max(accepted / sampled, 0.05)
+    return min(math.ceil(missing / rate * 1.25), missing * 20)
+
+
+def seen_path(player: str) -> str:
+    """File holding a player's seen set in file storage mode"""
+    digest = hashlib.sha1(player.encode()).hexdigest()
+    return os.path.join(QUESTIONS_DIR, "seen", digest + ".json")
+
+
+@timed("seen.load")
+def load_seen_set(player: str) -> SeenSet:
+    """Load a player's seen set, or an empty one"""
+    doc = get_question_store().load_seen_doc(player)
+    return SeenSet.from_doc(doc) if doc else SeenSet()
+
+
+@timed("seen.record")
+def record_seen(player: str, question_ids: list[str]) -> dict:
+    """Add answered question ids to a player's seen set"""
+    result = {}
+
+    def update(doc: Optional[dict]) -> dict:
+        seen = SeenSet.from_doc(doc) if doc else SeenSet()
+        result["added"] = sum(1 for question_id in question_ids if seen.add(question_id))
+        result["bytes"] = len(seen.current) + len(seen.previous)
+        return seen.to_doc()
+
+    get_question_store().update_seen_doc(player, update)
+    return {"status": "success", "player": player, **result}
+
+
+class Leaderboard(ABC):
+    """
+    Player totals with top-K and rank-of-player queries.
+    Submissions are atomic increments. The top-K list is cached until a write
+    through this process, a change to version(), or LEADERBOARD_CACHE_TTL.
+    """
+
+    name = "base"
+    cache_ttl = None  # Seconds; None reads LEADERBOARD_CACHE_TTL
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.top_cache = None  # (version, expires, limit, rows)
+
+    def version(self):
+        """Token that changes whenever the totals do (None when writes elsewhere can't be seen)"""
+        return None
+
+    def submit(self, name: str, points: int, age: Optional[int] = None) -> dict:
+        """Add `points` and one game to a player's total, returning the new entry with its rank"""
+        entry = self._submit(name, points, age)
+        with self.lock:
+            self.top_cache = None
+        return entry
+
+    def top(self, k: int) -> list[dict]:
+        """The `k` best players, highest score first (ties by name)"""
+        with self.lock:
+            version = self.version()
+            cached = self.top_cache
+            if cached and cached[0] == version and time.monotonic() < cached[1] and k <= cached[2]:
+                count_event("leaderboard_cache_hit")
+                return cached[3][:k]
+
+            rows = self._top(k)
+            ttl = LEADERBOARD_CACHE_TTL if self.cache_ttl is None else self.cache_ttl
+            self.top_cache = (version, time.monotonic() + ttl, k, rows)
+            return rows
+
+    @abstractmethod
+    def rank(self, name: str) -> Optional[dict]:
+        """A player's entry with its rank (1 + players with a higher score), or None"""
+
+    @abstractmethod
+    def players(self) -> int:
+        """Number of players on the board"""
+
+    @abstractmethod
+    def _submit(self, name: str, points: int, age: Optional[int]) -> dict:
+        """Apply one submission atomically, returning the player's entry with its rank"""
+
+    @abstractmethod
+    def _top(self, k: int) -> list[dict]:
+        """The `k` best players, ranked, read from storage"""
+
+
+def ranked(rows: list[dict]) -> list[dict]:
+    """Number top-K rows (highest score first), tied players sharing the rank of the first of them"""
+    for i, row in enumerate(rows):
+        row["rank"] = rows[i - 1]["rank"] if i and row["score"] == rows[i - 1]["score"] else i + 1
+    return rows
+
+
+class SortedKeys:
+    """
+    Sorted sequence kept as a list of sorted buckets of about `load` keys.
+    Adding or removing a key shifts one bucket, O(load), rather than the
+    whole sequence. Rank lookups bisect the bucket maxima and sum the sizes
+    of the buckets below in a Fenwick tree, O(log n) keys and buckets.
+    """
+
+    def __init__(self, load: int = 512):
+        self.load = load
+        self.buckets = []  # Sorted lists, each key below every key of the next bucket
+        self.maxes = []  # Last key of each bucket
+        self.size = 0
+        self.counts = None  # Fenwick tree of bucket sizes, rebuilt when buckets split or go away
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, key):
+        self.size += 1
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            self.counts = None
+            return
+        i = min(bisect_left(self.maxes, key), len(self.maxes) - 1)
+        bucket = self.buckets[i]
+        insort(bucket, key)
+        self.maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.load:
+            self.buckets[i:i + 1] = [bucket[:self.load], bucket[self.load:]]
+            self.maxes[i:i + 1] = [bucket[self.load - 1], bucket[-1]]
+            self.counts = None
+        else:
+            self._count(i, 1)
+
+    def remove(self, key):
+        i = bisect_left(self.maxes, key)
+        bucket = self.buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        self.size -= 1
+        if bucket:
+            self.maxes[i] = bucket[-1]
+            self._count(i, -1)
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+            self.counts = None
+
+    def _count(self, i: int, delta: int):
+        """Change the size of bucket `i` in the Fenwick tree (if built)"""
+        if self.counts is None:
+            return
+        i += 1
+        while i < len(self.counts):
+            self.counts[i] += delta
+            i += i & -i
+
+    def _below(self, i: int) -> int:
+        """Number of keys in the first `i` buckets"""
+        if self.counts is None:
+            counts = [0] + [len(bucket) for bucket in self.buckets]
+            for j in range(1, len(counts)):
+                parent = j + (j & -j)
+                if parent < len(counts):
+                    counts[parent] += counts[j]
+            self.counts = counts
+        below = 0
+        while i:
+            below += self.counts[i]
+            i -= i & -i
+        return below
+
+    def index(self, key) -> int:
+        """Number of keys below `key`"""
+        i = bisect_left(self.maxes, key)
+        below = self._below(i)
+        if i < len(self.buckets):
+            below += bisect_left(self.buckets[i], key)
+        return below
+
+    def first(self, k: int) -> list:
+        """The `k` smallest keys"""
+        keys = []
+        for bucket in self.buckets:
+            if len(keys) >= k:
+                break
+            keys.extend(bucket[:k - len(keys)])
+        return keys
+
+
+def read_leaderboard_log(path: str, offset: int = 0) -> Iterator[tuple[int, dict]]:
+    """
+    Yield (end offset, record) for each complete line of the leaderboard log
+    from `offset`, with None for a line that doesn't parse
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Write still in progress
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield offset, record
+
+
+def compact_leaderboard() -> dict:
+    """
+    Rewrite the leaderboard log with one record per player, holding the sum
+    of that player's submissions. leaderboard.json is left alone, the folded
+    records are still increments on top of it.
+    """
+    log_path = questions_path(LEADERBOARD_LOG)
+    if not os.path.exists(log_path):
+        return {"status": "success", "records_before": 0, "players": 0}
+
+    with _file_lock, locked_file(log_path + ".lock", exclusive=True):
+        records = 0
+        totals = {}  # name -> folded record
+        for _, record in read_leaderboard_log(log_path):
+            if record is None:
+                continue
+            records += 1
+            total = totals.setdefault(record['name'], {"name": record['name'], "points": 0, "games": 0, "age": None})
+            total["points"] += int(record.get('points') or 0)
+            total["games"] += int(record.get('games', 1))
+            if record.get('age') is not None:
+                total["age"] = record['age']
+
+        tmp_path = log_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for total in totals.values():
+                f.write(json.dumps(total) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, log_path)
+
+    return {"status": "success", "records_before": records, "players": len(totals)}
+
+
+class FileLeaderboard(Leaderboard):
+    """
+    Leaderboard on an append-only log of score increments, on top of the
+    legacy leaderboard.json totals. Totals are kept in memory with the
+    (-score, name) keys in a SortedKeys, so a submission, rank lookup or
+    top-K doesn't touch every player. The log is re-read incrementally as it
+    grows, and folded to one line per player (compact_leaderboard) once it
+    is much longer than the board so a new process doesn't replay every
+    submission ever made.
+    """
+
+    name = "file"
+    cache_ttl = math.inf  # version() sees every write
+
+    def __init__(self):
+        super().__init__()
+        self._reset()
+
+    def _reset(self):
+        self.entries = {}  # name -> [score, games, age]
+        self.order = SortedKeys()  # (-score, name)
+        self.legacy_signature = None
+        self.log_inode = None
+        self.log_offset = 0
+        self.log_lines = 0
+
+    def refresh(self):
+        """Pick up appended submissions, or reload if a file was replaced"""
+        legacy_signature = file_signature(questions_path(LEADERBOARD_FILE))
+        log_signature = file_signature(questions_path(LEADERBOARD_LOG))
+        log_inode = log_signature[0] if log_signature else None
+        log_size = log_signature[1] if log_signature else 0
+
+        if legacy_signature != self.legacy_signature or log_inode != self.log_inode or log_size < self.log_offset:
+            self._reset()
+            self.legacy_signature = legacy_signature
+            self.log_inode = log_inode
+            if legacy_signature:
+                try:
+                    with open(questions_path(LEADERBOARD_FILE), 'r') as f:
+                        legacy = json.load(f)
+                except ValueError:
+                    # Rewritten without a lock by the old submit.php
+                    print("Skipping unreadable legacy leaderboard", file=sys.stderr)
+                    legacy = []
+                for player in legacy:
+                    if player.get('name'):
+                        self._apply(player['name'], int(player.get('score') or 0), int(player.get('games') or 0), player.get('age'))
+
+        if log_size > self.log_offset:
+            for self.log_offset, record in read_leaderboard_log(questions_path(LEADERBOARD_LOG), self.log_offset):
+                self.log_lines += 1
+                if record is not None:
+                    self._apply(record['name'], int(record.get('points') or 0), int(record.get('games', 1)), record.get('age'))
+
+    def _apply(self, name: str, points: int, games: int, age):
+        """Add to a player's total, keeping `order` sorted"""
+        entry = self.entries.get(name)
+        if entry is None:
+            entry = self.entries[name] = [0, 0, None]
+        else:
+            self.order.remove((-entry[0], name))
+        entry[0] += points
+        entry[1] += games
+        if age is not None:
+            entry[2] = age
+        self.order.add((-entry[0], name))
+
+    def version(self):
+        self.refresh()
+        return (self.legacy_signature, self.log_inode, self.log_offset)
+
+    def _entry(self, name: str) -> Optional[dict]:
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        return {
+            "name": name,
+            "score": entry[0],
+            "games": entry[1],
+            "age": entry[2],
+            "rank": self.order.index((-entry[0], "")) + 1
+        }
+
+    @timed("leaderboard.submit")
+    def _submit(self, name: str, points: int, age: Optional[int]) -> dict:
+        record = {"name": name, "points": points, "games": 1, "age": age, "at": datetime.utcnow().isoformat()}
+        log_path = questions_path(LEADERBOARD_LOG)
+        append_to_log(log_path, (json.dumps(record) + "\n").encode(), log_path + ".lock")
+        with self.lock:
+            self.refresh()
+            if self.log_lines >= max(LEADERBOARD_COMPACT_LINES, 2 * len(self.entries)):
+                compact_leaderboard()
+                self.refresh()
+            return self._entry(name)
+
+    def _top(self, k: int) -> list[dict]:
+        rows = []
+        for _, name in self.order.first(k):
+            score, games, age = self.entries[name]
+            rows.append({"name": name, "score": score, "games": games, "age": age})
+        return ranked(rows)
+
+    def rank(self, name: str) -> Optional[dict]:
+        with self.lock:
+            self.refresh()
+            return self._entry(name)
+
+    def players(self) -> int:
+        with self.lock:
+            self.refresh()
+            return len(self.entries)
+
+
+class SQLiteLeaderboard(Leaderboard):
+    """
+    Leaderboard table in the SQLite store, an upsert per submission and a
+    (score DESC, name) index. A rank counts the players above on that index,
+    so its cost grows with the rank: cheap near the top, a walk over most of
+    the index for players near the bottom of a large board.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, store: SQLiteQuestionStore):
+        super().__init__()
+        self.store = store
+
+    @staticmethod
+    def row_entry(row: tuple) -> dict:
+        name, score, games, age = row
+        return {"name": name, "score": score, "games": games, "age": age}
+
+    @timed("leaderboard.submit")
+    def _submit(self, name: str, points: int, age: Optional[int]) -> dict:
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT INTO leaderboard (name, score, games, age, updated_at) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET score = score + excluded.score, games = games + 1, "
+                "age = coalesce(excluded.age, age), updated_at = excluded.updated_at",
+                (name, points, age, datetime.utcnow().isoformat())
+            )
+            return self._rank(conn, name)
+
+    def _rank(self, conn: sqlite3.Connection, name: str) -> Optional[dict]:
+        row = conn.execute("SELECT name, score, games, age FROM leaderboard WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        entry = self.row_entry(row)
+        higher = conn.execute("SELECT count(*) FROM leaderboard WHERE score > ?", (entry["score"],)).fetchone()[0]
+        entry["rank"] = higher + 1
+        return entry
+
+    def _top(self, k: int) -> list[dict]:
+        conn = self.store.connection()
+        rows = [
+            self.row_entry(row)
+            for row in conn.execute(
+                "SELECT name, score, games, age FROM leaderboard ORDER BY score DESC, name LIMIT ?", (k,)
+            )
+        ]
+        return ranked(rows)
+
+    def rank(self, name: str) -> Optional[dict]:
+        return self._rank(self.store.connection(), name)
+
+    def players(self) -> int:
+        return self.store.connection().execute("SELECT count(*) FROM leaderboard").fetchone()[0]
+
+
+class MongoLeaderboard(Leaderboard):
+    """
+    Leaderboard collection with one $inc upsert per submission and the
+    LEADERBOARD_INDEXES (created by the indexes command). A rank counts the
+    players above on the score index, so like SQLiteLeaderboard its cost
+    grows with the rank.
+    """
+
+    name = "mongodb"
+
+    def __init__(self):
+        super().__init__()
+        self.collection = get_db_connection().leaderboard
+
+    @staticmethod
+    def doc_entry(doc: dict) -> dict:
+        return {"name": doc["name"], "score": doc.get("score", 0), "games": doc.get("games", 0), "age": doc.get("age")}
+
+    @timed("leaderboard.submit")
+    def _submit(self, name: str, points: int, age: Optional[int]) -> dict:
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+
+        update = {"$inc": {"score": points, "games": 1}, "$set": {"updated_at": datetime.utcnow()}}
+        if age is not None:
+            update["$set"]["age"] = age
+        try:
+            doc = self.collection.find_one_and_update(
+                {"name": name}, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Two first submissions raced on the upsert, the loser is now a plain update
+            doc = self.collection.find_one_and_update({"name": name}, update, return_document=ReturnDocument.AFTER)
+        return self._rank(doc)
+
+    def _rank(self, doc: Optional[dict]) -> Optional[dict]:
+        if doc is None:
+            return None
+        entry = self.doc_entry(doc)
+        entry["rank"] = self.collection.count_documents({"score": {"$gt": entry["score"]}}) + 1
+        return entry
+
+    def _top(self, k: int) -> list[dict]:
+        cursor = self.collection.find({}, {"_id": 0}).sort([("score", -1), ("name", 1)]).limit(k)
+        return ranked([self.doc_entry(doc) for doc in cursor])
+
+    def rank(self, name: str) -> Optional[dict]:
+        return self._rank(self.collection.find_one({"name": name}))
+
+    def players(self) -> int:
+        return self.collection.estimated_document_count()
+
+
+_leaderboard: Optional[Leaderboard] = None
+
+
+def get_leaderboard() -> Leaderboard:
+    """Get the process-wide leaderboard on the configured storage backend"""
+    global _leaderboard
+    if _leaderboard is None:
+        if USE_FILE_STORAGE:
+            _leaderboard = FileLeaderboard()
+        elif STORAGE_BACKEND == "sqlite":
+            _leaderboard = SQLiteLeaderboard(get_sqlite_store())
+        else:
+            _leaderboard = MongoLeaderboard()
+    return _leaderboard
+
+
+def leaderboard_query(
+    top: Optional[int] = None,
+    player: Optional[str] = None,
+    points: Optional[int] = None,
+    age: Optional[int] = None
+) -> dict:
+    """
+    Record a submission (`player` and `points`) and/or read the top `top`
+    players and `player`'s rank, in one call
+    """
+    board = get_leaderboard()
+    result = {"status": "success", "storage": board.name}
+    if player is not None:
+        if points is not None:
+            result["player"] = board.submit(player, points, age)
+        else:
+            result["player"] = board.rank(player)
+    if top:
+        result["top"] = board.top(top)
+        result["players"] = board.players()
+    return result
+
+
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240601)
+_MINHASH_PARAMS = [
+    (_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(0, _MINHASH_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+
+def normalize_question_text(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def minhash_signature(text: str) -> tuple:
+    """MinHash signature over the character 4-grams of normalized text"""
+    padded = f" {text} "
+    shingles = {padded[i:i + 4] for i in range(max(1, len(padded) - 3))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') for s in shingles]
+    return tuple(min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_PARAMS)
+
+
+def band_keys(signature: tuple) -> list[int]:
+    """LSH band keys of a MinHash signature, as signed 64-bit ints"""
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    return [
+        int.from_bytes(
+            hashlib.blake2b(repr((band, signature[band * rows:(band + 1) * rows])).encode(), digest_size=8).digest(),
+            'big', signed=True
+        )
+        for band in range(MINHASH_BANDS)
+    ]
+
+
+def stamp_dedup_bands(q: dict) -> list[int]:
+    """A question's dedup_bands, computed and set if it has none yet"""
+    if not q.get('dedup_bands'):
+        q['dedup_bands'] = band_keys(minhash_signature(normalize_question_text(q.get('question') or "")))
+    return q['dedup_bands']
+
+
+class DuplicateIndex:
+    """Exact-hash and MinHash/LSH index of a set of questions in one topic"""
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.hashes = {}  # Digest of normalized text -> doc it was indexed with
+        self.signatures = []
+        self.buckets = {}
+
+    def check_and_add(self, text: str, doc: Optional[dict] = None) -> tuple[Optional[str], Optional[dict]]:
+        """
+        Return ("exact" or "near", doc of the question it repeats) for a
+        duplicate, otherwise index the text along with `doc` and return (None, None)
+        """
+        normalized = normalize_question_text(text or "")
+        digest = hashlib.sha1(normalized.encode()).digest()
+        if digest in self.hashes:
+            return "exact", self.hashes[digest]
+
+        signature = minhash_signature(normalized)
+        bands = band_keys(signature)
+
+        candidates = set()
+        for band in bands:
+            candidates.update(self.buckets.get(band, ()))
+        for candidate in candidates:
+            other = self.signatures[candidate]
+            similarity = sum(1 for x, y in zip(signature, other) if x == y) / MINHASH_PERMUTATIONS
+            if similarity >= self.threshold:
+                return "near", None
+
+        number = len(self.signatures)
+        self.hashes[digest] = doc
+        self.signatures.append(signature)
+        for band in bands:
+            self.buckets.setdefault(band, []).append(number)
+        return None, None
+
+
+@timed("dedup.load_index")
+def load_duplicate_indexes(bands_by_topic: dict) -> dict:
+    """
+    Duplicate indexes per topic holding only the stored questions that share
+    an LSH band with the batch, found through their stored dedup_bands
+    """
+    indexes = {topic: DuplicateIndex() for topic in bands_by_topic}
+    store = get_question_store()
+    try:
+        for topic, bands in bands_by_topic.items():
+            for q in store.band_candidates(topic, sorted(bands)):
+                indexes[topic].check_and_add(q.get('question', ''), q)
+    except Exception as e:
+        print(f"Duplicate index not loaded, checking batch only: {e}", file=sys.stderr)
+    return indexes
+
+
+@timed("dedup.check")
+def drop_duplicates(questions: list[dict], existing: Optional[list] = None) -> int:
+    """
+    Remove exact and near-duplicate questions from a batch in place.
+    Checks against stored questions of the same topic and earlier items in
+    the batch. In "flag" mode duplicates are kept and marked instead.
+    The stored copies of exact duplicates are appended to `existing`.
+    Returns the number of duplicates found.
+    """
+    if DEDUP_MODE == "off" or not questions:
+        return 0
+
+    bands_by_topic = {}
+    for q in questions:
+        bands_by_topic.setdefault(q.get('topic'), set()).update(stamp_dedup_bands(q))
+    indexes = load_duplicate_indexes(bands_by_topic)
+
+    kept = []
+    rejected = 0
+    for q in questions:
+        reason, match = indexes[q.get('topic')].check_and_add(q.get('question', ''))
+        if reason is None:
+            kept.append(q)
+            continue
+        rejected += 1
+        if reason == "exact" and match is not None and existing is not None:
+            existing.append(match)
+        if DEDUP_MODE == "flag":
+            q['duplicate'] = reason
+            kept.append(q)
+
+    # Reported as "duplicates" in generate results, stderr is part of generate.php's output
+    count_event("duplicates_dropped", rejected)
+    questions[:] = kept
+    return rejected
+
+
+def dedup_corpus(apply: bool = False) -> dict:
+    """
+    Find duplicates in the stored corpus (oldest kept), streaming one topic
+    at a time so only the largest topic's signatures are held in memory.
+    With `apply` the duplicates are deleted.
+    """
+    duplicate_ids = []
+    by_reason = {"exact": 0, "near": 0}
+    scanned = 0
+
+    store = get_question_store()
+    for topic in sorted({key[0] for key in store.cell_counts()}, key=str):
+        index = DuplicateIndex()
+        for q in store.iter_questions(topics={topic}):
+            scanned += 1
+            reason, _ = index.check_and_add(q.get('question', ''))
+            if reason is not None:
+                by_reason[reason] += 1
+                duplicate_ids.append(q['_id'])
+
+    deleted = 0
+    if apply and duplicate_ids:
+        deleted = store.delete(duplicate_ids)
+
+    return {
+        "status": "success",
+        "scanned": scanned,
+        "duplicates": len(duplicate_ids),
+        "by_reason": by_reason,
+        "deleted": deleted
+    }
+
+
+def snapshot_default(value):
+    """JSON encoding for ObjectIds and datetimes in snapshots"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+@contextmanager
+def open_snapshot(path: str, mode: str, compress: Optional[bool] = None) -> Iterator:
+    """
+    Open a JSONL snapshot for text reading ("r") or writing ("w"). "-" is
+    stdin/stdout. Writes are gzipped when `compress` is set or the path ends
+    in .gz; reads detect gzip from the magic bytes.
+    """
+    if path == "-":
+        stream = sys.stdin.buffer if mode == "r" else sys.stdout.buffer
+        if mode == "r" and stream.peek(2)[:2] == b"\x1f\x8b" or mode == "w" and compress:
+            # Closing the gzip file flushes its trailer but leaves stdin/stdout open
+            with gzip.open(stream, mode + "t", encoding="utf-8") as f:
+                yield f
+        else:
+            yield sys.stdin if mode == "r" else sys.stdout
+            sys.stdout.flush()
+        return
+
+    if mode == "r":
+        with open(path, "rb") as f:
+            gzipped = f.read(2) == b"\x1f\x8b"
+    else:
+        gzipped = path.endswith(".gz") if compress is None else compress
+    with (gzip.open(path, mode + "t", encoding="utf-8") if gzipped else open(path, mode, encoding="utf-8")) as f:
+        yield f
+
+
+def export_questions(path: str = "-", chunk_size: int = 1000, compress: Optional[bool] = None) -> dict:
+    """Write the corpus as a JSONL snapshot, one question per line"""
+    exported = 0
+    started = time.monotonic()
+    with open_snapshot(path, "w", compress) as f:
+        for chunk in get_question_store().iter_chunks(chunk_size):
+            for q in chunk:
+                if 'content_hash' not in q:
+                    q['content_hash'] = content_hash(q)
+                f.write(json.dumps(q, default=snapshot_default) + "\n")
+            exported += len(chunk)
+            if path != "-":
+                emit_progress("exported", questions=exported, elapsed=round(time.monotonic() - started, 2))
+
+    return {"status": "success", "exported": exported, "path": path}
+
+
+# Fields every imported record must have
+SNAPSHOT_REQUIRED = ("question", "options", "correct", "explanation", "difficulty", "topic", "age_min", "age_max")
+
+
+def snapshot_record(line: str) -> Optional[dict]:
+    """Parse one snapshot line into a question ready to store, or None if invalid"""
+    try:
+        q = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(q, dict) or any(field not in q for field in SNAPSHOT_REQUIRED):
+        return None
+    if not isinstance(q['options'], list) or len(q['options']) != 4:
+        return None
+
+    q['topic'] = normalize_topic(q['topic'])
+    q['content_hash'] = content_hash(q)
+    stamp_dedup_bands(q)
+    q.setdefault('used_count', 0)
+    q.setdefault('random_key', random.random())
+    return q
+
+
+def load_import_checkpoint(checkpoint: str, path: str) -> tuple[int, dict]:
+    """Lines of `path` already imported according to `checkpoint`, and the totals so far"""
+    totals = {"inserted": 0, "existing": 0, "invalid": 0}
+    try:
+        with open(checkpoint, 'r') as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return 0, totals
+    if state.get("input") != os.path.abspath(path):
+        return 0, totals
+    return int(state.get("lines", 0)), {key: int(state.get(key, 0)) for key in totals}
+
+
+def save_import_checkpoint(checkpoint: str, path: str, lines: int, totals: dict):
+    """Atomically record that the first `lines` lines of `path` are imported"""
+    tmp_path = checkpoint + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"input": os.path.abspath(path), "lines": lines, **totals}, f)
+    os.replace(tmp_path, checkpoint)
+
+
+def import_chunk_mongo(collection, records: list[dict], mode: str) -> tuple[int, int, list[dict]]:
+    """
+    Write one chunk with unordered bulk operations.
+    Returns (inserted, already present, inserted records).
+    """
+    from bson import ObjectId
+    from pymongo import InsertOne, UpdateOne
+    from pymongo.errors import BulkWriteError
+
+    for q in records:
+        if isinstance(q.get('_id'), str) and ObjectId.is_valid(q['_id']):
+            q['_id'] = ObjectId(q['_id'])
+        else:
+            q.pop('_id', None)
+        if isinstance(q.get('created_at'), str):
+            try:
+                q['created_at'] = datetime.fromisoformat(q['created_at'])
+            except ValueError:
+                q['created_at'] = datetime.utcnow()
+        q.setdefault('created_at', datetime.utcnow())
+
+    if mode == "insert":
+        operations = [InsertOne(q) for q in records]
+    else:
+        operations = [UpdateOne({"content_hash": q['content_hash']}, {"$setOnInsert": q}, upsert=True) for q in records]
+
+    try:
+        result = collection.bulk_write(operations, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        # Duplicate keys are questions that are already there, anything else is fatal
+        if any(error.get("code") != 11000 for error in details.get("writeErrors", [])):
+            raise
+
+    if mode == "insert":
+        failed = {error["index"] for error in details.get("writeErrors", [])}
+        inserted = [q for i, q in enumerate(records) if i not in failed]
+    else:
+        inserted = [records[u["index"]] for u in details.get("upserted", [])]
+    return len(inserted), len(records) - len(inserted), inserted
+
+
+def import_questions(
+    path: str,
+    chunk_size: int = 1000,
+    mode: str = "upsert",
+    checkpoint: Optional[str] = None,
+    resume: bool = True
+) -> dict:
+    """
+    Stream a JSONL snapshot into the configured store in fixed-size chunks.
+    Questions are keyed by content hash, so re-importing skips the ones
+    already stored. Progress and running totals are checkpointed after every
+    chunk, and a rerun resumes after the last completed one with totals
+    covering the whole import.
+    """
+    if checkpoint is None and path != "-":
+        checkpoint = path + ".checkpoint"
+    if checkpoint and resume:
+        skip, totals = load_import_checkpoint(checkpoint, path)
+    else:
+        skip, totals = 0, {"inserted": 0, "existing": 0, "invalid": 0}
+
+    writer = get_question_store().import_writer(mode)
+
+    def write_chunk(records: list[dict]):
+        inserted, existing = writer(records)
+        totals["inserted"] += inserted
+        totals["existing"] += existing
+
+    started = time.monotonic()
+    lines = 0
+    chunk = []
+    with open_snapshot(path, "r") as f:
+        for line in f:
+            lines += 1
+            if lines <= skip or not line.strip():
+                continue
+            q = snapshot_record(line)
+            if q is None:
+                totals["invalid"] += 1
+            else:
+                chunk.append(q)
+            if len(chunk) >= chunk_size:
+                write_chunk(chunk)
+                chunk = []
+                if checkpoint:
+                    save_import_checkpoint(checkpoint, path, lines, totals)
+                elapsed = time.monotonic() - started
+                emit_progress(
+                    "imported",
+                    lines=lines,
+                    elapsed=round(elapsed, 2),
+                    questions_per_sec=round((lines - skip) / elapsed, 1) if elapsed else 0,
+                    **totals
+                )
+        if chunk:
+            write_chunk(chunk)
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.unlink(checkpoint)
+
+    return {"status": "success", "lines": lines, "resumed_from": skip, **totals}
+
+
+def build_instructions(context, agent) -> str:
+    """Build dynamic instructions based on context"""
+    ctx = context.context
+    topic_info = TOPICS.get(ctx.topic, {})
+
+    # List valid topic slugs for the AI
+    valid_topics = ", ".join(TOPICS.keys())
+
+    return f"""You are a quiz question generator for Indian Tamil kids aged {ctx.age_min}-{ctx.age_max}.
+
+TOPIC: {topic_info.get('name', ctx.topic)}
+TOPIC SLUG: {ctx.topic}
+DESCRIPTION: {topic_info.get('description', '')}
+EXAMPLES: {topic_info.get('examples', '')}
+DIFFICULTY: {ctx.difficulty}
+GENERATE: {ctx.count} questions
+
+CRITICAL - TOPIC FIELD:
+The "topic" field in each question MUST be EXACTLY: "{ctx.topic}"
+Do NOT use variations like "cricket", "football", "space", etc.
+Use ONLY the exact slug provided above.
+
+VALID TOPIC SLUGS: {valid_topics}
+
+IMPORTANT GUIDELINES:
+1. Questions must be appropriate for kids aged {ctx.age_min}-{ctx.age_max}
+2. Focus on general knowledge that Indian children would find interesting
+3. Include facts about India, Tamil Nadu, and world knowledge
+4. Make questions fun and educational, not too hard
+5. Avoid controversial, religious conflicts, or sensitive topics
+6. Use simple language that kids can understand
+7. Each question must have exactly 4 options
+8. Only ONE option should be correct
+9. Provide a brief, kid-friendly explanation for each answer
+10. Questions should be interesting and make kids curious to learn more
+11. ALWAYS use the exact topic slug "{ctx.topic}" - never use sub-categories or variants
+
+DIFFICULTY LEVELS:
+- easy (age 8-10): Very simple facts, basic knowledge
+- medium (age 11-13): Moderate complexity, some reasoning
+- hard (age 14-16): More detailed knowledge, critical thinking
+
+Generate {ctx.count} unique, interesting questions about {topic_info.get('name', ctx.topic)}.
+Ensure variety - don't repeat similar questions."""
+
+
+@functools.cache
+def get_question_generator():
+    """The question generator agent, created on first use"""
+    from agents import Agent
+    return Agent(
+        name="QuizQuestionGenerator",
+        instructions=build_instructions,
+        model=GENERATOR_MODEL,
+        output_type=question_models().QuestionBatch
+    )
+
+
+def build_batch_instructions(context, agent) -> str:
+    """Build instructions for generating several topic x difficulty cells at once"""
+    cells = []
+    for topic, difficulty, count in context.context.cells:
+        age_min, age_max = DIFFICULTY_AGE_BANDS[difficulty]
+        topic_info = TOPICS.get(topic, {})
+        cells.append(
+            f"- CELL {topic}:{difficulty} - {count} questions about {topic_info.get('name', topic)} "
+            f"({topic_info.get('description', '')}; e.g. {topic_info.get('examples', '')}) "
+            f"for ages {age_min}-{age_max}, topic \"{topic}\", difficulty \"{difficulty}\""
+        )
+    cell_list = "\n".join(cells)
+
+    return f"""You are a quiz question generator for Indian Tamil kids aged 8-16.
+
+Generate questions for EACH of these cells:
+{cell_list}
+
+Return one entry per cell with "cell" set EXACTLY to the cell id (e.g. "sports:easy") and exactly the
+requested number of questions. Every question's "topic", "difficulty", "age_min" and "age_max" MUST
+match its cell. Use ONLY the exact topic slugs above - never sub-categories or variants.
+
+IMPORTANT GUIDELINES:
+1. Questions must be appropriate for the cell's age band
+2. Focus on general knowledge that Indian children would find interesting
+3. Include facts about India, Tamil Nadu, and world knowledge
+4. Make questions fun and educational, not too hard
+5. Avoid controversial, religious conflicts, or sensitive topics
+6. Use simple language that kids can understand
+7. Each question must have exactly 4 options
+8. Only ONE option should be correct
+9. Provide a brief, kid-friendly explanation for each answer
+10. Questions should be interesting and make kids curious to learn more
+
+DIFFICULTY LEVELS:
+- easy (age 8-10): Very simple facts, basic knowledge
+- medium (age 11-13): Moderate complexity, some reasoning
+- hard (age 14-16): More detailed knowledge, critical thinking
+
+Ensure variety - don't repeat similar questions within or across cells."""
+
+
+@functools.cache
+def get_batch_generator():
+    """
+    The multi-cell generator agent, created on first use. It generates
+    several cells per call so the instructions are paid for once.
+    """
+    from agents import Agent
+    return Agent(
+        name="QuizBatchGenerator",
+        instructions=build_batch_instructions,
+        model=GENERATOR_MODEL,
+        output_type=question_models().MultiCellBatch
+    )
+
+
+def warm_up_agents():
+    """Import the agents SDK and build the generator agent ahead of the first call"""
+    get_question_generator()
+    get_runner()
+
+
+_agents_warm_up: Optional[concurrent.futures.Future] = None
+
+
+def agents_warm_up() -> concurrent.futures.Future:
+    """
+    warm_up_agents() started once in a daemon thread. Unlike asyncio.to_thread,
+    asyncio.run and interpreter exit don't wait for it, so a quiz that gives
+    up on generation returns as soon as its deadline passes.
+    """
+    global _agents_warm_up
+    if _agents_warm_up is None:
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()  # Waiters being cancelled can't cancel the warm-up
+
+        def run():
+            global _agents_warm_up
+            try:
+                warm_up_agents()
+            except BaseException as e:
+                _agents_warm_up = None  # Try again on the next call
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+
+        _agents_warm_up = future
+        threading.Thread(target=run, name="agents-warm-up", daemon=True).start()
+    return _agents_warm_up
+
+
+def get_runner():
+    """agents.Runner, unless it was replaced"""
+    global Runner
+    if Runner is None:
+        from agents import Runner
+    return Runner
+
+
+class LLMResponseCache:
+    """
+    Content-addressed on-disk cache of agent outputs.
+    Entries are keyed by a hash of the model, rendered instructions, prompt
+    and prompt version, expire after `ttl` seconds and are evicted oldest
+    first once the cache grows past `max_bytes`. The cache size is kept as a
+    running total, so the directory is only walked when that total goes over
+    the limit, on the first put and every `rescan_every` puts (to pick up
+    entries written by other processes). Eviction goes down to `evict_to`
+    of the limit so the next walk is a while away.
+    """
+
+    rescan_every = 1000
+    evict_to = 0.9
+
+    def __init__(self, directory: str, ttl: int, max_bytes: int, replay: bool = False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.lock = threading.Lock()
+        self.total = None  # Bytes in the cache as of the last walk plus puts since, None before the first walk
+        self.puts = 0
+
+    @staticmethod
+    def key(model: str, instructions: str, prompt: str) -> str:
+        """Cache key for one agent call"""
+        material = json.dumps([PROMPT_VERSION, model, instructions, prompt])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """Cached output for `key`, or None on a miss or expired entry"""
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if not self.replay and time.time() - entry.get("created_at", 0) > self.ttl:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return entry["output"]
+
+    def put(self, key: str, output: dict):
+        """Store an output atomically, then evict if over the size limit"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created_at": time.time(), "output": output}).encode()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.puts += 1
+            if self.total is not None:
+                self.total += len(data) - replaced
+            if self.total is None or self.total > self.max_bytes or self.puts % self.rescan_every == 0:
+                self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the oldest ones until under `evict_to` of max_bytes"""
+        entries = []
+        total = 0
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if not self.replay and now - st.st_mtime > self.ttl:
+                    os.unlink(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        target = self.max_bytes * self.evict_to if total > self.max_bytes else total
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.total = total
+
+
+_llm_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """The configured LLM response cache, or None when caching is off"""
+    global _llm_cache
+    if LLM_CACHE_MODE not in ("on", "replay"):
+        return None
+    if _llm_cache is None:
+        _llm_cache = LLMResponseCache(
+            LLM_CACHE_DIR,
+            ttl=LLM_CACHE_TTL,
+            max_bytes=LLM_CACHE_MAX_BYTES,
+            replay=LLM_CACHE_MODE == "replay"
+        )
+    return _llm_cache
+
+
+def option_key(option: str) -> str:
+    """Case- and whitespace-insensitive form of an answer option"""
+    return " ".join(str(option).split()).casefold()
+
+
+def answer_in_distractor(q: dict) -> bool:
+    options = [option_key(o) for o in q['options']]
+    answer = options[q['correct']]
+    return any(o == answer for i, o in enumerate(options) if i != q['correct'])
+
+
+def duplicate_options(q: dict) -> bool:
+    options = [option_key(o) for o in q['options']]
+    return len(set(options)) < len(options)
+
+
+def age_range(difficulty: str, age_min: Optional[int] = None, age_max: Optional[int] = None) -> tuple[int, int]:
+    """Requested age range, with unset ends taken from the difficulty's age band"""
+    band_min, band_max = DIFFICULTY_AGE_BANDS.get(difficulty, (8, 16))
+    return (band_min if age_min is None else age_min, band_max if age_max is None else age_max)
+
+
+def age_band_mismatch(q: dict, ages: tuple[int, int]) -> bool:
+    return not (ages[0] <= q['age_min'] <= q['age_max'] <= ages[1])
+
+
+# (rule, check(question, topic, difficulty, ages)) pairs run in order against the
+# requested topic, difficulty and age range; a question is rejected by the first failing rule
+VALIDATION_RULES = [
+    ("empty_question", lambda q, topic, difficulty, ages: not q['question'].strip()),
+    ("empty_option", lambda q, topic, difficulty, ages: any(not option_key(o) for o in q['options'])),
+    ("answer_in_distractor", lambda q, topic, difficulty, ages: answer_in_distractor(q)),
+    ("duplicate_options", lambda q, topic, difficulty, ages: duplicate_options(q)),
+    ("empty_explanation", lambda q, topic, difficulty, ages: not q['explanation'].strip()),
+    ("unknown_topic", lambda q, topic, difficulty, ages: normalize_topic(q['topic']) not in TOPICS),
+    ("topic_mismatch", lambda q, topic, difficulty, ages: normalize_topic(q['topic']) != topic),
+    ("difficulty_mismatch", lambda q, topic, difficulty, ages: q['difficulty'] != difficulty),
+    ("age_band_mismatch", lambda q, topic, difficulty, ages: age_band_mismatch(q, ages)),
+]
+
+
+def validate_questions(
+    questions: list[dict],
+    topic: str,
+    difficulty: str,
+    age_min: Optional[int] = None,
+    age_max: Optional[int] = None
+) -> tuple[list[dict], dict]:
+    """
+    Split generated questions into accepted ones (with normalized topics) and
+    per-rule rejection counts for the requested topic, difficulty and age
+    range (the difficulty's age band by default).
+    """
+    ages = age_range(difficulty, age_min, age_max)
+    accepted = []
+    rejected = {}
+    for q in questions:
+        failed = next((rule for rule, check in VALIDATION_RULES if check(q, topic, difficulty, ages)), None)
+        if failed is None:
+            q['topic'] = normalize_topic(q['topic'])
+            accepted.append(q)
+        else:
+            rejected[failed] = rejected.get(failed, 0) + 1
+            count_event(f"rejected_{failed}")
+    return accepted, rejected
+
+
+def merge_counts(total: dict, counts: dict):
+    """Add per-rule counts into a running total"""
+    for rule, n in counts.items():
+        total[rule] = total.get(rule, 0) + n
+
+
+def rejection_feedback(rejected: dict) -> str:
+    """Prompt suffix telling the model why earlier questions were thrown away"""
+    if not rejected:
+        return ""
+    reasons = ", ".join(f"{rule.replace('_', ' ')} ({n})" for rule, n in sorted(rejected.items()))
+    return f" Earlier questions were rejected for: {reasons}. Avoid these problems."
+
+
+async def generate_questions(
+    topic: str,
+    count: int = 10,
+    difficulty: str = "medium",
+    age_min: int = 8,
+    age_max: int = 16,
+    feedback: str = ""
+) -> list[dict]:
+    """Generate quiz questions using the AI agent"""
+
+    if topic not in TOPICS:
+        raise ValueError(f"Invalid topic: {topic}. Valid topics: {list(TOPICS.keys())}")
+
+    context = GeneratorContext(
+        topic=topic,
+        difficulty=difficulty,
+        count=count,
+        age_min=age_min,
+        age_max=age_max
+    )
+
+    prompt = f"Generate {count} {difficulty} difficulty quiz questions about {TOPICS[topic]['name']} for kids aged {age_min}-{age_max}.{feedback}"
+
+    cache = get_llm_cache()
+    if cache is not None:
+        instructions = build_instructions(SimpleNamespace(context=context), None)
+        cache_key = cache.key(GENERATOR_MODEL, instructions, prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            count_event("llm_cache_hits")
+            output = question_models().QuestionBatch.model_validate(cached)
+            return [q.model_dump() for q in output.questions]
+        if cache.replay:
+            raise LookupError(f"No cached response for {topic} ({difficulty}, {count} questions) in replay mode")
+
+    with span("agent"):
+        result = await get_runner().run(
+            get_question_generator(),
+            input=prompt,
+            context=context
+        )
+    count_usage(result)
+
+    output = result.final_output_as(question_models().QuestionBatch)
+    if cache is not None:
+        cache.put(cache_key, output.model_dump())
+    return [q.model_dump() for q in output.questions]
+
+
+async def generate_valid_questions(
+    topic: str,
+    count: int = 10,
+    difficulty: str = "medium",
+    age_min: int = 8,
+    age_max: int = 16,
+    rounds: int = VALIDATION_ROUNDS
+) -> tuple[list[dict], dict, int]:
+    """
+    Generate questions, keep the ones that pass validation and request only
+    the missing count again, for at most `rounds` agent calls.
+    Returns (accepted questions, per-rule rejection counts, rounds used).
+    """
+    accepted = []
+    rejected = {}
+    used = 0
+    while len(accepted) < count and used < max(1, rounds):
+        used += 1
+        try:
+            questions = await generate_questions(
+                topic=topic,
+                count=count - len(accepted),
+                difficulty=difficulty,
+                age_min=age_min,
+                age_max=age_max,
+                feedback=rejection_feedback(rejected)
+            )
+        except LookupError:
+            # Replay mode has no cached answer for a follow-up round
+            if not used > 1:
+                raise
+            break
+
+        if not questions:
+            break  # Asking again for nothing back won't help
+
+        valid, round_rejected = validate_questions(questions, topic, difficulty, age_min, age_max)
+        accepted.extend(valid[:count - len(accepted)])
+        merge_counts(rejected, round_rejected)
+
+    return accepted, rejected, used
+
+
+class QuestionStreamParser:
+    """
+    Incrementally pull complete question objects out of a streamed
+    {"questions": [{...}, {...}]} JSON document.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.current = None  # Characters of the question being read
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text: str) -> list[dict]:
+        """Consume a text delta, returning any questions completed by it"""
+        completed = []
+        for ch in text:
+            if self.current is not None:
+                self.current.append(ch)
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+
+            if ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                self.depth += 1
+                # Depth 3 is an object inside the questions array
+                if ch == '{' and self.depth == 3:
+                    self.current = ['{']
+            elif ch in '}]':
+                self.depth -= 1
+                if ch == '}' and self.depth == 2 and self.current is not None:
+                    try:
+                        completed.append(question_models().QuizQuestion.model_validate_json(''.join(self.current)).model_dump())
+                    except ValueError:
+                        pass  # Left for the final output to fill in
+                    self.current = None
+        return completed
+
+
+async def stream_questions(
+    topic: str,
+    count: int = 10,
+    difficulty: str = "medium",
+    age_min: int = 8,
+    age_max: int = 16,
+    feedback: str = ""
+):
+    """Generate quiz questions, yielding each one as soon as it is complete"""
+
+    if topic not in TOPICS:
+        raise ValueError(f"Invalid topic: {topic}. Valid topics: {list(TOPICS.keys())}")
+
+    context = GeneratorContext(
+        topic=topic,
+        difficulty=difficulty,
+        count=count,
+        age_min=age_min,
+        age_max=age_max
+    )
+
+    prompt = f"Generate {count} {difficulty} difficulty quiz questions about {TOPICS[topic]['name']} for kids aged {age_min}-{age_max}.{feedback}"
+
+    cache = get_llm_cache()
+    if cache is not None:
+        instructions = build_instructions(SimpleNamespace(context=context), None)
+        cache_key = cache.key(GENERATOR_MODEL, instructions, prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            count_event("llm_cache_hits")
+            for q in question_models().QuestionBatch.model_validate(cached).questions:
+                yield q.model_dump()
+            return
+        if cache.replay:
+            raise LookupError(f"No cached response for {topic} ({difficulty}, {count} questions) in replay mode")
+
+    result = get_runner().run_streamed(
+        get_question_generator(),
+        input=prompt,
+        context=context
+    )
+
+    parser = QuestionStreamParser()
+    yielded = 0
+    started = time.perf_counter()
+    async for event in result.stream_events():
+        if event.type != "raw_response_event" or getattr(event.data, "type", None) != "response.output_text.delta":
+            continue
+        for question in parser.feed(event.data.delta):
+            if not yielded:
+                record_span("agent.first_question", time.perf_counter() - started)
+            yielded += 1
+            yield question
+    record_span("agent.stream", time.perf_counter() - started)
+    count_usage(result)
+
+    output = result.final_output_as(question_models().QuestionBatch)
+    if cache is not None:
+        cache.put(cache_key, output.model_dump())
+
+    # Anything the incremental parser could not validate on its own
+    for q in output.questions[yielded:]:
+        yield q.model_dump()
+
+
+async def generate_questions_batch(cells: list[tuple[str, str, int]], feedback: str = "") -> tuple[dict, int, dict]:
+    """
+    Generate questions for several (topic, difficulty, count) cells in one
+    agent call. Returns ({(topic, difficulty): [valid question, ...]},
+    tokens used, per-rule rejection counts), with tokens 0 when unknown
+    (e.g. a cache hit).
+    """
+    for topic, difficulty, _ in cells:
+        if topic not in TOPICS:
+            raise ValueError(f"Invalid topic: {topic}. Valid topics: {list(TOPICS.keys())}")
+        if difficulty not in DIFFICULTY_AGE_BANDS:
+            raise ValueError(f"Invalid difficulty: {difficulty}")
+
+    context = BatchContext(cells=cells)
+    total = sum(count for _, _, count in cells)
+    prompt = f"Generate {total} quiz questions across {len(cells)} cells.{feedback}"
+
+    cache = get_llm_cache()
+    output = None
+    tokens = 0
+    if cache is not None:
+        instructions = build_batch_instructions(SimpleNamespace(context=context), None)
+        cache_key = cache.key(GENERATOR_MODEL, instructions, prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            count_event("llm_cache_hits")
+            output = question_models().MultiCellBatch.model_validate(cached)
+        elif cache.replay:
+            raise LookupError(f"No cached response for a {len(cells)}-cell batch in replay mode")
+
+    if output is None:
+        with span("agent.batch"):
+            result = await get_runner().run(
+                get_batch_generator(),
+                input=prompt,
+                context=context
+            )
+        count_usage(result)
+        output = result.final_output_as(question_models().MultiCellBatch)
+        usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+        tokens = getattr(usage, "total_tokens", 0) or 0
+        if cache is not None:
+            cache.put(cache_key, output.model_dump())
+
+    requested = {f"{topic}:{difficulty}": (topic, difficulty, count) for topic, difficulty, count in cells}
+    questions = {(topic, difficulty): [] for topic, difficulty, _ in cells}
+    rejected = {}
+    for entry in output.cells:
+        if entry.cell not in requested:
+            continue
+        topic, difficulty, count = requested[entry.cell]
+        bucket = questions[(topic, difficulty)]
+        valid, cell_rejected = validate_questions([q.model_dump() for q in entry.questions], topic, difficulty)
+        bucket.extend(valid[:count - len(bucket)])
+        merge_counts(rejected, cell_rejected)
+
+    return questions, tokens, rejected
+
+
+def normalize_question_topics(questions: list[dict]):
+    """Normalize all topic slugs before saving"""
+    for q in questions:
+        if 'topic' in q:
+            q['topic'] = normalize_topic(q['topic'])
+
+
+def cell_key(topic: str, difficulty: str, age_min: int, age_max: int) -> str:
+    """Counter field name for a topic x difficulty x age band cell"""
+    return f"{topic}:{difficulty}:{age_min}-{age_max}"
+
+
+def counter_increments(questions: list[dict]) -> dict:
+    """$inc document adding a batch of questions to the stats counters"""
+    increments = {"total": len(questions)}
+    for q in questions:
+        field = "cells." + cell_key(q.get('topic'), q.get('difficulty'), q.get('age_min', 8), q.get('age_max', 16))
+        increments[field] = increments.get(field, 0) + 1
+    return increments
+
+
+@timed("save")
+def save_questions_to_db(questions: list[dict], existing: Optional[list] = None) -> int:
+    """
+    Save questions to the configured store, leaving out duplicates (stored
+    copies of exact ones are appended to `existing`)
+    """
+    normalize_question_topics(questions)
+    drop_duplicates(questions, existing)
+    if not questions:
+        return 0
+    return get_question_store().save(questions)
+
+
+@timed("save.async")
+async def save_questions_async(questions: list[dict], existing: Optional[list] = None) -> int:
+    """save_questions_to_db() without blocking the event loop"""
+    normalize_question_topics(questions)
+    await asyncio.to_thread(drop_duplicates, questions, existing)
+    if not questions:
+        return 0
+    return await get_question_store().save_async(questions)
+
+
+def generation_status(accepted: int, count: int) -> dict:
+    """Result status for a generate call that kept `accepted` of `count` questions"""
+    if not accepted:
+        return {"status": "error", "message": "No generated questions passed validation"}
+    return {"status": "success" if accepted >= count else "partial"}
+
+
+async def generate_and_save(
+    topic: str,
+    count: int = 10,
+    difficulty: str = "medium",
+    age_min: Optional[int] = None,
+    age_max: Optional[int] = None
+) -> dict:
+    """
+    Generate questions and save to database. Questions failing validation are
+    replaced by asking again for just the missing count. The age range
+    defaults to the difficulty's age band. Status is "partial" when fewer
+    than `count` questions passed validation and "error" when none did.
+    """
+    age_min, age_max = age_range(difficulty, age_min, age_max)
+
+    questions, rejected, rounds = await generate_valid_questions(
+        topic=topic,
+        count=count,
+        difficulty=difficulty,
+        age_min=age_min,
+        age_max=age_max
+    )
+
+    generated = len(questions)
+    existing = []
+    saved_count = await save_questions_async(questions, existing)
+    count_event("questions_generated", generated)
+    count_event("questions_saved", saved_count)
+
+    return {
+        **generation_status(generated, count),
+        "topic": topic,
+        "difficulty": difficulty,
+        "generated": generated,
+        "saved": saved_count,
+        "duplicates": generated - len(questions),
+        "already_stored": len(existing),
+        "rejected": rejected,
+        "rounds": rounds,
+        # Exact repeats (e.g. an LLM cache replay) come back as their stored copies
+        "questions": questions + existing
+    }
+
+
+async def stream_and_save(
+    topic: str,
+    count: int = 10,
+    difficulty: str = "medium",
+    age_min: Optional[int] = None,
+    age_max: Optional[int] = None,
+    emit=None,
+    save_batch_size: int = STREAM_SAVE_BATCH
+) -> dict:
+    """
+    Generate questions, passing each valid one to `emit` as soon as it is
+    parsed and saving them every `save_batch_size` questions. Rejected
+    questions are replaced by another streamed round for the missing count.
+    Age range and status work as in generate_and_save.
+    """
+    age_min, age_max = age_range(difficulty, age_min, age_max)
+    emit = emit or (lambda question: print(json.dumps({"event": "question", "question": question}), flush=True))
+
+    generated = 0
+    saved = 0
+    kept = []
+    existing = []
+    batch = []
+    rejected = {}
+    rounds = 0
+
+    async def flush():
+        nonlocal saved
+        saved += await save_questions_async(batch, existing)
+        kept.extend(batch)
+        batch.clear()
+
+    while generated < count and rounds < max(1, VALIDATION_ROUNDS):
+        rounds += 1
+        round_rejected = {}
+        received = 0
+        async for question in stream_questions(
+            topic=topic,
+            count=count - generated,
+            difficulty=difficulty,
+            age_min=age_min,
+            age_max=age_max,
+            feedback=rejection_feedback(rejected)
+        ):
+            received += 1
+            valid, failed = validate_questions([question], topic, difficulty, age_min, age_max)
+            merge_counts(round_rejected, failed)
+            if not valid or generated >= count:
+                continue
+
+            generated += 1
+            result = emit(question)
+            if asyncio.iscoroutine(result):
+                await result
+            batch.append(question)
+            if len(batch) >= save_batch_size:
+                await flush()
+
+        merge_counts(rejected, round_rejected)
+        if not received:
+            break  # Asking again for nothing back won't help
+
+    if batch:
+        await flush()
+    count_event("questions_generated", generated)
+    count_event("questions_saved", saved)
+
+    return {
+        **generation_status(generated, count),
+        "topic": topic,
+        "difficulty": difficulty,
+        "generated": generated,
+        "saved": saved,
+        "duplicates": generated - len(kept),
+        "already_stored": len(existing),
+        "rejected": rejected,
+        "rounds": rounds,
+        "questions": kept + existing
+    }
+
+
+# Generations still running after their caller returned, saved when they finish
+_background_tasks: set = set()
+
+
+def _finish_background_task(task: asyncio.Task):
+    """Forget a finished background task and report its failure, if any"""
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background generation failed: {task.exception()}", file=sys.stderr)
+
+
+async def finish_background_tasks():
+    """
+    Let leftover generations finish and save before a CLI run exits. Stdout
+    is pointed at /dev/null first, so whoever reads the answer gets EOF now
+    instead of when the last generation (at most GENERATION_TIMEOUT_MS) ends.
+    """
+    if not _background_tasks:
+        return
+    sys.stdout.flush()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+    await asyncio.gather(*list(_background_tasks), return_exceptions=True)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing upstream. Opens after `threshold` failures in a
+    row, then lets a single trial call through once `cooldown` seconds have
+    passed (half-open), and no other call until that trial has finished.
+    State lives in the process, so it only spans requests under `serve`; each
+    CLI run starts closed.
+    """
+
+    def __init__(self, threshold: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False  # The half-open trial call is in flight
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go through now. In half-open state only the first
+        caller gets True, and must make exactly one call (see `probing`).
+        """
+        state = self.state
+        if state == "open" or self.probing:
+            return False
+        if state == "half-open":
+            self.probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                count_event("breaker_opened")
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """The trial call was cancelled before it finished; let the next caller try"""
+        self.probing = False
+
+
+# Guards live-path generation against a failing or hanging upstream API
+generation_breaker = CircuitBreaker()
+
+
+def quiz_difficulty(age: int) -> str:
+    """Difficulty served to a player of `age`"""
+    if age <= 10:
+        return "easy"
+    if age <= 13:
+        return "medium"
+    return "hard"
+
+
+def relaxation_steps(difficulty: str) -> list[tuple[str, dict]]:
+    """Looser pool filters, tried in order when the exact one comes up short"""
+    order = list(DIFFICULTY_AGE_BANDS)
+    i = order.index(difficulty)
+    adjacent = [d for j, d in enumerate(order) if abs(j - i) == 1]
+    return [
+        ("adjacent_difficulty", {"difficulties": adjacent}),
+        ("any_difficulty", {})
+    ]
+
+
+async def sample_pool(
+    count: int,
+    excluded_ids: list[str],
+    seen: Optional[SeenSet] = None,
+    age: Optional[int] = None,
+    difficulties: Optional[list[str]] = None,
+    selection: str = "random",
+    prefer_topic: Optional[str] = None
+) -> list[dict]:
+    """
+    Pick up to `count` stored questions for an age and/or difficulties,
+    skipping excluded ids and the player's seen set. The pool is sampled in a
+    few fixed-size rounds instead of sending every seen id. With `selection`
+    "least_used" the least served questions are picked first. With
+    `prefer_topic` that topic fills the quiz first and other topics the rest.
+    """
+    if count <= 0:
+        return []
+    rounds = SEEN_SAMPLE_ROUNDS if seen is not None else 1
+
+    store = get_question_store()
+    pick = store.sample_least_used if selection == "least_used" else store.sample
+    selected = []
+    skip = list(excluded_ids)
+    try:
+        for _ in range(rounds):
+            missing = count - len(selected)
+            size = unseen_sample_size(missing, len(skip) - len(excluded_ids), len(selected)) if seen else missing
+            batch = await pick(size, age=age, exclude=skip, difficulties=difficulties, prefer_topic=prefer_topic)
+            if not batch:
+                break
+            skip.extend(q['_id'] for q in batch)
+            selected.extend(q for q in batch if seen is None or q['_id'] not in seen)
+            if len(selected) >= count:
+                break
+    except Exception as e:
+        print(f"DB Error: {e}", file=sys.stderr)
+    return topic_first(selected, prefer_topic)[:count]
+
+
+def topic_first(questions: list[dict], topic: Optional[str]) -> list[dict]:
+    """Questions from `topic` first, keeping the order otherwise"""
+    if topic is None:
+        return questions
+    return sorted(questions, key=lambda q: q.get('topic') != topic)
+
+
+async def generate_fallback(
+    missing: int,
+    difficulty: str,
+    budget: Optional[float] = None,
+    keep_leftovers: bool = False,
+    prefer_topic: Optional[str] = None
+) -> list[dict]:
+    """
+    Generate about `missing` questions across several topics at once,
+    returning once enough are ready or `budget` seconds have passed. Each call
+    has a timeout and feeds the circuit breaker. Generations still running
+    after QUIZ_HEDGE_MS are hedged with a second wave of other topics.
+    With `keep_leftovers` unfinished generations keep running in the
+    background and save when done, otherwise they are cancelled.
+    `prefer_topic` is always in the first wave. While the breaker is probing
+    the upstream (half-open) a single generation is made, without hedging.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    end = started + budget if budget is not None else None
+
+    per_topic = 3
+    topic_count = 1 if generation_breaker.probing else min(len(TOPICS), max(5, -(-missing // per_topic) + 1))
+    topics = random.sample(list(TOPICS.keys()), len(TOPICS))
+    if prefer_topic in TOPICS:
+        topics.remove(prefer_topic)
+        topics.insert(0, prefer_topic)
+    spare = topics[topic_count:]
+    age_min, age_max = DIFFICULTY_AGE_BANDS[difficulty]
+
+    async def generate_topic(topic: str) -> list[dict]:
+        try:
+            # Importing the agents SDK takes seconds, keep it off the loop so the deadline holds
+            await asyncio.wrap_future(agents_warm_up())
+            questions = await asyncio.wait_for(
+                generate_questions(
+                    topic=topic,
+                    count=per_topic,
+                    difficulty=difficulty,
+                    age_min=age_min,
+                    age_max=age_max
+                ),
+                GENERATION_TIMEOUT_MS / 1000
+            )
+        except asyncio.CancelledError:
+            generation_breaker.abandon()
+            raise
+        except Exception:
+            generation_breaker.record_failure()
+            raise
+        generation_breaker.record_success()
+
+        # No regeneration rounds here, the other topics cover any shortfall
+        questions, _ = validate_questions(questions, topic, difficulty, age_min, age_max)
+        existing = []
+        if questions:
+            await save_questions_async(questions, existing)
+        # Exact repeats are served as their stored copies, so answers are recorded against real ids
+        return questions + existing
+
+    tasks = {}
+
+    def launch(wave: list[str]):
+        for topic in wave:
+            tasks[asyncio.create_task(generate_topic(topic))] = topic
+
+    launch(topics[:topic_count])
+    pending = set(tasks)
+    hedge_at = started + QUIZ_HEDGE_MS / 1000 if spare else None
+    all_questions = []
+
+    # Return as soon as enough questions are ready, or the budget runs out
+    with span("quiz.fallback"):
+        while pending and len(all_questions) < missing:
+            now = loop.time()
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if generation_breaker.allow():
+                    count_event("quiz_hedged")
+                    before = set(tasks)
+                    launch(spare[:topic_count])
+                    pending |= set(tasks) - before
+                continue
+
+            waits = [t - now for t in (end, hedge_at) if t is not None]
+            timeout = min(waits) if waits else None
+            if end is not None and timeout <= 0:
+                count_event("quiz_deadline_hit")
+                break
+
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    all_questions.extend(task.result())
+                except Exception as e:
+                    print(f"Error generating for topic {tasks[task]}: {e}", file=sys.stderr)
+
+    # Leftover generations either keep running and save when done, or are cancelled
+    for task in pending:
+        if keep_leftovers:
+            _background_tasks.add(task)
+            task.add_done_callback(_finish_background_task)
+        else:
+            task.cancel()
+
+    return topic_first(all_questions, prefer_topic)[:missing]
+
+
+async def generate_for_quiz_session(
+    age: int,
+    excluded_ids: list[str] = None,
+    count: int = 10,
+    keep_leftovers: bool = False,
+    player: Optional[str] = None,
+    deadline_ms: Optional[int] = None,
+    selection: Optional[str] = None,
+    topic: Optional[str] = None,
+    mixed: bool = False,
+    difficulties: Optional[list[str]] = None
+) -> dict:
+    """
+    Generate questions for a live quiz session.
+    First tries to fetch from file/DB, then generates new ones if needed, and
+    finally relaxes the difficulty step by step to fill what is still missing.
+    With `player`, questions in the player's seen set are skipped.
+    With `deadline_ms` (default QUIZ_DEADLINE_MS, 0 = none) generation is cut
+    off in time to answer with whatever the pool has; the same happens
+    without generating while the circuit breaker is open.
+    `selection` (default QUIZ_SELECTION) picks pool questions at "random" or
+    "least_used" first. Served questions are recorded for the usage flush.
+    With `topic` (ignored when `mixed`) the quiz is filled from that topic
+    first and other topics after. `difficulties` replaces the age filter with
+    a fixed list of allowed difficulties, which is never relaxed.
+    """
+    if topic is not None and topic not in TOPICS:
+        return {"status": "error", "message": f"Invalid topic: {topic}. Valid topics: {list(TOPICS.keys())}"}
+    if difficulties is not None:
+        unknown = [d for d in difficulties if d not in DIFFICULTY_AGE_BANDS]
+        if unknown or not difficulties:
+            return {"status": "error", "message": f"Invalid difficulties: {unknown or difficulties}"}
+
+    loop = asyncio.get_running_loop()
+    selection = selection or QUIZ_SELECTION
+    deadline_ms = QUIZ_DEADLINE_MS if deadline_ms is None else deadline_ms
+    deadline = loop.time() + deadline_ms / 1000 if deadline_ms else None
+
+    def remaining() -> Optional[float]:
+        return None if deadline is None else deadline - loop.time()
+
+    async def within_deadline(coro, fallback):
+        """Await `coro`, giving up with `fallback` at the deadline"""
+        if deadline is None:
+            return await coro
+        try:
+            return await asyncio.wait_for(coro, max(0.0, remaining()))
+        except asyncio.TimeoutError:
+            count_event("quiz_deadline_hit")
+            return fallback
+
+    difficulty = quiz_difficulty(age)
+    if difficulties is not None and difficulty not in difficulties:
+        difficulty = difficulties[-1]
+    prefer_topic = None if mixed else topic
+    pool_filters = {"age": age} if difficulties is None else {"difficulties": difficulties}
+    excluded_ids = excluded_ids or []
+    pool_source = get_question_store().source
+
+    seen = None
+    if player:
+        try:
+            seen = await within_deadline(asyncio.to_thread(load_seen_set, player), None)
+        except Exception as e:
+            print(f"Seen set not loaded for {player}: {e}", file=sys.stderr)
+
+    selected = await within_deadline(
+        sample_pool(count, excluded_ids, seen, selection=selection, prefer_topic=prefer_topic, **pool_filters),
+        []
+    )
+    if len(selected) >= count:
+        count_event(f"quiz_served_{pool_source}")
+        record_usage(q['_id'] for q in selected[:count])
+        result = {
+            "status": "success",
+            "source": pool_source,
+            "questions": selected[:count]
+        }
+        if prefer_topic is not None and selected[count - 1].get('topic') != prefer_topic:
+            result["degraded"] = ["other_topics"]
+        return result
+
+    # Not enough questions, generate new ones for several topics at once
+    degraded = []
+    generated = []
+    budget = remaining()
+    if budget is not None:
+        budget -= QUIZ_RELAX_RESERVE_MS / 1000
+    if budget is not None and budget <= 0:
+        degraded.append("deadline")
+    elif not generation_breaker.allow():
+        degraded.append("circuit_open")
+    else:
+        generated = await generate_fallback(count - len(selected), difficulty, budget, keep_leftovers, prefer_topic)
+        if deadline is not None and loop.time() >= deadline - QUIZ_RELAX_RESERVE_MS / 1000 and len(selected) + len(generated) < count:
+            degraded.append("deadline")
+    selected.extend(generated)
+
+    # Still short: serve what the pool has, relaxing the difficulty step by step
+    for step, filters in relaxation_steps(difficulty) if difficulties is None else []:
+        if len(selected) >= count:
+            break
+        if deadline is not None and remaining() <= 0:
+            break
+        taken = excluded_ids + [str(q['_id']) for q in selected if '_id' in q]
+        more = await within_deadline(
+            sample_pool(count - len(selected), taken, seen, selection=selection, prefer_topic=prefer_topic, **filters),
+            []
+        )
+        if more:
+            degraded.append(step)
+            selected.extend(more)
+
+    if prefer_topic is not None and any(q.get('topic') != prefer_topic for q in selected[:count]):
+        degraded.append("other_topics")
+
+    if not selected:
+        return {
+            "status": "error",
+            "message": "Could not generate questions",
+            "degraded": degraded
+        }
+
+    source = "generated" if generated else pool_source
+    count_event(f"quiz_served_{source}")
+    record_usage(q['_id'] for q in selected[:count] if '_id' in q)
+    result = {
+        "status": "success",
+        "source": source,
+        "questions": selected[:count]
+    }
+    if degraded:
+        count_event("quiz_degraded")
+        result["degraded"] = degraded
+    if len(selected) < count:
+        result["partial"] = True
+    return result
+
+
+def list_topics():
+    """List all available topics"""
+    return TOPICS
+
+
+def stats_from_cells(cell_counts: dict, storage: str) -> dict:
+    """Build the stats report from per-(topic, difficulty, age_min, age_max) counts"""
+    stats = {
+        "total_questions": sum(cell_counts.values()),
+        "storage": storage,
+        "by_topic": {topic: 0 for topic in TOPICS},
+        "by_difficulty": {diff: 0 for diff in DIFFICULTY_AGE_BANDS},
+        "by_cell": {}
+    }
+
+    for (topic, difficulty, age_min, age_max), n in cell_counts.items():
+        if topic in stats["by_topic"]:
+            stats["by_topic"][topic] += n
+        if difficulty in stats["by_difficulty"]:
+            stats["by_difficulty"][difficulty] += n
+        band = f"{age_min}-{age_max}"
+        by_band = stats["by_cell"].setdefault(topic, {}).setdefault(difficulty, {})
+        by_band[band] = by_band.get(band, 0) + n
+
+    return stats
+
+
+def aggregate_cell_counts(db, match_filter: Optional[dict] = None) -> dict:
+    """Count questions (matching `match_filter`) per cell in a single aggregation round trip"""
+    pipeline = [{"$match": match_filter}] if match_filter else []
+    pipeline += [
+        {"$group": {
+            "_id": {
+                "topic": "$topic",
+                "difficulty": "$difficulty",
+                "age_min": {"$ifNull": ["$age_min", 8]},
+                "age_max": {"$ifNull": ["$age_max", 16]}
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+    return {
+        (row["_id"]["topic"], row["_id"]["difficulty"], row["_id"]["age_min"], row["_id"]["age_max"]): row["count"]
+        for row in db.questions.aggregate(pipeline)
+    }
+
+
+def read_stats_counters(db) -> Optional[dict]:
+    """Per-cell counts from the counters document, or None if it doesn't exist"""
+    doc = db.stats.find_one({"_id": STATS_COUNTERS_ID})
+    if doc is None:
+        return None
+
+    cell_counts = {}
+    for key, n in doc.get("cells", {}).items():
+        topic, difficulty, band = key.split(":")
+        age_min, age_max = band.split("-")
+        cell_counts[(topic, difficulty, int(age_min), int(age_max))] = n
+    return cell_counts
+
+
+def rebuild_stats_counters() -> dict:
+    """Recompute the counters document from the collection (after deletes or first enabling)"""
+    db = get_db_connection()
+    cell_counts = aggregate_cell_counts(db)
+    db.stats.replace_one(
+        {"_id": STATS_COUNTERS_ID},
+        {
+            "total": sum(cell_counts.values()),
+            "cells": {cell_key(*key): n for key, n in cell_counts.items()}
+        },
+        upsert=True
+    )
+    return stats_from_cells(cell_counts, "mongodb")
+
+
+def get_stats():
+    """Get database/file statistics"""
+    store = get_question_store()
+    try:
+        return stats_from_cells(store.cell_counts(), store.name)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+class RateLimiter:
+    """Token bucket allowing up to `per_minute` units to be spent per minute"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1):
+        """Wait until `amount` units are available, then spend them"""
+        if self.capacity <= 0:
+            return
+        amount = min(amount, self.capacity)
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveBatchSizer:
+    """
+    Questions per multi-cell generation call. Grows by a quarter after calls
+    that come back complete and within the latency target, halves after slow
+    or lossy ones, and is capped by the measured seconds and tokens per
+    question.
+    """
+
+    def __init__(
+        self,
+        initial: int = BATCH_INITIAL_QUESTIONS,
+        maximum: int = BATCH_MAX_QUESTIONS,
+        minimum: int = 1,
+        target_latency: float = BATCH_TARGET_LATENCY,
+        max_tokens: int = BATCH_MAX_TOKENS,
+        max_failure_rate: float = BATCH_MAX_FAILURE_RATE
+    ):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.size = max(minimum, min(initial, self.maximum))
+        self.target_latency = target_latency
+        self.max_tokens = max_tokens
+        self.max_failure_rate = max_failure_rate
+        self.seconds_per_question: Optional[float] = None
+        self.tokens_per_question: Optional[float] = None
+        self.failure_rate = 0.0
+
+    @staticmethod
+    def smooth(previous: Optional[float], value: float) -> float:
+        return value if previous is None else 0.7 * previous + 0.3 * value
+
+    def record(self, requested: int, received: int, latency: float, tokens: int = 0):
+        """Update the estimates with one finished call and resize"""
+        failure = 1 - received / requested if requested else 0.0
+        self.failure_rate = self.smooth(self.failure_rate, failure)
+        if received:
+            self.seconds_per_question = self.smooth(self.seconds_per_question, latency / received)
+            if tokens:
+                # Spread the fixed prompt over the batch so the cap stays conservative
+                self.tokens_per_question = self.smooth(self.tokens_per_question, tokens / received)
+
+        # Judge failures on the smoothed rate so a few bad questions don't halve the batch
+        if self.failure_rate > self.max_failure_rate or latency > self.target_latency:
+            size = self.size // 2
+        else:
+            size = self.size + max(1, self.size // 4)
+
+        if self.seconds_per_question:
+            size = min(size, int(self.target_latency / self.seconds_per_question))
+        if self.tokens_per_question and self.max_tokens:
+            size = min(size, int(self.max_tokens / self.tokens_per_question))
+        self.size = max(self.minimum, min(self.maximum, size))
+
+    def estimate_tokens(self, count: int) -> int:
+        """Tokens a call for `count` questions is expected to use"""
+        if self.tokens_per_question:
+            return int(count * self.tokens_per_question)
+        return estimate_tokens(count)
+
+
+def estimate_tokens(count: int) -> int:
+    """Estimate the total tokens one generation call for `count` questions uses"""
+    return PROMPT_TOKEN_ESTIMATE + count * TOKENS_PER_QUESTION_ESTIMATE
+
+
+def emit_progress(event: str, **fields):
+    """Print a machine-readable progress line"""
+    print(json.dumps({"event": event, **fields}, default=str), flush=True)
+
+
+async def run_generation_jobs(
+    jobs: list[tuple[str, str, int]],
+    concurrency: int = 8,
+    requests_per_minute: float = 0,
+    tokens_per_minute: float = 0,
+    retries: int = 3,
+    backoff: float = 2.0
+) -> dict:
+    """
+    Run (topic, difficulty, count) generations on one event loop.
+    At most `concurrency` generations run at once, and each call waits on the
+    request and token limiters (0 disables a limiter). Failed jobs are retried
+    with exponential backoff and jitter.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    request_limiter = RateLimiter(requests_per_minute)
+    token_limiter = RateLimiter(tokens_per_minute)
+
+    started = time.monotonic()
+    progress = {"completed": 0, "failed": 0, "saved": 0}
+    rejected = {}
+
+    async def run_job(topic: str, difficulty: str, count: int):
+        age_min, age_max = DIFFICULTY_AGE_BANDS[difficulty]
+
+        for attempt in range(1, retries + 2):
+            async with semaphore:
+                await request_limiter.acquire()
+                await token_limiter.acquire(estimate_tokens(count))
+                try:
+                    result = await generate_and_save(
+                        topic=topic,
+                        count=count,
+                        difficulty=difficulty,
+                        age_min=age_min,
+                        age_max=age_max
+                    )
+                    error = RuntimeError(result["message"]) if result["status"] == "error" else None
+                except Exception as e:
+                    error = e
+
+            if error is None:
+                progress["completed"] += 1
+                progress["saved"] += result.get("saved", 0)
+                merge_counts(rejected, result.get("rejected", {}))
+                elapsed = time.monotonic() - started
+                emit_progress(
+                    "saved",
+                    topic=topic,
+                    difficulty=difficulty,
+                    saved=result.get("saved", 0),
+                    attempt=attempt,
+                    completed=progress["completed"],
+                    failed=progress["failed"],
+                    total=len(jobs),
+                    elapsed=round(elapsed, 2),
+                    questions_per_sec=round(progress["saved"] / elapsed, 3) if elapsed else 0
+                )
+                return
+
+            if attempt > retries:
+                progress["failed"] += 1
+                emit_progress(
+                    "failed",
+                    topic=topic,
+                    difficulty=difficulty,
+                    attempt=attempt,
+                    error=str(error),
+                    completed=progress["completed"],
+                    failed=progress["failed"],
+                    total=len(jobs)
+                )
+                return
+
+            delay = backoff * (2 ** (attempt - 1)) * (0.5 + random.random())
+            emit_progress(
+                "retry",
+                topic=topic,
+                difficulty=difficulty,
+                attempt=attempt,
+                error=str(error),
+                retry_in=round(delay, 2)
+            )
+            await asyncio.sleep(delay)
+
+    await asyncio.gather(*(run_job(topic, difficulty, count) for topic, difficulty, count in jobs))
+
+    elapsed = time.monotonic() - started
+    return {
+        "total_saved": progress["saved"],
+        "completed": progress["completed"],
+        "failed": progress["failed"],
+        "total": len(jobs),
+        "rejected": rejected,
+        "elapsed": round(elapsed, 2),
+        "questions_per_sec": round(progress["saved"] / elapsed, 3) if elapsed else 0
+    }
+
+
+async def run_batched_generation_jobs(
+    jobs: list[tuple[str, str, int]],
+    concurrency: int = 8,
+    requests_per_minute: float = 0,
+    tokens_per_minute: float = 0,
+    retries: int = 3,
+    backoff: float = 2.0,
+    sizer: Optional[AdaptiveBatchSizer] = None
+) -> dict:
+    """
+    Like run_generation_jobs, but packs several cells into each agent call.
+    Jobs for the same cell are merged, calls are sized by an
+    AdaptiveBatchSizer, and questions missing from a call are requeued for
+    the next one until they run out of retries.
+    """
+    sizer = sizer or AdaptiveBatchSizer()
+    request_limiter = RateLimiter(requests_per_minute)
+    token_limiter = RateLimiter(tokens_per_minute)
+
+    wanted = {}
+    for topic, difficulty, count in jobs:
+        wanted[(topic, difficulty)] = wanted.get((topic, difficulty), 0) + count
+    # [topic, difficulty, remaining, attempt]
+    pending = [[topic, difficulty, count, 1] for (topic, difficulty), count in wanted.items() if count > 0]
+
+    condition = asyncio.Condition()
+    in_flight = 0
+    started = time.monotonic()
+    progress = {"completed": 0, "failed": 0, "saved": 0, "calls": 0}
+    rejected = {}
+    saved_per_cell = {cell: 0 for cell in wanted}
+
+    # Pieces of each cell still queued or in flight, and cells that gave up
+    open_pieces = {cell: 1 for cell in wanted}
+    failed_cells = {}
+
+    def take_batch() -> list[list]:
+        """
+        Pop up to sizer.size questions' worth of cells, splitting the last one.
+        Pieces of the same cell (the rest of a split cell and a requeued retry)
+        are merged, since a call's results come back keyed by cell.
+        """
+        batch = {}  # (topic, difficulty) -> piece
+        room = sizer.size
+        while pending and room > 0:
+            job = pending[0]
+            cell = (job[0], job[1])
+            if job[2] <= room:
+                piece = pending.pop(0)
+            else:
+                piece = [job[0], job[1], room, job[3]]
+                open_pieces[cell] += 1
+                job[2] -= room
+            room -= piece[2]
+
+            if cell in batch:
+                # The merged piece keeps the lower attempt so fresh questions get every retry
+                batch[cell][2] += piece[2]
+                batch[cell][3] = min(batch[cell][3], piece[3])
+                open_pieces[cell] -= 1
+            else:
+                batch[cell] = piece
+        return list(batch.values())
+
+    def close_piece(topic: str, difficulty: str):
+        """Report a cell once its last piece is done"""
+        cell = (topic, difficulty)
+        open_pieces[cell] -= 1
+        if open_pieces[cell]:
+            return
+
+        if cell in failed_cells:
+            progress["failed"] += 1
+            emit_progress(
+                "failed",
+                topic=topic,
+                difficulty=difficulty,
+                error=failed_cells[cell],
+                completed=progress["completed"],
+                failed=progress["failed"],
+                total=len(wanted)
+            )
+            return
+
+        progress["completed"] += 1
+        elapsed = time.monotonic() - started
+        emit_progress(
+            "saved",
+            topic=topic,
+            difficulty=difficulty,
+            saved=saved_per_cell[cell],
+            completed=progress["completed"],
+            failed=progress["failed"],
+            total=len(wanted),
+            elapsed=round(elapsed, 2),
+            questions_per_sec=round(progress["saved"] / elapsed, 3) if elapsed else 0
+        )
+
+    async def run_batch(batch: list[list]) -> list[list]:
+        """Generate and save one batch, returning the pieces to retry"""
+        requested = sum(job[2] for job in batch)
+        await request_limiter.acquire()
+        await token_limiter.acquire(sizer.estimate_tokens(requested))
+
+        call_started = time.monotonic()
+        # Retried pieces tell the model what went wrong before
+        feedback = rejection_feedback(rejected) if any(job[3] > 1 for job in batch) else ""
+        try:
+            results, tokens, batch_rejected = await generate_questions_batch(
+                [(job[0], job[1], job[2]) for job in batch],
+                feedback=feedback
+            )
+            error = None
+        except Exception as e:
+            results, tokens, batch_rejected, error = {}, 0, {}, e
+        merge_counts(rejected, batch_rejected)
+        latency = time.monotonic() - call_started
+
+        received = sum(len(questions) for questions in results.values())
+        questions = [q for cell_questions in results.values() for q in cell_questions]
+        existing = []
+        saved = await save_questions_async(questions, existing) if questions else 0
+        for q in questions:
+            saved_per_cell[(q['topic'], q['difficulty'])] += 1
+        progress["saved"] += saved
+        progress["calls"] += 1
+
+        previous_size = sizer.size
+        sizer.record(requested, received, latency, tokens)
+        emit_progress(
+            "batch",
+            cells=len(batch),
+            requested=requested,
+            received=received,
+            saved=saved,
+            already_stored=len(existing),
+            latency=round(latency, 2),
+            tokens=tokens,
+            batch_size=previous_size,
+            next_batch_size=sizer.size,
+            rejected=batch_rejected,
+            error=str(error) if error else None
+        )
+
+        retry = []
+        for topic, difficulty, count, attempt in batch:
+            missing = count - len(results.get((topic, difficulty), []))
+            if missing > 0 and attempt <= retries:
+                retry.append([topic, difficulty, missing, attempt + 1])
+                continue
+            if missing > 0:
+                failed_cells[(topic, difficulty)] = str(error) if error else f"{missing} questions missing"
+            close_piece(topic, difficulty)
+
+        if retry and error is not None:
+            attempt = max(job[3] for job in retry) - 1
+            await asyncio.sleep(backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+        return retry
+
+    async def worker():
+        nonlocal in_flight
+        while True:
+            async with condition:
+                await condition.wait_for(lambda: pending or not in_flight)
+                if not pending:
+                    return
+                batch = take_batch()
+                in_flight += 1
+
+            retry = []
+            try:
+                retry = await run_batch(batch)
+            finally:
+                async with condition:
+                    in_flight -= 1
+                    pending.extend(retry)
+                    condition.notify_all()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    elapsed = time.monotonic() - started
+    return {
+        "total_saved": progress["saved"],
+        "completed": progress["completed"],
+        "failed": progress["failed"],
+        "total": len(wanted),
+        "calls": progress["calls"],
+        "batch_size": sizer.size,
+        "rejected": rejected,
+        "elapsed": round(elapsed, 2),
+        "questions_per_sec": round(progress["saved"] / elapsed, 3) if elapsed else 0
+    }
+
+
+async def seed_all(
+    count: int = 10,
+    concurrency: int = 8,
+    requests_per_minute: float = 0,
+    tokens_per_minute: float = 0,
+    retries: int = 3,
+    backoff: float = 2.0,
+    batched: bool = BATCH_GENERATION
+) -> dict:
+    """Seed every topic x difficulty cell with `count` questions"""
+    jobs = [(topic, difficulty, count) for topic in TOPICS for difficulty in DIFFICULTY_AGE_BANDS]
+
+    emit_progress("start", cells=len(jobs), count=count, concurrency=concurrency, batched=batched)
+    run_jobs = run_batched_generation_jobs if batched else run_generation_jobs
+    summary = await run_jobs(
+        jobs,
+        concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        retries=retries,
+        backoff=backoff
+    )
+    emit_progress("done", **summary)
+    return summary
+
+
+def inventory_counts(max_used: int) -> dict:
+    """Questions per (topic, difficulty) served at most `max_used` times"""
+    inventory = {}
+    for (topic, difficulty, _, _), n in get_question_store().cell_counts(max_used=max_used).items():
+        inventory[(topic, difficulty)] = inventory.get((topic, difficulty), 0) + n
+    return inventory
+
+
+async def replenish_once(
+    low: int = REPLENISH_LOW_WATERMARK,
+    high: int = REPLENISH_HIGH_WATERMARK,
+    max_used: int = REPLENISH_MAX_USED,
+    batch_size: int = 10,
+    concurrency: int = 4,
+    requests_per_minute: float = 0,
+    tokens_per_minute: float = 0,
+    retries: int = 3,
+    batched: bool = BATCH_GENERATION
+) -> dict:
+    """
+    Top up every topic x difficulty cell whose fresh inventory is below the
+    low watermark back to the high watermark, generating only the deficit.
+    """
+    inventory = await asyncio.to_thread(inventory_counts, max_used)
+
+    jobs = []
+    cells_low = 0
+    for topic in TOPICS:
+        for difficulty in DIFFICULTY_AGE_BANDS:
+            have = inventory.get((topic, difficulty), 0)
+            if have >= low:
+                continue
+
+            cells_low += 1
+            deficit = high - have
+            emit_progress(
+                "decision",
+                topic=topic,
+                difficulty=difficulty,
+                inventory=have,
+                low=low,
+                high=high,
+                generate=deficit
+            )
+            for start in range(0, deficit, batch_size):
+                jobs.append((topic, difficulty, min(batch_size, deficit - start)))
+
+    cells = len(TOPICS) * len(DIFFICULTY_AGE_BANDS)
+    summary = {"cells": cells, "cells_low": cells_low, "cells_ok": cells - cells_low, "jobs": len(jobs)}
+    if jobs:
+        run_jobs = run_batched_generation_jobs if batched else run_generation_jobs
+        summary.update(await run_jobs(
+            jobs,
+            concurrency=concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            retries=retries
+        ))
+    emit_progress("replenished", **summary)
+    return summary
+
+
+async def replenish(interval: float = 0, **options):
+    """Run replenish_once, then repeat every `interval` seconds (once if 0)"""
+    while True:
+        try:
+            await replenish_once(**options)
+        except Exception as e:
+            if interval <= 0:
+                raise
+            emit_progress("error", error=str(e))
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
+
+
+async def dispatch_request(request: dict, emit=None):
+    """
+    Run a single daemon request and return its result. Streaming commands
+    pass partial results to `emit` first.
+    """
+    command = request.get("command")
+    args = request.get("args") or {}
+
+    if command == "stream":
+        return await stream_and_save(
+            topic=args["topic"],
+            count=int(args.get("count", 10)),
+            difficulty=args.get("difficulty", "medium"),
+            age_min=int(args["age_min"]) if args.get("age_min") is not None else None,
+            age_max=int(args["age_max"]) if args.get("age_max") is not None else None,
+            emit=emit
+        )
+
+    if command == "generate":
+        return await generate_and_save(
+            topic=args["topic"],
+            count=int(args.get("count", 10)),
+            difficulty=args.get("difficulty", "medium"),
+            age_min=int(args["age_min"]) if args.get("age_min") is not None else None,
+            age_max=int(args["age_max"]) if args.get("age_max") is not None else None
+        )
+
+    if command == "quiz":
+        return await generate_for_quiz_session(
+            age=int(args["age"]),
+            excluded_ids=args.get("exclude") or [],
+            count=int(args.get("count", 10)),
+            keep_leftovers=True,
+            player=args.get("player"),
+            deadline_ms=int(args["deadline_ms"]) if args.get("deadline_ms") is not None else None,
+            selection=args.get("selection"),
+            topic=args.get("topic"),
+            mixed=bool(args.get("mixed")),
+            difficulties=args.get("difficulties")
+        )
+
+    if command == "usage":
+        # Questions served elsewhere (e.g. the PHP API), counted at the next flush
+        return {"status": "success", "pending": record_usage(args.get("ids") or [])}
+
+    if command == "seen":
+        return await asyncio.to_thread(record_seen, args["player"], args.get("add") or [])
+
+    if command == "leaderboard":
+        return await asyncio.to_thread(
+            leaderboard_query,
+            int(args["top"]) if args.get("top") else None,
+            args.get("player"),
+            int(args["points"]) if args.get("points") is not None else None,
+            int(args["age"]) if args.get("age") is not None else None
+        )
+
+    if command == "stats":
+        # get_stats is blocking, keep it off the event loop
+        return await asyncio.to_thread(get_stats)
+
+    if command == "topics":
+        return list_topics()
+
+    if command == "metrics":
+        return metrics_registry.render()
+
+    if command == "ping":
+        return {"status": "ok"}
+
+    raise ValueError(f"Unknown command: {command}")
+
+
+async def write_metrics_file(path: str, interval: float):
+    """Rewrite `path` with the OpenMetrics exposition every `interval` seconds"""
+    while True:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(metrics_registry.render(openmetrics=True))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Metrics file not written: {e}", file=sys.stderr)
+        await asyncio.sleep(interval)
+
+
+async def handle_metrics_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Minimal HTTP endpoint answering GET /metrics for Prometheus scrapes"""
+    try:
+        request_line = (await reader.readline()).decode(errors="replace").split()
+        while (await reader.readline()).strip():
+            pass  # Headers are not needed
+
+        if len(request_line) >= 2 and request_line[0] == "GET" and request_line[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", metrics_registry.render()
+        else:
+            status, body = "404 Not Found", "Not found\n"
+
+        payload = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(
+    socket_path: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    max_concurrency: int = 32,
+    replenish_interval: float = 0,
+    metrics_file: Optional[str] = None,
+    metrics_interval: float = 15,
+    metrics_port: Optional[int] = None
+):
+    """
+    Run a long-lived generator daemon speaking JSON lines.
+    Each request line is {"id": ..., "command": ..., "args": {...}} and gets
+    back {"id": ..., "result": ...} or {"id": ..., "error": ...}. Requests on a
+    connection run concurrently, so responses may arrive out of order.
+    Metrics are served in Prometheus text format on `metrics_port` (/metrics)
+    and/or rewritten as an OpenMetrics file every `metrics_interval` seconds.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        write_lock = asyncio.Lock()
+        pending = set()
+
+        async def send(response: dict):
+            with span("json.serialize"):
+                line = json.dumps(response, default=str) + "\n"
+            async with write_lock:
+                writer.write(line.encode())
+                await writer.drain()
+
+        async def respond(request: dict):
+            response = {"id": request.get("id")}
+
+            async def emit(question: dict):
+                try:
+                    await send({"id": request.get("id"), "event": "question", "question": question})
+                except ConnectionError:
+                    pass
+
+            with collect_metrics(str(request.get("command"))) as record:
+                try:
+                    async with semaphore:
+                        response["result"] = await dispatch_request(request, emit=emit)
+                except Exception as e:
+                    response["error"] = str(e)
+                    count_event("request_errors")
+                if request.get("profile"):
+                    response["metrics"] = record.to_dict()
+                try:
+                    await send(response)
+                except ConnectionError:
+                    pass
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request must be a JSON object")
+                except ValueError as e:
+                    await send({"id": None, "error": f"Invalid request: {e}"})
+                    continue
+
+                task = asyncio.create_task(respond(request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    # Warm up the shared DB client and the agents before the first request arrives
+    get_question_store().warm_up()
+    warm_up_agents()
+
+    # Allow long exclude lists on a single line
+    limit = 4 * 1024 * 1024
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(handle_client, path=socket_path, limit=limit)
+        address = {"socket": socket_path}
+    else:
+        server = await asyncio.start_server(handle_client, host, port, limit=limit)
+        address = {"host": host, "port": port}
+
+    print(json.dumps({"status": "listening", **address}), flush=True)
+
+    # Keep the pool stocked in the background so the quiz fallback rarely fires
+    background = []
+    if replenish_interval > 0:
+        background.append(asyncio.create_task(replenish(interval=replenish_interval)))
+    if metrics_file:
+        background.append(asyncio.create_task(write_metrics_file(metrics_file, metrics_interval)))
+    if USAGE_TRACKING:
+        background.append(asyncio.create_task(flush_usage_periodically(USAGE_FLUSH_INTERVAL)))
+    metrics_server = None
+    if metrics_port:
+        metrics_server = await asyncio.start_server(handle_metrics_http, host, metrics_port)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.to_thread(flush_usage)
+        if metrics_server is not None:
+            metrics_server.close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def print_json(result, **kwargs):
+    """Print a command result as JSON, timing the serialization"""
+    with span("json.serialize"):
+        text = json.dumps(result, default=str, **kwargs)
+    print(text, flush=True)
+
+
+def write_profile(record: MetricsRecord, destination: str):
+    """Write a --profile record as one JSON line to stderr ("-") or a file"""
+    line = json.dumps({"event": "profile", **record.to_dict()})
+    if destination == "-":
+        print(line, file=sys.stderr, flush=True)
+    else:
+        with open(destination, 'a') as f:
+            f.write(line + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fun Quiz Question Generator")
+    parser.add_argument("--profile", action="store_true", help="Write a JSON metrics record of this run to stderr")
+    parser.add_argument("--profile-file", metavar="PATH", help="Append the --profile record to PATH instead of stderr")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    # Generate command
+    gen_parser = subparsers.add_parser("generate", help="Generate questions for a topic")
+    gen_parser.add_argument("--topic", required=True, help="Topic slug")
+    gen_parser.add_argument("--count", type=int, default=10, help="Number of questions")
+    gen_parser.add_argument("--difficulty", default="medium", choices=["easy", "medium", "hard"])
+    gen_parser.add_argument("--age-min", type=int, help="Youngest age (default: the difficulty's age band)")
+    gen_parser.add_argument("--age-max", type=int, help="Oldest age (default: the difficulty's age band)")
+    gen_parser.add_argument("--stream", "--stream-first", dest="stream", action="store_true", help="Print each question as a JSON line as soon as it is generated")
+
+    # Quiz session command
+    quiz_parser = subparsers.add_parser("quiz", help="Get questions for a quiz session")
+    quiz_parser.add_argument("--age", type=int, required=True, help="Player's age")
+    quiz_parser.add_argument("--count", type=int, default=10, help="Number of questions")
+    quiz_parser.add_argument("--exclude", nargs="*", default=[], help="Question IDs to exclude")
+    quiz_parser.add_argument("--player", help="Skip questions in this player's seen set")
+    quiz_parser.add_argument("--deadline-ms", type=int, help="Answer within this many ms, serving the pool if generation is too slow")
+    quiz_parser.add_argument("--selection", choices=["random", "least_used"], help="Pool selection (default QUIZ_SELECTION)")
+    quiz_parser.add_argument("--topic", help="Fill the quiz from this topic first, other topics after")
+    quiz_parser.add_argument("--mixed", action="store_true", help="Any topic (ignores --topic)")
+    quiz_parser.add_argument("--difficulties", nargs="+", choices=["easy", "medium", "hard"], help="Allowed difficulties instead of the age filter")
+
+    # Seen command - record questions a player has answered
+    seen_parser = subparsers.add_parser("seen", help="Record questions a player has seen")
+    seen_parser.add_argument("--player", required=True, help="Player name or id")
+    seen_parser.add_argument("--add", nargs="+", required=True, help="Question IDs the player answered")
+
+    # Leaderboard command - record a submission and read the top players and a player's rank
+    leaderboard_parser = subparsers.add_parser("leaderboard", help="Update and query the leaderboard")
+    leaderboard_parser.add_argument("--top", type=int, help="Return the K best players")
+    leaderboard_parser.add_argument("--player", help="Return this player's entry and rank")
+    leaderboard_parser.add_argument("--points", type=int, help="Add these points and one game to --player first")
+    leaderboard_parser.add_argument("--age", type=int, help="Player's age, stored with --points")
+
+    # List topics command
+    subparsers.add_parser("topics", help="List all available topics")
+
+    # Stats command
+    stats_parser = subparsers.add_parser("stats", help="Show database statistics")
+    stats_parser.add_argument("--rebuild-counters", action="store_true", help="Recompute the stats counters document")
+
+    # Dedup command - find duplicates in the stored corpus
+    dedup_parser = subparsers.add_parser("dedup", help="Find exact and near-duplicate questions")
+    dedup_parser.add_argument("--apply", action="store_true", help="Delete the duplicates found")
+
+    # Backfill command - random keys and indexes for random-key sampling
+    subparsers.add_parser("backfill-keys", help="Add random_key to existing questions and create sampling indexes")
+
+    # Indexes command - create, verify and audit the questions indexes
+    indexes_parser = subparsers.add_parser("indexes", help="Create the questions indexes and explain the quiz/stats queries")
+    indexes_parser.add_argument("--audit-only", action="store_true", help="Only verify indexes and explain queries, create nothing")
+    indexes_parser.add_argument("--age", type=int, default=11, help="Player age used in the audited queries")
+
+    # Compact command - rewrite the file store with one record per question
+    subparsers.add_parser("compact", help="Compact the file-storage question and leaderboard logs")
+
+    # Seed command - generate initial questions for all topics
+    seed_parser = subparsers.add_parser("seed", help="Seed database with initial questions")
+    seed_parser.add_argument("--count", type=int, default=10, help="Questions per topic per difficulty")
+    seed_parser.add_argument("--concurrency", type=int, default=8, help="Generations running at once")
+    seed_parser.add_argument("--rpm", type=float, default=0, help="Max LLM requests per minute (0 = unlimited)")
+    seed_parser.add_argument("--tpm", type=float, default=0, help="Max estimated LLM tokens per minute (0 = unlimited)")
+    seed_parser.add_argument("--retries", type=int, default=3, help="Retries per cell with exponential backoff")
+    seed_parser.add_argument("--no-batch", dest="batched", action="store_false", default=BATCH_GENERATION, help="One agent call per cell instead of multi-cell batches")
+
+    # Serve command - long-lived daemon speaking JSON lines
+    serve_parser = subparsers.add_parser("serve", help="Run as a daemon on a Unix socket or TCP port")
+    serve_parser.add_argument("--socket", help="Unix socket path (overrides --host/--port)")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="TCP host to bind")
+    serve_parser.add_argument("--port", type=int, default=8765, help="TCP port to bind")
+    serve_parser.add_argument("--max-concurrency", type=int, default=32, help="Maximum requests handled at once")
+    serve_parser.add_argument("--replenish-interval", type=float, default=0, help="Seconds between background replenish runs (0 = off)")
+    serve_parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port at /metrics")
+    serve_parser.add_argument("--metrics-file", help="Rewrite this OpenMetrics file periodically")
+    serve_parser.add_argument("--metrics-interval", type=float, default=15, help="Seconds between metrics file writes")
+
+    # Export / import commands - JSONL snapshots of the question corpus
+    export_parser = subparsers.add_parser("export", help="Stream all questions to a JSONL snapshot")
+    export_parser.add_argument("--output", default="-", help="Snapshot path, - for stdout (.gz is gzipped)")
+    export_parser.add_argument("--gzip", action="store_true", default=None, help="Gzip the snapshot")
+    export_parser.add_argument("--chunk-size", type=int, default=1000, help="Questions read per batch")
+
+    import_parser = subparsers.add_parser("import", help="Load questions from a JSONL snapshot")
+    import_parser.add_argument("path", help="Snapshot path (plain or gzipped), - for stdin")
+    import_parser.add_argument("--chunk-size", type=int, default=1000, help="Questions written per batch")
+    import_parser.add_argument("--mode", choices=["upsert", "insert"], default="upsert", help="Bulk upserts keyed by content hash, or unordered inserts")
+    import_parser.add_argument("--checkpoint", help="Checkpoint file (default: <path>.checkpoint)")
+    import_parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and start from the top")
+
+    # Replenish command - keep every cell stocked between watermarks
+    replenish_parser = subparsers.add_parser("replenish", help="Generate questions for cells below the low watermark")
+    replenish_parser.add_argument("--low", type=int, default=REPLENISH_LOW_WATERMARK, help="Refill cells with fewer fresh questions than this")
+    replenish_parser.add_argument("--high", type=int, default=REPLENISH_HIGH_WATERMARK, help="Refill up to this many fresh questions")
+    replenish_parser.add_argument("--max-used", type=int, default=REPLENISH_MAX_USED, help="Questions served more often don't count as stock")
+    replenish_parser.add_argument("--batch-size", type=int, default=10, help="Questions per generation call with --no-batch")
+    replenish_parser.add_argument("--concurrency", type=int, default=4, help="Generations running at once")
+    replenish_parser.add_argument("--rpm", type=float, default=0, help="Max LLM requests per minute (0 = unlimited)")
+    replenish_parser.add_argument("--tpm", type=float, default=0, help="Max estimated LLM tokens per minute (0 = unlimited)")
+    replenish_parser.add_argument("--retries", type=int, default=3, help="Retries per generation with exponential backoff")
+    replenish_parser.add_argument("--no-batch", dest="batched", action="store_false", default=BATCH_GENERATION, help="One agent call per cell instead of multi-cell batches")
+    replenish_parser.add_argument("--interval", type=float, default=0, help="Repeat every N seconds (0 = run once)")
+
+    args = parser.parse_args()
+
+    if not (args.profile or args.profile_file):
+        run_command(args, parser)
+        return
+
+    with collect_metrics(args.command or "help") as record:
+        run_command(args, parser)
+    write_profile(record, args.profile_file or "-")
+
+
+def run_command(args, parser):
+    """Run the parsed CLI command"""
+    if args.command == "generate" and args.stream:
+        result = asyncio.run(stream_and_save(
+            topic=args.topic,
+            count=args.count,
+            difficulty=args.difficulty,
+            age_min=args.age_min,
+            age_max=args.age_max
+        ))
+        # The questions were already streamed, finish with a one-line summary
+        result.pop("questions")
+        print_json({"event": "done", **result})
+        if result["status"] == "error":
+            sys.exit(1)
+
+    elif args.command == "generate":
+        result = asyncio.run(generate_and_save(
+            topic=args.topic,
+            count=args.count,
+            difficulty=args.difficulty,
+            age_min=args.age_min,
+            age_max=args.age_max
+        ))
+        print_json(result, indent=2)
+        if result["status"] == "error":
+            sys.exit(1)
+
+    elif args.command == "quiz":
+        async def quiz():
+            result = await generate_for_quiz_session(
+                age=args.age,
+                excluded_ids=args.exclude,
+                count=args.count,
+                keep_leftovers=True,
+                player=args.player,
+                deadline_ms=args.deadline_ms,
+                selection=args.selection,
+                topic=args.topic,
+                mixed=args.mixed,
+                difficulties=args.difficulties
+            )
+            await asyncio.to_thread(flush_usage)
+            print_json(result, indent=2)
+            # The questions were paid for, answer first and then save them
+            await finish_background_tasks()
+
+        asyncio.run(quiz())
+
+    elif args.command == "leaderboard":
+        if args.points is not None and args.player is None:
+            parser.error("--points needs --player")
+        print_json(leaderboard_query(args.top, args.player, args.points, args.age), indent=2)
+
+    elif args.command == "seen":
+        print_json(record_seen(args.player, args.add), indent=2)
+
+    elif args.command == "topics":
+        print_json(list_topics(), indent=2)
+
+    elif args.command == "stats":
+        if args.rebuild_counters:
+            print_json(rebuild_stats_counters(), indent=2)
+        else:
+            print_json(get_stats(), indent=2)
+
+    elif args.command == "dedup":
+        print_json(dedup_corpus(apply=args.apply), indent=2)
+
+    elif args.command == "backfill-keys":
+        print_json(backfill_random_keys(), indent=2)
+
+    elif args.command == "indexes":
+        result = manage_indexes(audit_only=args.audit_only, age=args.age)
+        print_json(result, indent=2)
+        if result["status"] != "success":
+            sys.exit(1)
+
+    elif args.command == "compact":
+        print_json({**compact_question_store(), "leaderboard": compact_leaderboard()}, indent=2)
+
+    elif args.command == "seed":
+        asyncio.run(seed_all(
+            count=args.count,
+            concurrency=args.concurrency,
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+            retries=args.retries,
+            batched=args.batched
+        ))
+
+    elif args.command == "export":
+        result = export_questions(path=args.output, chunk_size=args.chunk_size, compress=args.gzip)
+        if args.output != "-":
+            print_json(result, indent=2)
+
+    elif args.command == "import":
+        print_json(import_questions(
+            path=args.path,
+            chunk_size=args.chunk_size,
+            mode=args.mode,
+            checkpoint=args.checkpoint,
+            resume=not args.restart
+        ), indent=2)
+
+    elif args.command == "replenish":
+        try:
+            asyncio.run(replenish(
+                interval=args.interval,
+                low=args.low,
+                high=args.high,
+                max_used=args.max_used,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                requests_per_minute=args.rpm,
+                tokens_per_minute=args.tpm,
+                retries=args.retries,
+                batched=args.batched
+            ))
+        except KeyboardInterrupt:
+            pass
+
+    elif args.command == "serve":
+        try:
+            asyncio.run(serve(
+                socket_path=args.socket,
+                host=args.host,
+                port=args.port,
+                max_concurrency=args.max_concurrency,
+                replenish_interval=args.replenish_interval,
+                metrics_file=args.metrics_file,
+                metrics_interval=args.metrics_interval,
+                metrics_port=args.metrics_port
+            ))
+        except KeyboardInterrupt:
+            pass
+
+    else:
+        parser.print_help()
+
+
+def __getattr__(name: str):
+    """Expose the lazily built schemas and agents as module attributes"""
+    if name in ("QuizQuestion", "QuestionBatch", "CellQuestions", "MultiCellBatch"):
+        return getattr(question_models(), name)
+    if name == "question_generator":
+        return get_question_generator()
+    if name == "batch_generator":
+        return get_batch_generator()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
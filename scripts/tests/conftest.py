@@ -0,0 +1,60 @@
+"""
+Shared fixtures: every test gets its own QUESTIONS_DIR and fresh store
+singletons, and `store` runs a test once per storage backend
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quiz_generator as qg  # noqa: E402
+
+BACKENDS = ["file", "sqlite", "mongodb"]
+
+
+@pytest.fixture(autouse=True)
+def questions_dir(tmp_path, monkeypatch):
+    """A private, empty question store directory with no cached stores"""
+    monkeypatch.setattr(qg, "QUESTIONS_DIR", str(tmp_path))
+    monkeypatch.setattr(qg, "SQLITE_PATH", None)
+    monkeypatch.setattr(qg, "LLM_CACHE_MODE", "off")
+    monkeypatch.setattr(qg, "_question_catalogue", None)
+    monkeypatch.setattr(qg, "_sqlite_store", None)
+    monkeypatch.setattr(qg, "_leaderboard", None)
+    monkeypatch.setattr(qg, "generation_breaker", qg.CircuitBreaker())
+    return tmp_path
+
+
+def use_backend(monkeypatch, backend: str):
+    """Point get_question_store() and get_leaderboard() at `backend`"""
+    monkeypatch.setattr(qg, "USE_FILE_STORAGE", backend == "file")
+    monkeypatch.setattr(qg, "STORAGE_BACKEND", backend)
+    if backend == "mongodb":
+        mongomock = pytest.importorskip("mongomock")
+        import mongomock.collection
+
+        # pymongo passes sort= to bulk updates, which mongomock does not know
+        add_update = mongomock.collection.BulkOperationBuilder.add_update
+        monkeypatch.setattr(
+            mongomock.collection.BulkOperationBuilder,
+            "add_update",
+            lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+        )
+        monkeypatch.setattr(qg, "_mongo_client", mongomock.MongoClient())
+        monkeypatch.setattr(qg, "AsyncMongoClient", None)
+    return qg.get_question_store()
+
+
+@pytest.fixture(params=BACKENDS)
+def store(request, monkeypatch):
+    """The question store of each backend in turn"""
+    return use_backend(monkeypatch, request.param)
+
+
+@pytest.fixture
+def file_storage(monkeypatch):
+    """The file question store, for tests of file-only behaviour"""
+    return use_backend(monkeypatch, "file")
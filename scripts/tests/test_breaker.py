@@ -0,0 +1,80 @@
+import pytest
+
+import quiz_generator as qg
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock the test moves by hand"""
+    now = [1000.0]
+    monkeypatch.setattr(qg.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    return qg.CircuitBreaker(threshold=3, cooldown=30)
+
+
+def test_opens_after_threshold_failures_in_a_row(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_half_open_lets_a_single_probe_through(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 30
+    assert breaker.state == "half-open"
+
+    assert breaker.allow()
+    assert breaker.probing
+    assert not breaker.allow()
+
+
+def test_failed_probe_reopens_for_another_cooldown(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+
+
+def test_successful_probe_closes(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_abandoned_probe_lets_the_next_caller_try(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+
+    breaker.abandon()
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+import quiz_generator as qg
+from benchmarks.fakes import FakeRunner, synthetic_question
+
+
+def dispatch(request: dict, emit=None):
+    return asyncio.run(qg.dispatch_request(request, emit))
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    """A fake agent runner answering at once"""
+    runner = FakeRunner(latency_ms=0, jitter_ms=0)
+    monkeypatch.setattr(qg, "Runner", runner)
+    return runner
+
+
+def test_ping_and_topics():
+    assert dispatch({"command": "ping"}) == {"status": "ok"}
+    assert dispatch({"command": "topics"}) == qg.TOPICS
+
+
+def test_stats(store):
+    store.save([synthetic_question(n, "sports", "hard") for n in range(4)])
+    stats = dispatch({"command": "stats"})
+    assert (stats["total_questions"], stats["storage"]) == (4, store.name)
+    assert stats["by_topic"]["sports"] == 4
+
+
+def test_unknown_command():
+    with pytest.raises(ValueError, match="Unknown command"):
+        dispatch({"command": "nope"})
+
+
+def test_quiz_from_the_stored_pool(store):
+    store.save([synthetic_question(n, "sports", "easy") for n in range(20)])
+    ids = [str(q["_id"]) for chunk in store.iter_chunks() for q in chunk]
+
+    result = dispatch({"command": "quiz", "args": {"age": 9, "count": 5, "exclude": ids[:10]}})
+    assert result["source"] == store.source
+    assert len(result["questions"]) == 5
+    assert not {q["_id"] for q in result["questions"]} & set(ids[:10])
+
+
+def test_seen_then_quiz_skips_seen_questions(store):
+    store.save([synthetic_question(n, "sports", "easy") for n in range(12)])
+    ids = [str(q["_id"]) for chunk in store.iter_chunks() for q in chunk]
+
+    assert dispatch({"command": "seen", "args": {"player": "asha", "add": ids[:8]}})["added"] == 8
+    result = dispatch({"command": "quiz", "args": {"age": 9, "count": 4, "player": "asha"}})
+    assert {q["_id"] for q in result["questions"]} == set(ids[8:])
+
+
+def test_leaderboard_and_usage(store):
+    dispatch({"command": "leaderboard", "args": {"player": "asha", "points": 70, "age": 11}})
+    result = dispatch({"command": "leaderboard", "args": {"player": "asha", "points": 5, "top": 5}})
+    assert result["player"]["score"] == 75
+    assert [row["name"] for row in result["top"]] == ["asha"]
+
+    assert dispatch({"command": "usage", "args": {"ids": ["a", "b"]}})["status"] == "success"
+
+
+def test_generate_saves_and_reports_counts(store, runner):
+    result = dispatch({"command": "generate", "args": {"topic": "sports", "count": 3, "difficulty": "easy"}})
+    assert (result["status"], result["generated"], result["saved"]) == ("success", 3, 3)
+    assert store.cell_counts() == {("sports", "easy", 8, 10): 3}
+
+
+def test_stream_emits_each_question(store, runner):
+    emitted = []
+    result = dispatch(
+        {"command": "stream", "args": {"topic": "geography", "count": 3, "difficulty": "medium"}},
+        emitted.append
+    )
+    assert result["status"] == "success"
+    assert len(emitted) == 3
+    assert {q["topic"] for q in emitted} == {"geography"}
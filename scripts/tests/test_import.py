@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+import quiz_generator as qg
+from benchmarks.fakes import synthetic_question
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    """A 23-line snapshot: 22 questions and one invalid line"""
+    path = tmp_path / "snapshot.jsonl"
+    lines = [json.dumps(synthetic_question(n, "sports", "easy")) for n in range(22)]
+    lines.insert(7, json.dumps({"question": "No options"}))
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_import_then_reimport(store, snapshot):
+    result = qg.import_questions(snapshot, chunk_size=5)
+    assert (result["inserted"], result["existing"], result["invalid"]) == (22, 0, 1)
+    assert not os.path.exists(snapshot + ".checkpoint")
+
+    again = qg.import_questions(snapshot, chunk_size=5)
+    assert (again["inserted"], again["existing"]) == (0, 22)
+    assert store.cell_counts() == {("sports", "easy", 8, 10): 22}
+
+
+def test_resume_keeps_totals(store, snapshot, monkeypatch):
+    writer = store.import_writer("upsert")
+    calls = []
+
+    def failing_writer(mode):
+        def write(records):
+            calls.append(len(records))
+            if len(calls) == 3:
+                raise RuntimeError("interrupted")
+            return writer(records)
+        return write
+
+    with monkeypatch.context() as patch:
+        patch.setattr(type(store), "import_writer", lambda self, mode: failing_writer(mode))
+        with pytest.raises(RuntimeError):
+            qg.import_questions(snapshot, chunk_size=5)
+
+    # Two chunks made it, covering 11 lines (one of them invalid)
+    with open(snapshot + ".checkpoint") as f:
+        state = json.load(f)
+    assert (state["lines"], state["inserted"], state["invalid"]) == (11, 10, 1)
+
+    result = qg.import_questions(snapshot, chunk_size=5)
+    assert result["resumed_from"] == 11
+    assert (result["inserted"], result["existing"], result["invalid"]) == (22, 0, 1)
+    assert store.cell_counts() == {("sports", "easy", 8, 10): 22}
+
+
+def test_export_round_trip(store, tmp_path):
+    store.save([synthetic_question(n, "geography", "medium") for n in range(12)])
+    path = str(tmp_path / "export.jsonl.gz")
+
+    assert qg.export_questions(path, chunk_size=5)["exported"] == 12
+    with qg.open_snapshot(path, "r") as f:
+        records = [qg.snapshot_record(line) for line in f]
+    assert {q["content_hash"] for q in records} == {q["content_hash"] for chunk in store.iter_chunks() for q in chunk}
@@ -0,0 +1,67 @@
+import json
+import random
+from bisect import bisect_left, insort
+
+import quiz_generator as qg
+
+
+def test_sorted_keys_matches_a_sorted_list():
+    rng = random.Random(7)
+    keys = qg.SortedKeys(load=4)
+    expected = []
+    for step in range(3000):
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            expected.remove(key)
+            keys.remove(key)
+        else:
+            key = (-rng.randrange(200), f"p{rng.randrange(10 ** 6)}")
+            if key in expected:
+                continue
+            insort(expected, key)
+            keys.add(key)
+
+        if step % 10 == 0:
+            probe = (-rng.randrange(200), "")
+            assert keys.index(probe) == bisect_left(expected, probe)
+            assert keys.first(7) == expected[:7]
+            assert len(keys) == len(expected)
+
+
+def test_ranks_share_ties(store):
+    board = qg.get_leaderboard()
+    board.submit("asha", 50, age=10)
+    board.submit("ravi", 80, age=11)
+    board.submit("meena", 50, age=9)
+    board.submit("asha", 30, age=10)
+
+    assert [(row["name"], row["score"], row["rank"]) for row in board.top(3)] == [
+        ("asha", 80, 1), ("ravi", 80, 1), ("meena", 50, 3)
+    ]
+    assert board.rank("meena")["rank"] == 3
+    assert board.rank("asha")["games"] == 2
+    assert board.rank("nobody") is None
+    assert board.players() == 3
+
+
+def test_file_log_compacts_to_one_line_per_player(file_storage, questions_dir, monkeypatch):
+    monkeypatch.setattr(qg, "LEADERBOARD_COMPACT_LINES", 20)
+    (questions_dir / qg.LEADERBOARD_FILE).write_text(json.dumps([{"name": "old", "score": 500, "games": 5}]))
+
+    board = qg.get_leaderboard()
+    expected = {"old": 500}
+    for i in range(60):
+        name = f"p{i % 4}"
+        board.submit(name, i, age=10)
+        expected[name] = expected.get(name, 0) + i
+
+    log = (questions_dir / qg.LEADERBOARD_LOG).read_text().splitlines()
+    assert len(log) < 20
+    assert {row["name"]: row["score"] for row in board.top(10)} == expected
+
+    # A new process replays the legacy totals and the compacted log
+    monkeypatch.setattr(qg, "_leaderboard", None)
+    assert {row["name"]: row["score"] for row in qg.get_leaderboard().top(10)} == expected
+    assert qg.get_leaderboard().rank("p0")["games"] == 15
+
+    assert qg.compact_leaderboard() == {"status": "success", "records_before": len(log), "players": 4}
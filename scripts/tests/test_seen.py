@@ -0,0 +1,76 @@
+import quiz_generator as qg
+
+
+def test_add_reports_new_ids():
+    seen = qg.SeenSet(capacity=100, error_rate=0.01)
+    assert seen.add("q1")
+    assert not seen.add("q1")
+    assert "q1" in seen
+    assert "q2" not in seen
+
+
+def test_rotation_forgets_the_oldest_generation():
+    seen = qg.SeenSet(capacity=50, error_rate=0.001)
+    for i in range(50):
+        seen.add(f"a{i}")
+    size = len(seen.current)
+
+    # Filling the next filter moves the first one to `previous`
+    for i in range(50):
+        seen.add(f"b{i}")
+    assert all(f"a{i}" in seen for i in range(50))
+
+    # A second rotation drops it
+    for i in range(50):
+        seen.add(f"c{i}")
+    assert sum(f"a{i}" in seen for i in range(50)) <= 2
+    assert all(f"c{i}" in seen for i in range(50))
+    assert len(seen.current) == len(seen.previous) == size
+
+
+def test_false_positive_rate_holds():
+    seen = qg.SeenSet(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        seen.add(f"q{i}")
+    false_positives = sum(f"other{i}" in seen for i in range(10000))
+    assert false_positives < 300
+
+
+def test_doc_round_trip():
+    seen = qg.SeenSet(capacity=20, error_rate=0.01)
+    for i in range(30):
+        seen.add(f"q{i}")
+
+    loaded = qg.SeenSet.from_doc(seen.to_doc(), 20, 0.01)
+    assert loaded.count == seen.count
+    assert loaded.older is None
+    assert all(f"q{i}" in loaded for i in range(30))
+
+
+def test_new_settings_rebuild_and_keep_old_filters_until_rotation():
+    seen = qg.SeenSet(capacity=20, error_rate=0.01)
+    for i in range(20):
+        seen.add(f"q{i}")
+
+    rebuilt = qg.SeenSet.from_doc(seen.to_doc(), 100, 0.001)
+    assert (rebuilt.capacity, rebuilt.error_rate, rebuilt.count) == (100, 0.001, 0)
+    assert all(f"q{i}" in rebuilt for i in range(20))
+
+    # Still there after a save and load at the new settings
+    reloaded = qg.SeenSet.from_doc(rebuilt.to_doc(), 100, 0.001)
+    assert reloaded.older is not None
+    assert all(f"q{i}" in reloaded for i in range(20))
+
+    # Some new ids look seen in the small old filter, so add more than capacity
+    for i in range(150):
+        reloaded.add(f"n{i}")
+    assert reloaded.older is None
+
+
+def test_record_seen(store):
+    result = qg.record_seen("asha", ["a", "b"])
+    assert result["added"] == 2
+    assert qg.record_seen("asha", ["b", "c"])["added"] == 1
+
+    seen = qg.load_seen_set("asha")
+    assert all(question_id in seen for question_id in "abc")
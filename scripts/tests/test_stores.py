@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+import quiz_generator as qg
+from benchmarks.fakes import synthetic_question
+
+
+def questions(n: int, topic: str = "sports", difficulty: str = "easy", start: int = 0) -> list[dict]:
+    return [synthetic_question(start + i, topic, difficulty) for i in range(n)]
+
+
+def stored(store) -> list[dict]:
+    return [q for chunk in store.iter_chunks(100) for q in chunk]
+
+
+def test_save_stamps_and_counts_cells(store):
+    assert store.save(questions(4) + questions(3, "geography", "hard", start=4)) == 7
+
+    saved = stored(store)
+    assert len(saved) == 7
+    for q in saved:
+        assert q["used_count"] == 0
+        assert q["content_hash"] == qg.content_hash(q)
+        if store.name != "file":
+            # The file catalogue samples in memory without random keys
+            assert 0 <= q["random_key"] < 1
+
+    assert store.cell_counts() == {
+        ("sports", "easy", 8, 10): 4,
+        ("geography", "hard", 14, 16): 3
+    }
+
+
+def test_sample_filters(store):
+    store.save(questions(10) + questions(10, "geography", "medium", start=10))
+    ids = [str(q["_id"]) for q in stored(store)]
+
+    picked = asyncio.run(store.sample(5, difficulties=["easy"]))
+    assert len(picked) == 5
+    assert {q["difficulty"] for q in picked} == {"easy"}
+    assert all(isinstance(q["_id"], str) for q in picked)
+    assert len({q["_id"] for q in picked}) == 5
+
+    excluded = set(ids[:15])
+    rest = asyncio.run(store.sample(20, exclude=list(excluded)))
+    assert {q["_id"] for q in rest} == set(ids) - excluded
+
+    assert asyncio.run(store.sample(5, age=15)) == []
+    assert {q["topic"] for q in asyncio.run(store.sample(20, topics=["geography"]))} == {"geography"}
+
+
+def test_sample_prefers_topic(store):
+    if store.name == "mongodb":
+        pytest.skip("mongomock has no $unionWith")
+    store.save(questions(3) + questions(10, "geography", start=3))
+
+    picked = asyncio.run(store.sample(6, prefer_topic="sports"))
+    assert [q["topic"] for q in picked[:3]] == ["sports"] * 3
+    assert len(picked) == 6
+
+
+def test_least_used_first(store):
+    store.save(questions(6))
+    ids = [str(q["_id"]) for q in stored(store)]
+    store.record_usage({question_id: 2 for question_id in ids[:4]})
+
+    picked = asyncio.run(store.sample_least_used(2))
+    assert {q["_id"] for q in picked} == set(ids[4:])
+    assert store.cell_counts(max_used=1) == {("sports", "easy", 8, 10): 2}
+
+
+def test_iter_questions_by_topic(store):
+    store.save(questions(2) + questions(3, "geography", start=2))
+    assert len(list(store.iter_questions({"geography"}))) == 3
+    assert len(list(store.iter_questions())) == 5
+
+
+def test_delete_reports_real_deletions(store):
+    store.save(questions(3))
+    ids = [q["_id"] for q in stored(store)]
+    missing = "000000000000000000000000" if store.name == "mongodb" else "missing"
+
+    assert store.delete([ids[0], missing]) == 1
+    assert len(stored(store)) == 2
+
+
+def test_exact_repeats_come_back_stored(store):
+    batch = questions(3)
+    qg.save_questions_to_db([dict(q) for q in batch])
+
+    existing = []
+    repeat = [dict(q) for q in batch] + questions(1, start=3)
+    assert qg.save_questions_to_db(repeat, existing) == 1
+    assert len(existing) == 3
+    assert len(stored(store)) == 4
+
+
+def test_seen_doc_round_trip(store):
+    assert store.load_seen_doc("asha") is None
+
+    calls = []
+
+    def update(doc):
+        calls.append(doc)
+        return {"count": (doc or {}).get("count", 0) + 1}
+
+    store.update_seen_doc("asha", update)
+    store.update_seen_doc("asha", update)
+    assert calls[0] is None
+    assert store.load_seen_doc("asha")["count"] == 2
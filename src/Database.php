@@ -7,6 +7,9 @@ use Dotenv\Dotenv;
 
 class Database
 {
+    // Documents read per random_key seek, as in quiz_generator.py
+    private const SAMPLE_SEEK_SIZE = 3;
+
     private static ?Database $instance = null;
     private static ?MongoDBClient $client = null;
     private static bool $envLoaded = false;
@@ -176,9 +179,69 @@ class Database
     }
 
     /**
-     * Get random documents using $sample
+     * Get random documents by seeking to several random points of the random_key
+     * index, SAMPLE_SEEK_SIZE documents per seek, so picks are not one contiguous
+     * run of keys. A second round tops up when seeks overlapped. Falls back to
+     * $sample when documents have no random_key yet (run
+     * `quiz_generator.py backfill-keys`).
      */
     public function random(string $collection, int $count, array $match = []): array
+    {
+        if ($count <= 0) {
+            return [];
+        }
+
+        $picked = [];
+        for ($round = 0; $round < 2; $round++) {
+            $missing = $count - count($picked);
+            $seeks = max(1, (int) ceil($missing / self::SAMPLE_SEEK_SIZE));
+            $perSeek = (int) ceil($missing / $seeks);
+
+            for ($i = 0; $i < $seeks; $i++) {
+                foreach ($this->seek($collection, $perSeek, $match) as $document) {
+                    if (!isset($picked[$document['_id']])) {
+                        $picked[$document['_id']] = $document;
+                    }
+                }
+            }
+
+            if (count($picked) >= $count) {
+                $results = array_slice(array_values($picked), 0, $count);
+                shuffle($results);
+                return $results;
+            }
+            if (empty($picked)) {
+                break;
+            }
+        }
+
+        return $this->sample($collection, $count, $match);
+    }
+
+    /**
+     * Read `limit` documents in random_key order from a random point, wrapping
+     * around to the start when the seek runs off the end
+     */
+    private function seek(string $collection, int $limit, array $match): array
+    {
+        $pivot = mt_rand() / mt_getrandmax();
+        $options = ['sort' => ['random_key' => 1], 'limit' => $limit];
+
+        $results = $this->find($collection, $match + ['random_key' => ['$gte' => $pivot]], $options);
+
+        if (count($results) < $limit) {
+            $options['limit'] = $limit - count($results);
+            $more = $this->find($collection, $match + ['random_key' => ['$lt' => $pivot]], $options);
+            $results = array_merge($results, $more);
+        }
+
+        return $results;
+    }
+
+    /**
+     * Get random documents using $sample
+     */
+    public function sample(string $collection, int $count, array $match = []): array
     {
         $pipeline = [];
 